@@ -0,0 +1,351 @@
+#/usr/bin/python3
+'''
+Reproducible benchmarks for the MachineApp. Run from the server directory:
+
+    python3 benchmark.py [cycle|notifier|iomonitor|all] [--output results.json]
+
+Results are printed (or written to --output) as JSON so that they can be compared
+between releases:
+
+    cycle:      MachineAppEngine from machine_app.py, run end to end against the fake
+                MachineMotion with simulated pneumatics, outputs and sensors.
+                Reports sheets per hour and state transition latency. With --virtual,
+                the cycle runs on a VirtualClock: dwells and actuations take no wall time
+                and the report is computed in machine time.
+    notifier:   Notifier throughput and delivery latency with N local websocket clients.
+    iomonitor:  IOMonitor MQTT messages handled per second with M monitored pins.
+
+Besides this tree, the benchmarks need the packages of requirements.txt and the runtime
+modules of the MachineApp template (internal.interprocess_message, internal.mqtt_topic_subscriber).
+A benchmark whose modules are missing is reported as skipped. The IO drivers (pneumatic,
+digital_out) only exist on the MachineMotion: simulated ones are used when they are missing.
+'''
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+import types
+from internal.clock import getClock, setClock, VirtualClock
+
+# Modules each benchmark needs that are not part of this tree
+REQUIRED_MODULES = {
+    "cycle":        ['paho', 'websockets', 'internal.interprocess_message', 'internal.mqtt_topic_subscriber'],
+    "notifier":     ['websockets', 'internal.interprocess_message'],
+    "iomonitor":    ['websockets', 'internal.interprocess_message']
+}
+
+def findMissingModules(benchmark):
+    ''' Returns the modules required by a benchmark that cannot be imported '''
+    missing = []
+    for name in REQUIRED_MODULES[benchmark]:
+        try:
+            if importlib.util.find_spec(name) == None:
+                missing.append(name)
+        except ImportError:
+            missing.append(name)
+    return missing
+
+class SimulatedPneumatic:
+    ''' Stands in for pneumatic.Pneumatic. Every actuation takes ACTUATION_SECONDS. '''
+    ACTUATION_SECONDS = 0.05
+
+    def __init__(self, name, ipAddress, networkId, pushPin, pullPin):
+        self.name = name
+        self.state = 'released'
+
+    def push(self):
+        getClock().sleep(SimulatedPneumatic.ACTUATION_SECONDS)
+        self.state = 'pushed'
+
+    def pull(self):
+        getClock().sleep(SimulatedPneumatic.ACTUATION_SECONDS)
+        self.state = 'pulled'
+
+    def release(self):
+        getClock().sleep(SimulatedPneumatic.ACTUATION_SECONDS)
+        self.state = 'released'
+
+class SimulatedDigitalOut:
+    ''' Stands in for digital_out.Digital_Out '''
+
+    def __init__(self, name, ipAddress, networkId, pin):
+        self.name = name
+        self.state = 0
+
+    def high(self):
+        self.state = 1
+
+    def low(self):
+        self.state = 0
+
+class SimulatedSensor:
+    ''' Stands in for sensor.Sensor. Edges are produced by calling 'trigger'. '''
+
+    class timeoutException(Exception):
+        pass
+
+    def __init__(self, name, ipAddress, networkId, pin):
+        self.name = name
+        self.state = 0
+        self.__condition = threading.Condition()
+        self.__onRisingEdge = None
+
+    def getState(self):
+        return self.state
+
+    def register_on_rising_edge(self, cb):
+        self.__onRisingEdge = cb
+
+    def trigger(self, value):
+        with self.__condition:
+            isRisingEdge = value == 1 and self.state != 1
+            self.state = value
+            self.__condition.notify_all()
+        if isRisingEdge and self.__onRisingEdge != None:
+            self.__onRisingEdge()
+
+    def wait_for_rising_edge(self, timeout = None):
+        self.__wait_for(1, timeout)
+
+    def wait_for_falling_edge(self, timeout = None):
+        self.__wait_for(0, timeout)
+
+    def __wait_for(self, value, timeout):
+        with self.__condition:
+            if not getClock().waitCondition(self.__condition, lambda: self.state == value, timeout):
+                raise self.timeoutException("simulated timeout {}".format(self.name))
+
+def installSimulatedDrivers():
+    '''
+    Makes the simulated IO drivers importable as pneumatic and digital_out when the real
+    ones are not installed, so that machine_app can be imported.
+    '''
+    for moduleName, className, simulatedClass in (('pneumatic', 'Pneumatic', SimulatedPneumatic), ('digital_out', 'Digital_Out', SimulatedDigitalOut)):
+        if not moduleName in sys.modules and importlib.util.find_spec(moduleName) == None:
+            module = types.ModuleType(moduleName)
+            setattr(module, className, simulatedClass)
+            sys.modules[moduleName] = module
+
+def benchmarkCycle(sheets, length, virtual=False):
+    '''
+    Cuts 'sheets' sheets of 'length' with the MachineAppEngine of machine_app.py.
+    '''
+    if virtual:
+        setClock(VirtualClock())
+
+    from env import env
+    env.IS_DEVELOPMENT = True       # Makes machine_app use the fake MachineMotion
+    installSimulatedDrivers()
+    import machine_app
+
+    machine_app.Pneumatic = SimulatedPneumatic
+    machine_app.Digital_Out = SimulatedDigitalOut
+    machine_app.Sensor = SimulatedSensor
+
+    engine = machine_app.MachineAppEngine()
+    engine.PROFILE_REPORT_INTERVAL_SECONDS = None
+    engine.JOURNAL_DIRECTORY = None
+    engine.LOG_FILE = None
+    engine.METRICS_PORT = None
+    engine.STOP_WHEN_QUEUE_EMPTY = True
+
+    startTime = engine.clock.monotonic()
+    wallStartTime = time.perf_counter()
+    engine.loop(False, { "Length": length, "Num_of_sheets": sheets })   # Returns once every sheet is cut
+    wallSeconds = time.perf_counter() - wallStartTime
+    elapsedSeconds = engine.clock.monotonic() - startTime
+
+    timings = engine.getStateTimings()
+    return {
+        "sheets": sheets,
+        "length": length,
+        "virtual": virtual,
+        "elapsedSeconds": elapsedSeconds,
+        "wallSeconds": wallSeconds,
+        "sheetsPerHour": sheets * 3600.0 / elapsedSeconds,
+        "transitionLatency": {state: phases["transitionLatency"] for state, phases in timings.items() if "transitionLatency" in phases},
+        "timeInState": {state: phases["inState"] for state, phases in timings.items() if "inState" in phases}
+    }
+
+def benchmarkNotifier(numClients, numMessages, port, encoding='json'):
+    '''
+    Broadcasts 'numMessages' notifications to 'numClients' local websocket clients, which
+    connect with the provided encoding (see wire_format.Encoding).
+    '''
+    import websockets
+    from internal.notifier import Notifier
+    from internal.profiler import LatencyHistogram
+    from internal.wire_format import Encoding, PackedDecoder
+
+    notifier = Notifier(ip='127.0.0.1', port=port)
+    latencies = LatencyHistogram()
+    received = [0]
+    receivedBytes = [0]
+    connected = threading.Event()
+
+    async def client(connectedClients):
+        uri = 'ws://127.0.0.1:{}/?encoding={}'.format(port, encoding)
+        decoder = PackedDecoder()
+        for attempt in range(50):       # The server starts on its own thread: retry until it is up
+            try:
+                websocket = await websockets.connect(uri)
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError('Unable to connect to the notifier on {}'.format(uri))
+
+        connectedClients.append(websocket)
+        if len(connectedClients) == numClients:
+            connected.set()
+
+        try:
+            while True:
+                frame = await asyncio.wait_for(websocket.recv(), 2)
+                receivedBytes[0] += len(frame)
+                message = decoder.decode(frame) if encoding == Encoding.PACKED else json.loads(frame)
+                if message == None:     # Packed definition frame
+                    continue
+                latencies.record(time.time() - message["timeSeconds"])
+                received[0] += 1
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await websocket.close()
+
+    def runClients():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        connectedClients = []
+        loop.run_until_complete(asyncio.gather(*[client(connectedClients) for _ in range(numClients)]))
+        loop.close()
+
+    clientThread = threading.Thread(name='BenchmarkClients', target=runClients)
+    clientThread.start()
+    connected.wait(10)
+    while len(notifier.clients) < numClients:
+        time.sleep(0.01)
+
+    startTime = time.perf_counter()
+    for i in range(numMessages):
+        notifier.sendMessage('io_state', '', { "isInput": True, "device": 1, "pin": i % 8, "value": i % 2 })
+    while received[0] < numMessages * numClients and clientThread.is_alive():
+        time.sleep(0.001)
+    elapsedSeconds = time.perf_counter() - startTime
+
+    clientStats = notifier.getClientStats()
+    clientThread.join()
+    notifier.setDead()
+
+    return {
+        "clients": numClients,
+        "messages": numMessages,
+        "encoding": encoding,
+        "bytesPerMessage": receivedBytes[0] / max(received[0], 1),
+        "delivered": received[0],
+        "elapsedSeconds": elapsedSeconds,
+        "deliveriesPerSecond": received[0] / elapsedSeconds,
+        "latencySeconds": latencies.getSummary(),
+        "clientStats": clientStats
+    }
+
+def benchmarkIOMonitor(numPins, numMessages, conflationWindowSeconds=0):
+    '''
+    Feeds 'numMessages' MQTT messages, spread over 'numPins' monitored pins, to an IOMonitor
+    with the provided conflation window.
+    Notifications are counted instead of being sent to the parent process.
+    '''
+    import internal.io_monitor as io_monitor
+
+    class SimulatedMachineMotion:
+        def __init__(self):
+            self.callbacks = []
+
+        def addMqttCallback(self, callback):
+            self.callbacks.append(callback)
+
+    notifications = [0]
+    def countNotification(level, message, customPayload=None):
+        notifications[0] += 1
+    io_monitor.sendNotification = countNotification
+
+    machineMotion = SimulatedMachineMotion()
+    monitor = io_monitor.IOMonitor(machineMotion, conflationWindowSeconds)
+    topics = []
+    for pin in range(numPins):
+        device, devicePin = pin // 4 + 1, pin % 4
+        monitor.startMonitoring('Pin {}'.format(pin), True, device, devicePin)
+        topics.append('devices/io-expander/{}/digital-input/{}'.format(device, devicePin))
+
+    callback = machineMotion.callbacks[0]
+    startTime = time.perf_counter()
+    for i in range(numMessages):
+        callback(topics[i % numPins], str((i // numPins) % 2))
+    elapsedSeconds = time.perf_counter() - startTime
+    monitor.close()
+
+    return {
+        "pins": numPins,
+        "messages": numMessages,
+        "conflationWindowSeconds": conflationWindowSeconds,
+        "notifications": notifications[0],
+        "elapsedSeconds": elapsedSeconds,
+        "messagesPerSecond": numMessages / elapsedSeconds,
+        "monitorStats": monitor.getStats()
+    }
+
+def run():
+    parser = argparse.ArgumentParser(description='MachineApp benchmarks')
+    parser.add_argument('benchmark', nargs='?', default='all', choices=['cycle', 'notifier', 'iomonitor', 'all'])
+    parser.add_argument('--sheets', type=int, default=20, help='Sheets cut by the cycle benchmark')
+    parser.add_argument('--length', type=float, default=500, help='Sheet length used by the cycle benchmark')
+    parser.add_argument('--virtual', action='store_true', help='Run the cycle benchmark in virtual time')
+    parser.add_argument('--clients', type=int, default=4, help='Websocket clients of the notifier benchmark')
+    parser.add_argument('--messages', type=int, default=10000, help='Messages sent by the notifier and iomonitor benchmarks')
+    parser.add_argument('--pins', type=int, default=32, help='Pins monitored by the iomonitor benchmark')
+    parser.add_argument('--conflation-window', type=float, default=0, help='Conflation window of the iomonitor benchmark, in seconds')
+    parser.add_argument('--encoding', default='json', choices=['json', 'packed'], help='Encoding requested by the notifier benchmark clients')
+    parser.add_argument('--port', type=int, default=18081, help='Port used by the notifier benchmark')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    benchmarks = {
+        "cycle":        lambda: benchmarkCycle(args.sheets, args.length, args.virtual),
+        "notifier":     lambda: benchmarkNotifier(args.clients, args.messages, args.port, args.encoding),
+        "iomonitor":    lambda: benchmarkIOMonitor(args.pins, args.messages, args.conflation_window)
+    }
+
+    results = {}
+    for name in ('cycle', 'notifier', 'iomonitor'):
+        if args.benchmark not in (name, 'all'):
+            continue
+        missing = findMissingModules(name)
+        if len(missing) > 0:
+            logging.error('Skipping the {} benchmark, missing modules: {}'.format(name, ', '.join(missing)))
+            results[name] = { "skipped": True, "missingModules": missing }
+            continue
+        results[name] = benchmarks[name]()
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "arguments": vars(args),
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    run()
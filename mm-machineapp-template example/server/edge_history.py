@@ -0,0 +1,104 @@
+from array import array
+import threading
+
+class EdgeHistory():
+    '''
+    Fixed-size ring buffer of (monotonic_timestamp, value) events.
+
+    Storage is allocated once, in two flat arrays, so recording an event is a pair of
+    slot writes. Once the buffer is full, the oldest events are overwritten.
+
+    Every event gets a sequence number. A cursor is the sequence number of the next event
+    to be written: keep the cursor returned by 'since' to resume reading where you left off.
+
+    Values are stored as 32 bits integers: values outside of that range (e.g. a garbage
+    payload) are clamped to it.
+    '''
+    MIN_VALUE = -2 ** 31
+    MAX_VALUE = 2 ** 31 - 1
+
+    def __init__(self, capacity=256):
+        if capacity <= 0:
+            raise ValueError("EdgeHistory capacity must be positive")
+
+        self.capacity = capacity
+        self.__timestamps = array('d', bytes(8 * capacity))
+        self.__values = array('i', [0]) * capacity
+        self.__count = 0                # Total number of events ever recorded
+        self.__lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        ''' Records an event. timestamp should come from time.monotonic() '''
+        value = max(EdgeHistory.MIN_VALUE, min(int(value), EdgeHistory.MAX_VALUE))
+        with self.__lock:
+            idx = self.__count % self.capacity
+            self.__timestamps[idx] = timestamp
+            self.__values[idx] = value
+            self.__count += 1
+
+    def cursor(self):
+        ''' Returns the cursor of the next event to be recorded '''
+        return self.__count
+
+    def since(self, cursor):
+        '''
+        Returns the events recorded since the provided cursor.
+
+        params:
+            cursor: int
+                Value returned by 'cursor' or by a previous call to 'since'
+
+        returns:
+            (list<(float, int)>, int, int)
+                The events, oldest first, the cursor to use on the next call, and the
+                number of events that were overwritten before they could be read
+        '''
+        with self.__lock:
+            count = self.__count
+            first = max(cursor, count - self.capacity, 0)
+            events = [self.__event(seq) for seq in range(first, count)]
+
+        return events, count, first - min(cursor, first)
+
+    def countInWindow(self, start, end=None, value=None):
+        '''
+        Counts the events recorded between start and end (monotonic seconds, inclusive).
+        If value is provided, only the events with that value are counted.
+        '''
+        total = 0
+        for timestamp, eventValue in self.__window(start, end):
+            if value is None or eventValue == value:
+                total += 1
+        return total
+
+    def pulseWidths(self, value=1, start=None, end=None):
+        '''
+        Measures how long the signal stayed at 'value' each time it went there, i.e. the
+        time between an event with that value and the next event with another value.
+        Pulses that are still in progress are not reported.
+
+        returns:
+            list<float>
+                Pulse widths in seconds, oldest first
+        '''
+        widths = []
+        pulseStart = None
+        for timestamp, eventValue in self.__window(start, end):
+            if eventValue == value:
+                if pulseStart is None:
+                    pulseStart = timestamp
+            elif pulseStart is not None:
+                widths.append(timestamp - pulseStart)
+                pulseStart = None
+        return widths
+
+    def __event(self, seq):
+        idx = seq % self.capacity
+        return (self.__timestamps[idx], self.__values[idx])
+
+    def __window(self, start, end):
+        with self.__lock:
+            count = self.__count
+            events = [self.__event(seq) for seq in range(max(count - self.capacity, 0), count)]
+
+        return [e for e in events if (start is None or e[0] >= start) and (end is None or e[0] <= end)]
@@ -0,0 +1,196 @@
+import logging
+from internal.clock import getClock
+
+class ScheduledAction:
+    '''
+    Single action of an ActionSchedule. Holds its timing once the schedule has run.
+    '''
+
+    def __init__(self, name, callback, dependencies):
+        self.name = name
+        self.callback = callback
+        self.dependencies = dependencies
+        self.startSeconds = None        # Relative to the start of the schedule
+        self.endSeconds = None          # Relative to the start of the schedule
+
+    def getDuration(self):
+        if self.startSeconds == None or self.endSeconds == None:
+            return None
+        return self.endSeconds - self.startSeconds
+
+class ScheduleReport:
+    '''
+    Timing breakdown of a completed ActionSchedule.
+    '''
+
+    def __init__(self, actions, totalSeconds):
+        self.actions = actions
+        self.totalSeconds = totalSeconds
+        self.criticalPath = self.__findCriticalPath()
+
+    def __findCriticalPath(self):
+        '''
+        Walks back from the action that finished last, each time following the dependency
+        that finished last. Those are the actions that determined the total duration.
+        '''
+        finished = [action for action in self.actions if action.endSeconds != None]
+        if len(finished) == 0:
+            return []
+
+        path = [max(finished, key=lambda action: action.endSeconds)]
+        while len(path[-1].dependencies) > 0:
+            path.append(max(path[-1].dependencies, key=lambda action: action.endSeconds))
+
+        path.reverse()
+        return path
+
+    def toJson(self):
+        return {
+            "totalSeconds": self.totalSeconds,
+            "criticalPath": [action.name for action in self.criticalPath],
+            "actions": [{
+                "name": action.name,
+                "dependsOn": [dependency.name for dependency in action.dependencies],
+                "startSeconds": action.startSeconds,
+                "endSeconds": action.endSeconds,
+                "durationSeconds": action.getDuration()
+            } for action in self.actions]
+        }
+
+    def format(self):
+        ''' Returns a human readable breakdown, one action per line '''
+        lines = ['Schedule completed in {:.3f}s, critical path: {}'.format(
+            self.totalSeconds, ' -> '.join([action.name for action in self.criticalPath]))]
+        for action in self.actions:
+            lines.append('  {}{:<24} {:>8.3f}s -> {:>8.3f}s ({:.3f}s)'.format(
+                '*' if action in self.criticalPath else ' ',
+                action.name, action.startSeconds, action.endSeconds, action.getDuration()))
+        return '\n'.join(lines)
+
+class ActionSchedule:
+    '''
+    Set of actions with dependencies between them, run concurrently whenever possible.
+
+    Declare the actions of a state with 'add' (or one of the helpers), listing the actions
+    that must complete before each one can start, then call 'run'. Actions that do not
+    depend on each other are executed at the same time. 'run' returns a ScheduleReport
+    with the timing of each action and the critical path.
+
+    Example:
+        schedule = self.engine.createActionSchedule()
+        knifeDown = schedule.output('Knife down', self.engine.knife_output, False)
+        schedule.motion('Belt return', beltProgram, dependsOn=[knifeDown])
+        schedule.push('Plate down', self.engine.plate_pneumatic)
+        report = schedule.run()
+
+    Create schedules with BaseMachineAppEngine.createActionSchedule.
+    '''
+
+    def __init__(self, executor, clock=None):
+        '''
+        params:
+            executor: concurrent.futures.Executor
+                Executor on which the actions are run
+            clock: RealClock | VirtualClock
+                (Optional) Clock used for dwells, timings and to wait for the actions. Defaults to the MachineApp clock.
+        '''
+        self.__logger = logging.getLogger(__name__)
+        self.__executor = executor
+        self.__clock = clock if clock != None else getClock()
+        self.__actions = []
+
+    def add(self, name, callback, dependsOn=None):
+        '''
+        Declares an action.
+
+        params:
+            name: str
+                Name used in the report
+            callback: func() -> void
+                Blocking function performing the action
+            dependsOn: list<ScheduledAction>
+                (Optional) Actions that must be complete before this one starts
+
+        returns:
+            ScheduledAction
+        '''
+        dependencies = list(dependsOn) if dependsOn != None else []
+        for dependency in dependencies:
+            if not dependency in self.__actions:
+                raise ValueError('{} depends on an action from another schedule: {}'.format(name, dependency.name))
+
+        action = ScheduledAction(name, callback, dependencies)
+        self.__actions.append(action)
+        return action
+
+    def motion(self, name, motionProgram, dependsOn=None):
+        ''' Runs a MotionProgram and waits for its completion '''
+        return self.add(name, motionProgram.run, dependsOn)
+
+    def push(self, name, pneumatic, dependsOn=None):
+        ''' Pushes a pneumatic '''
+        return self.add(name, pneumatic.push, dependsOn)
+
+    def pull(self, name, pneumatic, dependsOn=None):
+        ''' Pulls a pneumatic '''
+        return self.add(name, pneumatic.pull, dependsOn)
+
+    def output(self, name, digitalOutput, isHigh, dependsOn=None):
+        ''' Sets a digital output high or low '''
+        return self.add(name, digitalOutput.high if isHigh else digitalOutput.low, dependsOn)
+
+    def dwell(self, name, seconds, dependsOn=None):
+        ''' Waits for a fixed amount of time '''
+        return self.add(name, lambda: self.__clock.sleep(seconds), dependsOn)
+
+    def waitForSensor(self, name, sensor, rising=True, timeout=None, dependsOn=None):
+        ''' Waits for a rising (or falling) edge on a Sensor '''
+        if rising:
+            return self.add(name, lambda: sensor.wait_for_rising_edge(timeout), dependsOn)
+        return self.add(name, lambda: sensor.wait_for_falling_edge(timeout), dependsOn)
+
+    def run(self):
+        '''
+        Runs every action, as soon as its dependencies are complete, and blocks until they are
+        all done. If an action raises, no further action is started and the exception is raised
+        again once the running actions have completed.
+
+        returns:
+            ScheduleReport
+        '''
+        startTime = self.__clock.monotonic()
+        pending = list(self.__actions)
+        done = set()
+        running = {}
+        error = None
+
+        while len(pending) > 0 or len(running) > 0:
+            if error == None:
+                for action in [a for a in pending if all(d in done for d in a.dependencies)]:
+                    pending.remove(action)
+                    running[self.__clock.submit(self.__executor, self.__runAction, action, startTime)] = action
+
+            if len(running) == 0:
+                if error == None:
+                    error = RuntimeError('Circular dependencies between: {}'.format(', '.join([a.name for a in pending])))
+                break
+
+            finished = self.__clock.waitFutures(running.keys())
+            for future in finished:
+                action = running.pop(future)
+                done.add(action)
+                if future.exception() != None and error == None:
+                    self.__logger.error('Action {} failed: {}'.format(action.name, future.exception()))
+                    error = future.exception()
+
+        if error != None:
+            raise error
+
+        return ScheduleReport(list(self.__actions), self.__clock.monotonic() - startTime)
+
+    def __runAction(self, action, startTime):
+        action.startSeconds = self.__clock.monotonic() - startTime
+        try:
+            action.callback()
+        finally:
+            action.endSeconds = self.__clock.monotonic() - startTime
@@ -1,12 +1,23 @@
 from abc import ABC, abstractmethod
 import logging
-from internal.notifier import NotificationLevel, sendNotification
-import time
-from internal.mqtt_topic_subscriber import MqttTopicSubscriber
-
-# TODO: Hacky wait to ensure that all print statements are immediately flushed up to the super-process
-import functools
-print = functools.partial(print, flush=True)
+from internal.notifier import NotificationLevel, sendNotification, flushNotifications
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from internal.mqtt_subscription_pool import MqttSubscriptionPool, MqttDispatchMode
+from internal.motion_program import MotionProgram
+from internal.action_scheduler import ActionSchedule
+from internal.io_monitor import IOMonitor
+from internal.profiler import StateProfiler
+from internal.clock import getClock, setClock
+from internal.journal import RecordType, initializeJournal, getJournal
+from internal.log_pipeline import installLogPipeline, uninstallLogPipeline
+from internal.metrics import registry, startMetricsServer, stopMetricsServer
+import internal.tracing as tracing
+
+STATE_TRANSITIONS   = registry.counter('machineapp_state_transitions_total', 'State transitions, by state entered', ['state'])
+CYCLES              = registry.counter('machineapp_cycles_total', 'Completed production cycles (e.g. sheets cut), by cycle', ['cycle'])
+LOOP_LAG            = registry.histogram('machineapp_loop_lag_seconds', 'Delay between the time a state update was due and the time it ran')
 
 class MachineAppState(ABC):
     '''
@@ -14,6 +25,11 @@ class MachineAppState(ABC):
     you will inherit this class and implement, at the minimum, the onEnter and onLeave
     methods. See IdleState for an example.
     '''
+
+    # Seconds between two calls to 'update' while this state is active. When None, the
+    # engine's UPDATE_INTERVAL_SECONDS is used. Set it to float('inf') if your state does
+    # not need periodic updates: the engine will then sleep until it is woken up.
+    UPDATE_INTERVAL_SECONDS = None
     
     def __init__(self, engine: 'BaseMachineAppEngine'):
         '''
@@ -24,7 +40,14 @@ class MachineAppState(ABC):
         self.engine = engine
         self.configuration = self.engine.getConfiguration()
 
-        self.__mqttTopicSubscriberList = []
+        self.__subscriptionHandles = []                                 # Handles acquired from the engine's MqttSubscriptionPool while this state is active
+
+    def sleep(self, seconds):
+        '''
+        Waits for the provided number of seconds. Use this instead of time.sleep in your
+        states, so that they also run in a simulated (virtual time) run.
+        '''
+        self.engine.clock.sleep(seconds)
 
     def gotoState(self, state):
         '''
@@ -41,8 +64,8 @@ class MachineAppState(ABC):
 
     def registerCallback(self, machineMotion: 'MachineMotion', ioName: str, callback):
         ''' 
-        Register a callback for a particular topic. Note that you should call removeCallback
-        when you are finished.
+        Register a callback for a particular topic. The callback is removed automatically when
+        the state is left, or earlier with removeCallback.
 
         params:
             machineMotion: MachineMotion
@@ -53,23 +76,53 @@ class MachineAppState(ABC):
 
             callback: func(topic: str, msg: str) -> void
                 Callback that gets called when we receive data on that topic
+
+        returns:
+            MqttSubscriptionHandle
+                Handle to pass to removeCallback
         '''
-        mqttSubscriber = None
-        for subscriber in self.__mqttTopicSubscriberList:
-            if subscriber.getMachineMotion() == machineMotion:
-                mqttSubscriber = subscriber
-                break
+        handle = self.engine.getSubscriptionPool().acquire(machineMotion, machineMotion.getInputTopic(ioName), callback)
+        self.__subscriptionHandles.append(handle)
+        return handle
+
+    def removeCallback(self, handle: 'MqttSubscriptionHandle'):
+        '''
+        Removes a callback registered with registerCallback.
 
-        if mqttSubscriber == None:
-            mqttSubscriber = MqttTopicSubscriber(machineMotion)
-            self.__mqttTopicSubscriberList.append(mqttSubscriber)
+        params:
+            handle: MqttSubscriptionHandle
+                Handle returned by registerCallback
+        '''
+        handle.release()
+        if handle in self.__subscriptionHandles:
+            self.__subscriptionHandles.remove(handle)
 
-        mqttSubscriber.registerCallback(machineMotion.getInputTopic(ioName), callback)
+    def getUpdateInterval(self):
+        '''
+        Returns the number of seconds that the engine waits between two calls to 'update'
+        while this state is active.
+
+        returns:
+            float
+        '''
+        if self.UPDATE_INTERVAL_SECONDS == None:
+            return self.engine.UPDATE_INTERVAL_SECONDS
+
+        return self.UPDATE_INTERVAL_SECONDS
 
     @abstractmethod
     def onEnter(self):
         ''' 
         Called whenever this state is entered
+
+        Every state callback (onEnter, onLeave, update, onPause, onResume and onStop) may
+        also be declared with 'async def'. It then runs on the engine's event loop, where
+        you can await several things at once, e.g.:
+
+            await asyncio.wait_for(asyncio.gather(
+                sensor.rising_edge(),
+                self.engine.waitForMotionCompletionAsync(self.engine.MachineMotion)
+            ), timeout=5)
         '''
         pass
 
@@ -114,31 +167,52 @@ class MachineAppState(ABC):
         '''
         Warning: For internal use only.
 
-        Updates all of the MQTT topic subscribers that you currently have active.
+        Updates all of the MQTT topic subscribers of the engine. Messages on topics that no
+        state holds are dropped, so that they do not pile up between two uses.
         '''
-        for subscriber in self.__mqttTopicSubscriberList:
-            subscriber.update()
+        self.engine.getSubscriptionPool().update()
 
     def freeCallbacks(self):
         '''
         Warning: For internal use only.
 
-        Deletes all of the MQTT topic subscribers that you currently have active.
+        Releases all of the MQTT callbacks that you currently have active. The subscriptions
+        themselves stay open in the engine's pool, ready for the next state that needs them.
         '''
-        for subscriber in self.__mqttTopicSubscriberList:
-            subscriber.delete()
+        for handle in self.__subscriptionHandles:
+            handle.release()
 
-        self.__mqttTopicSubscriberList.clear()
+        self.__subscriptionHandles.clear()
 
 class BaseMachineAppEngine(ABC):
     '''
     Base class for the MachineApp engine
     '''
     UPDATE_INTERVAL_SECONDS = 0.16
+    MAX_CONCURRENT_ACTIONS  = 8                                         # Number of actions of an ActionSchedule that can run at the same time
+    PROFILE_REPORT_INTERVAL_SECONDS = 30                                # Period at which state timings are pushed to the Notifier. None disables the periodic report.
+    WAKEUP_DRIVEN           = True                                      # If True, gotoState/pause/resume/stop wake the loop up immediately instead of waiting for the next tick
+    NOTIFICATION_FLUSH_TIMEOUT_SECONDS = 2                              # How long the end of a run waits for queued notifications to reach the parent process
+    MQTT_DISPATCH_MODE      = MqttDispatchMode.POLL                     # How callbacks registered with MachineAppState.registerCallback are delivered (see MqttDispatchMode)
+    LOG_FILE                = 'machine_app.log'                         # Written by a background thread (see internal.log_pipeline). None leaves the logging configuration alone.
+    METRICS_PORT            = 8082                                      # Port on which metrics are served in the Prometheus text format (see internal.metrics). None disables it.
+    METRICS_IP              = '127.0.0.1'                               # Address the metrics are served on. Use '0.0.0.0' to let a scraper on the network read them (they are not authenticated).
+    JOURNAL_DIRECTORY       = 'journal'                                 # Where the run journal is kept (see internal.journal). None disables journaling.
+
+    def __init__(self, clock=None):
+        '''
+        params:
+            clock: RealClock | VirtualClock
+                (Optional) Clock driving the engine. It becomes the MachineApp clock (see internal.clock.setClock),
+                so that sensors, notifications, the IO monitor and the journal use the same time as the engine.
+                Defaults to the current MachineApp clock.
+        '''
+        if clock != None:
+            setClock(clock)
 
-    def __init__(self):
         self.configuration  = None                                      # Python dictionary containing the loaded configuration payload
         self.logger         = logging.getLogger(__name__)               # Logger used to output information to the local log file and console
+        self.clock          = getClock()                                # Every time measurement and wait of the engine goes through this clock
         
         # High-Level state variables
         self.__isRunning              = False                           # The MachineApp will execute while this flag is set
@@ -154,6 +228,30 @@ class BaseMachineAppEngine(ABC):
         self.__shouldPause  = False                                     # Tells the MachineApp loop that it should pause on its next update
         self.__shouldResume = False                                     # Tells the MachineApp loop that it should resume on its next update
 
+        # Asynchronous state variables
+        self.__eventLoop        = None                                  # Event loop on which 'async def' state callbacks run. Owned by the engine thread.
+        self.__runningTask      = None                                  # Asynchronous state callback currently being run, if any
+        self.__taskLock         = threading.Lock()                      # Guards __eventLoop and __runningTask, which 'stop' reads from another thread
+
+        # Motion programs
+        self.__motionExecutors  = {}                                    # Maps MachineMotion instances to the single-threaded executor running their programs in order
+        self.__actionExecutor   = None                                  # Executor shared by every ActionSchedule
+        self.__ioMonitors       = []                                    # IOMonitors created for this run, closed at its end
+
+        # MQTT subscriptions
+        self.__subscriptionPool = MqttSubscriptionPool(self.MQTT_DISPATCH_MODE, self.wakeup)   # Subscriptions shared by every state, kept open for the whole run
+
+        # Profiling
+        self.__profiler                 = StateProfiler()               # Histograms of the time spent in each state and state callback
+        self.__stateEnteredTime         = None                          # Monotonic time at which the current state was entered
+        self.__transitionRequestedTime  = None                          # Monotonic time at which gotoState was last called
+        self.__nextProfileReportTime    = float('inf')                  # Monotonic time at which the state timings are pushed next
+        self.__lastCycleTime            = None                          # Monotonic time at which the last cycle completed, or the run started
+
+        # Wakeup state variables
+        self.__wakeEvent        = threading.Event()                     # Set whenever the loop has something to do before its next scheduled update
+        self.__nextUpdateTime   = 0                                     # Monotonic time at which the current state's update should run next
+        self.__updateRequested  = False                                 # Set by 'requestUpdate' to run the current state's update right away
 
     @abstractmethod
     def initialize(self):
@@ -264,9 +362,231 @@ class BaseMachineAppEngine(ABC):
             self.logger.error('Trying to move to an unknown state: {}'.format(newState))
             return False
 
+        self.__transitionRequestedTime = self.clock.monotonic()
         self.__nextRequestedState = newState
+        self.wakeup()
         return True
 
+    def wakeup(self):
+        '''
+        Wakes the MachineApp loop up so that it processes pending requests right away
+        instead of waiting for the next scheduled update. Safe to call from any thread.
+        '''
+        self.__wakeEvent.set()
+
+    def requestUpdate(self):
+        '''
+        Runs the 'update' of the current state as soon as possible, even if it is not due yet
+        (e.g. a state with an infinite UPDATE_INTERVAL_SECONDS waiting for an external event).
+        Safe to call from any thread.
+        '''
+        self.__updateRequested = True
+        self.wakeup()
+
+    def __waitForWakeup(self, timeout):
+        '''
+        (Internal, for engine use only)
+
+        Blocks the loop until either 'wakeup' is called or the timeout (in seconds) expires.
+        A timeout of None waits until the next wakeup.
+        '''
+        if not self.WAKEUP_DRIVEN:
+            self.clock.sleep(BaseMachineAppEngine.UPDATE_INTERVAL_SECONDS)
+            return
+
+        if timeout != None:
+            if timeout <= 0:
+                self.__wakeEvent.clear()
+                return
+            if timeout == float('inf'):
+                timeout = None
+
+        self.clock.waitEvent(self.__wakeEvent, timeout)
+        self.__wakeEvent.clear()
+
+    def getSubscriptionPool(self):
+        '''
+        Returns the pool holding the MQTT subscriptions of every state.
+
+        returns:
+            MqttSubscriptionPool
+        '''
+        return self.__subscriptionPool
+
+    def completeCycle(self, name='cycle'):
+        '''
+        Records the completion of a production cycle (e.g. a sheet cut) in the run journal,
+        along with the time it took since the previous one.
+
+        params:
+            name: str
+                (Optional) Name of the cycle, used to query the journal
+        '''
+        now = self.clock.monotonic()
+        duration = now - self.__lastCycleTime if self.__lastCycleTime != None else 0.0
+        self.__lastCycleTime = now
+
+        CYCLES.labels(name).inc()
+        journal = getJournal()
+        if journal != None:
+            journal.record(RecordType.CYCLE_COMPLETE, name, value=duration)
+
+    def getEventLoop(self):
+        '''
+        Returns the event loop on which asynchronous state callbacks run. It only exists
+        while the MachineApp is running.
+
+        returns:
+            asyncio.AbstractEventLoop
+        '''
+        return self.__eventLoop
+
+    async def waitForMotionCompletionAsync(self, machineMotion):
+        '''
+        Awaitable version of MachineMotion.waitForMotionCompletion, for use in 'async def'
+        state callbacks. The blocking wait runs on the executor shared by the ActionSchedules.
+
+        Warning: a thread blocked in waitForMotionCompletion cannot be interrupted. When the
+        callback is cancelled (e.g. on stop), the await ends right away but the wait itself
+        goes on in the executor until the motion is complete.
+
+        params:
+            machineMotion: MachineMotion
+                Machine whose motion you are waiting for
+        '''
+        await asyncio.wrap_future(self.clock.submit(self.__getActionExecutor(), machineMotion.waitForMotionCompletion))
+
+    def createMotionProgram(self, machineMotion):
+        '''
+        Creates an empty MotionProgram for the provided machine. Programs submitted for the
+        same machine run one after the other, in submission order.
+
+        params:
+            machineMotion: MachineMotion
+                Machine that will run the program
+        returns:
+            MotionProgram
+        '''
+        executor = self.__motionExecutors.get(machineMotion)
+        if executor == None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='MotionProgram')
+            self.__motionExecutors[machineMotion] = executor
+
+        return MotionProgram(machineMotion, executor, self.clock)
+
+    def createActionSchedule(self):
+        '''
+        Creates an empty ActionSchedule. Its independent actions run concurrently on an
+        executor shared by the whole engine.
+
+        returns:
+            ActionSchedule
+        '''
+        return ActionSchedule(self.__getActionExecutor(), self.clock)
+
+    def createIOMonitor(self, machineMotion, conflationWindowSeconds=None, resyncIntervalSeconds=None):
+        '''
+        Creates an IOMonitor sending the IOs of the provided machine to the Web Client. It is
+        closed when the run ends.
+
+        params:
+            machineMotion: MachineMotion
+                Machine whose IOs are monitored
+            conflationWindowSeconds: float
+                (Optional) See IOMonitor
+            resyncIntervalSeconds: float
+                (Optional) See IOMonitor
+        returns:
+            IOMonitor
+        '''
+        monitor = IOMonitor(machineMotion, conflationWindowSeconds, resyncIntervalSeconds)
+        self.__ioMonitors.append(monitor)
+        return monitor
+
+    def __getActionExecutor(self):
+        '''
+        (Internal, for engine use only)
+
+        Returns the executor shared by every ActionSchedule, creating it if needed.
+        '''
+        if self.__actionExecutor == None:
+            self.__actionExecutor = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_ACTIONS, thread_name_prefix='Action')
+
+        return self.__actionExecutor
+
+    def getProfiler(self):
+        '''
+        Returns the profiler holding the timings of every state.
+
+        returns:
+            StateProfiler
+        '''
+        return self.__profiler
+
+    def getStateTimings(self):
+        '''
+        Returns the p50/p95/p99/max durations, in seconds, of each state and of its
+        callbacks. Safe to call from any thread while the MachineApp is running.
+
+        returns:
+            dict<str, dict<str, dict>>
+                e.g. getStateTimings()['Cut']['inState']['p95']
+        '''
+        return self.__profiler.getSummary()
+
+    def __reportStateTimings(self):
+        '''
+        (Internal, for engine use only)
+
+        Pushes the state timings to the web client.
+        '''
+        sendNotification(NotificationLevel.PROFILE, 'State timings', self.__profiler.getSummary())
+
+    def __invokeStateCallback(self, callback, phase=None):
+        '''
+        (Internal, for engine use only)
+
+        Calls a state callback. If it is a coroutine function, it is run to completion on the
+        engine's event loop. Asynchronous callbacks are cancelled when the MachineApp is stopped.
+        Blocking calls they await through an executor (run_in_executor) are not interrupted.
+
+        If a phase is provided, the duration of the callback is recorded for the current state.
+        '''
+        startTime = self.clock.monotonic()
+        try:
+            result = callback()
+            if not asyncio.iscoroutine(result):
+                return result
+
+            with self.__taskLock:
+                runningTask = self.__eventLoop.create_task(result)
+                self.__runningTask = runningTask
+            try:
+                with self.clock.idle():     # The task waits on other threads (e.g. executors), so the engine thread does not hold the time back
+                    return self.__eventLoop.run_until_complete(runningTask)
+            except asyncio.CancelledError:
+                self.logger.info('Cancelled {}'.format(callback.__qualname__))
+                return None
+            finally:
+                with self.__taskLock:
+                    self.__runningTask = None
+        finally:
+            if phase != None:
+                self.__recordStateTiming(phase, self.clock.monotonic() - startTime)
+
+    def __recordStateTiming(self, phase, seconds):
+        '''
+        (Internal, for engine use only)
+
+        Records the duration of a phase of the current state in the profiler, and in the trace if tracing is enabled.
+        '''
+        self.__profiler.record(self.__currentState, phase, seconds)
+
+        tracer = tracing.activeTracer
+        if tracer != None:
+            name = self.__currentState if phase == StateProfiler.IN_STATE else '{}.{}'.format(self.__currentState, phase)
+            tracer.complete(name, 'state', tracer.now() - seconds * 1e6, seconds * 1e6)
+
     def __tryExecuteStateTransition(self):
         '''
         (Internal, for engine use only)
@@ -285,21 +605,37 @@ class BaseMachineAppEngine(ABC):
             return True # Return True so that we can get a clean update loop
 
         self.__hasPausedForStepper = False # We have paused for the stepper at this point, so let's reset it
+        transitionStartTime = self.clock.monotonic()
+        transitionLatency = None
+        if self.__transitionRequestedTime != None and not self.__inStateStepperMode:
+            transitionLatency = transitionStartTime - self.__transitionRequestedTime
 
         if not self.__currentState == None:
             prevState = self.getCurrentState()
             if prevState != None:
-                prevState.onLeave()
+                self.__invokeStateCallback(prevState.onLeave, StateProfiler.ON_LEAVE)
                 prevState.freeCallbacks()
+            if self.__stateEnteredTime != None:
+                self.__recordStateTiming(StateProfiler.IN_STATE, self.clock.monotonic() - self.__stateEnteredTime)
 
         sendNotification(NotificationLevel.APP_STATE_CHANGE, 'Entered MachineApp state: {}'.format(self.__nextRequestedState))
         self.__currentState = self.__nextRequestedState
         self.__nextRequestedState = None
+        self.__nextUpdateTime = 0 # The new state gets updated right away
         nextState = self.getCurrentState()
 
+        timeInPreviousState = self.clock.monotonic() - self.__stateEnteredTime if self.__stateEnteredTime != None else 0.0
+        self.__stateEnteredTime = self.clock.monotonic()
+        STATE_TRANSITIONS.labels(self.__currentState).inc()
+        journal = getJournal()
+        if journal != None:
+            journal.record(RecordType.STATE_ENTER, self.__currentState, value=timeInPreviousState)
+        if transitionLatency != None:
+            self.__recordStateTiming(StateProfiler.TRANSITION_LATENCY, transitionLatency)
         if nextState != None:
-            nextState.onEnter()
+            self.__invokeStateCallback(nextState.onEnter, StateProfiler.ON_ENTER)
 
+        self.__recordStateTiming(StateProfiler.TRANSITION, self.clock.monotonic() - transitionStartTime)
         return True
 
     def loop(self, inStateStepperMode, configuration):
@@ -309,22 +645,53 @@ class BaseMachineAppEngine(ABC):
         if self.__isRunning:
             return False
 
-        sendNotification(NotificationLevel.APP_START, 'MachineApp started')
-        self.logger.info('Starting the main MachineApp loop')
-
-        # Configure run time variables
-        self.__inStateStepperMode = inStateStepperMode
-        self.configuration = configuration
         self.__isRunning = True
+        self.clock.attach()         # In a simulated run, the time only moves while the engine thread waits
+        try:
+            # Everything acquired here is released by __releaseRunResources, even if a step fails
+            if self.LOG_FILE != None:
+                installLogPipeline(self.LOG_FILE)
+            if self.METRICS_PORT != None:
+                startMetricsServer(self.METRICS_PORT, self.METRICS_IP)
+
+            sendNotification(NotificationLevel.APP_START, 'MachineApp started')
+            self.logger.info('Starting the main MachineApp loop')
+
+            # Configure run time variables
+            self.__inStateStepperMode = inStateStepperMode
+            self.configuration = configuration
+            with self.__taskLock:
+                self.__eventLoop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.__eventLoop)
+            self.__profiler.reset()
+            self.__stateEnteredTime = None
+            self.__lastCycleTime = self.clock.monotonic()
+            if self.JOURNAL_DIRECTORY != None and getJournal() == None:
+                initializeJournal(self.JOURNAL_DIRECTORY)
+            if getJournal() != None:
+                getJournal().record(RecordType.RUN_START)
+            if self.PROFILE_REPORT_INTERVAL_SECONDS != None:
+                self.__nextProfileReportTime = self.clock.monotonic() + self.PROFILE_REPORT_INTERVAL_SECONDS
+
+            # Run initialization sequence
+            self.initialize()
+            self.__stateDictionary = self.buildStateDictionary()
+
+            # Begin the Application by moving to the default state
+            self.gotoState(self.getDefaultState())
+
+            self.__runStates()
+            self.__completeRun()
+        finally:
+            self.__releaseRunResources()
+        return True
 
-        # Run initialization sequence
-        self.initialize()
-        self.__stateDictionary = self.buildStateDictionary()
-
-        # Begin the Application by moving to the default state
-        self.gotoState(self.getDefaultState())
+    def __runStates(self):
+        '''
+        (Internal, for engine use only)
 
-        # Inner Loop running the actual MachineApp program
+        Inner Loop running the actual MachineApp program, until it is stopped.
+        '''
         while self.__isRunning:
             if self.__shouldStop:           # Running stop behavior
                 self.__shouldStop = False
@@ -334,7 +701,7 @@ class BaseMachineAppEngine(ABC):
 
                 currentState = self.getCurrentState()
                 if currentState != None:
-                    currentState.onStop()
+                    self.__invokeStateCallback(currentState.onStop)
                 
                 break
 
@@ -352,7 +719,7 @@ class BaseMachineAppEngine(ABC):
 
                     currentState = self.getCurrentState()
                     if currentState != None:
-                        currentState.onPause()
+                        self.__invokeStateCallback(currentState.onPause)
 
             if self.__shouldResume:         # Running resume behavior
                 sendNotification(NotificationLevel.APP_RESUME, 'MachineApp resumed')
@@ -364,10 +731,10 @@ class BaseMachineAppEngine(ABC):
 
                     currentState = self.getCurrentState()
                     if currentState != None:
-                        currentState.onResume()
+                        self.__invokeStateCallback(currentState.onResume)
 
-            if self.__isPaused:               # While paused, don't do anything
-                time.sleep(BaseMachineAppEngine.UPDATE_INTERVAL_SECONDS)
+            if self.__isPaused:               # While paused, don't do anything until we are woken up
+                self.__waitForWakeup(None)
                 continue
 
             if self.__nextRequestedState != None:       # Running state transition behavior
@@ -379,15 +746,82 @@ class BaseMachineAppEngine(ABC):
                 self.logger.error('Currently in an invalid state')
                 continue
 
-            currentState.updateCallbacks()
-            currentState.update()
+            if self.__subscriptionPool.hasPendingMessages():    # MQTT messages are delivered as soon as they arrive, whatever the update interval
+                currentState.updateCallbacks()
+
+            if self.__updateRequested or self.clock.monotonic() >= self.__nextUpdateTime:
+                self.__updateRequested = False
+                if 0 < self.__nextUpdateTime <= self.clock.monotonic():     # Updates run early by 'requestUpdate' are not late
+                    LOOP_LAG.observe(self.clock.monotonic() - self.__nextUpdateTime)
+                currentState.updateCallbacks()
+                self.__invokeStateCallback(currentState.update, StateProfiler.UPDATE)
+                self.__nextUpdateTime = self.clock.monotonic() + currentState.getUpdateInterval()
+
+            if self.clock.monotonic() >= self.__nextProfileReportTime:
+                self.__reportStateTimings()
+                self.__nextProfileReportTime = self.clock.monotonic() + self.PROFILE_REPORT_INTERVAL_SECONDS
+
+            self.__waitForWakeup(min(self.__nextUpdateTime, self.__nextProfileReportTime) - self.clock.monotonic())
 
-            time.sleep(BaseMachineAppEngine.UPDATE_INTERVAL_SECONDS)
+    def __completeRun(self):
+        '''
+        (Internal, for engine use only)
 
+        Reports the end of a run that was stopped normally.
+        '''
         self.logger.info('Exiting MachineApp loop')
+        if self.__currentState != None and self.__stateEnteredTime != None:
+            self.__recordStateTiming(StateProfiler.IN_STATE, self.clock.monotonic() - self.__stateEnteredTime)
+        if tracing.activeTracer != None:
+            tracing.activeTracer.flush()
+        self.logger.info('State timings:\n{}'.format(self.__profiler.format()))
+        self.__reportStateTimings()
+
         sendNotification(NotificationLevel.APP_COMPLETE, 'MachineApp completed')
         self.afterRun()
-        return True
+        flushNotifications(self.NOTIFICATION_FLUSH_TIMEOUT_SECONDS)
+
+        journal = getJournal()
+        if journal != None:
+            journal.record(RecordType.RUN_END)
+            journal.flush()
+
+    def __releaseRunResources(self):
+        '''
+        (Internal, for engine use only)
+
+        Releases what a run holds, whether it ended normally or with an exception, so that
+        the engine can run again. The run may have failed before acquiring everything.
+        '''
+        with self.__taskLock:
+            eventLoop = self.__eventLoop
+            self.__eventLoop = None
+            self.__runningTask = None
+        if eventLoop != None:
+            eventLoop.close()
+        asyncio.set_event_loop(None)
+
+        self.__subscriptionPool.free()
+
+        for executor in self.__motionExecutors.values():
+            executor.shutdown(wait=False)
+        self.__motionExecutors.clear()
+
+        if self.__actionExecutor != None:
+            self.__actionExecutor.shutdown(wait=False)
+            self.__actionExecutor = None
+
+        for monitor in self.__ioMonitors:
+            monitor.close()
+        self.__ioMonitors.clear()
+
+        self.clock.detach()
+        self.__isRunning = False
+
+        if self.METRICS_PORT != None:
+            stopMetricsServer()
+        if self.LOG_FILE != None:
+            uninstallLogPipeline()
 
     def pause(self):
         '''
@@ -399,6 +833,7 @@ class BaseMachineAppEngine(ABC):
         '''
         self.logger.info('Pausing the MachineApp')
         self.__shouldPause = True
+        self.wakeup()
 
     def resume(self):
         '''
@@ -410,6 +845,7 @@ class BaseMachineAppEngine(ABC):
         '''
         self.logger.info('Resuming the MachineApp')
         self.__shouldResume = True
+        self.wakeup()
 
     def stop(self):
         '''
@@ -420,4 +856,13 @@ class BaseMachineAppEngine(ABC):
         you implement any on-stop behavior in your MachineAppStates instead
         '''
         self.logger.info('Stopping the MachineApp')
-        self.__shouldStop = True
\ No newline at end of file
+        self.__shouldStop = True
+        self.wakeup()
+
+        # Interrupt the asynchronous state callback, if one is running. The lock makes sure
+        # that the task still runs on an open loop: a task that completed, or the task of a
+        # later callback, is never cancelled.
+        with self.__taskLock:
+            runningTask = self.__runningTask
+            if self.__eventLoop != None and runningTask != None and not runningTask.done():
+                self.__eventLoop.call_soon_threadsafe(runningTask.cancel)
@@ -0,0 +1,326 @@
+import time
+import heapq
+import threading
+from contextlib import contextmanager
+from concurrent.futures import wait, FIRST_COMPLETED
+
+class RealClock:
+    '''
+    Clock backed by the system time. This is the default clock.
+
+    Every piece of the MachineApp that needs the time, or needs to wait, goes through a
+    clock (see getClock) instead of the time module, so that runs can be simulated with
+    a VirtualClock. The same goes for work handed to other threads, which is submitted
+    with 'submit' and waited for with 'waitFutures'.
+    '''
+
+    def time(self):
+        ''' Wall-clock time, in seconds since the epoch '''
+        return time.time()
+
+    def monotonic(self):
+        ''' Monotonic time, in seconds. Use it to measure durations. '''
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def waitEvent(self, event, timeout=None):
+        '''
+        Waits until the threading.Event is set or the timeout (in seconds) expires.
+
+        returns:
+            bool
+                Whether or not the event is set
+        '''
+        return event.wait(timeout)
+
+    def waitCondition(self, condition, predicate, timeout=None):
+        '''
+        Waits until the predicate is True. Must be called while holding the threading.Condition.
+
+        returns:
+            bool
+                Last value of the predicate
+        '''
+        return condition.wait_for(predicate, timeout)
+
+    def waitFutures(self, futures, timeout=None):
+        '''
+        Waits until at least one of the concurrent.futures.Future is done, or the timeout
+        (in seconds) expires.
+
+        returns:
+            set<Future>
+                The futures that are done
+        '''
+        done, _ = wait(list(futures), timeout, return_when=FIRST_COMPLETED)
+        return done
+
+    def submit(self, executor, function, *args):
+        '''
+        Runs function(*args) on the concurrent.futures.Executor.
+
+        returns:
+            Future
+        '''
+        return executor.submit(function, *args)
+
+    def attach(self):
+        ''' Makes the calling thread take part in the simulation. Nothing to do in real time. '''
+        pass
+
+    def detach(self):
+        ''' Ends 'attach'. Nothing to do in real time. '''
+        pass
+
+    @contextmanager
+    def idle(self):
+        ''' Marks the calling thread as waiting on something other than the clock. Nothing to do in real time. '''
+        yield
+
+class _ThreadState(threading.local):
+    ''' Part a thread takes in a VirtualClock simulation '''
+
+    def __init__(self):
+        self.tokens = 0                 # Participant tokens held by the thread (see VirtualClock)
+        self.suspendedTokens = None     # Tokens suspended while the thread waits on the clock, None when it is not waiting
+
+class VirtualClock:
+    '''
+    Discrete-event clock. Time only moves when every thread taking part in the simulation
+    is waiting on the clock: it then jumps to the earliest end of those waits, or to the
+    next event scheduled with callLater. Hours of machine time run in however long the
+    code between the waits takes, and the times read by each thread do not depend on how
+    the threads happen to be scheduled.
+
+    The participants of the simulation are:
+        - the threads between 'attach' and 'detach' (e.g. the engine thread during a run)
+        - the functions run with 'submit', from the time they are submitted until they are done
+    Other threads (e.g. the REST API requesting a stop) can still wait on the clock, and set
+    what the participants are waiting for, but the time does not wait for them.
+
+    A participant blocked on anything other than the clock (a future's result, a queue, a
+    lock held for long...) holds the time back until it is released: wait on futures with
+    'waitFutures', and mark event loops with 'idle'. asyncio's own timers run in real time.
+
+    Callbacks scheduled with callLater run on the thread that moves the time, while the time
+    is held back. They must not wait on the clock.
+    '''
+    POLL_SECONDS = 0.005        # Real time between two checks of a wait, for waits released by other threads
+
+    def __init__(self, startTime=0.0, epoch=None):
+        '''
+        params:
+            startTime: float
+                Initial value of monotonic()
+            epoch: float
+                (Optional) Value of time() when monotonic() is 0. Defaults to the current time.
+        '''
+        self.__condition = threading.Condition(threading.Lock())
+        self.__now = startTime
+        self.__epoch = epoch if epoch != None else time.time()
+        self.__events = []              # Heap of (time, sequence, callback)
+        self.__sequence = 0
+        self.__tokens = 0               # One per participant, plus one per callLater callback running
+        self.__suspendedTokens = 0      # Tokens of the participants waiting on the clock
+        self.__waits = {}               # Maps the sequence number of each wait in progress to its (deadline, predicate)
+        self.__threads = _ThreadState()
+
+    def time(self):
+        return self.__epoch + self.__now
+
+    def monotonic(self):
+        return self.__now
+
+    def callLater(self, delay, callback):
+        '''
+        Schedules a callback 'delay' virtual seconds from now. Use it to simulate sensors,
+        operators and anything else that happens on its own.
+        '''
+        with self.__condition:
+            self.__sequence += 1
+            heapq.heappush(self.__events, (self.__now + max(delay, 0), self.__sequence, callback))
+            self.__condition.notify_all()
+
+    def advance(self, seconds):
+        '''
+        Moves the time forward, running every callback scheduled in between, whether or not
+        the participants are waiting. Use it to drive the clock by hand, e.g. in tests.
+        '''
+        with self.__condition:
+            deadline = self.__now + max(seconds, 0)
+            while len(self.__events) > 0 and self.__events[0][0] <= deadline:
+                self.__runNextEvent()
+            self.__now = max(self.__now, deadline)
+            self.__condition.notify_all()
+
+    def sleep(self, seconds):
+        self.__wait(lambda: False, seconds)
+
+    def waitEvent(self, event, timeout=None):
+        return self.__wait(event.is_set, timeout)
+
+    def waitCondition(self, condition, predicate, timeout=None):
+        '''
+        Waits until the predicate is True. Must be called while holding the threading.Condition,
+        which is released during the wait. The predicate is checked without holding it.
+        '''
+        condition.release()
+        try:
+            return self.__wait(predicate, timeout)
+        finally:
+            condition.acquire()
+
+    def waitFutures(self, futures, timeout=None):
+        futures = list(futures)
+        self.__wait(lambda: any(future.done() for future in futures), timeout)
+        return set(future for future in futures if future.done())
+
+    def submit(self, executor, function, *args):
+        '''
+        Runs function(*args) on the concurrent.futures.Executor as a participant: the time
+        does not move between the submission and the first wait of the function.
+        '''
+        with self.__condition:
+            self.__tokens += 1
+        try:
+            future = executor.submit(self.__runParticipant, function, args)
+        except:
+            self.__releaseToken()
+            raise
+        future.add_done_callback(lambda future: self.__releaseToken())
+        return future
+
+    def attach(self):
+        ''' Makes the calling thread a participant until it calls 'detach' '''
+        with self.__condition:
+            self.__tokens += 1
+        self.__threads.tokens += 1
+
+    def detach(self):
+        self.__threads.tokens -= 1
+        self.__releaseToken()
+
+    @contextmanager
+    def idle(self):
+        '''
+        Lets the time move while the calling participant waits on something other than the
+        clock, e.g. while it runs an asyncio event loop whose tasks wait on other participants.
+        '''
+        with self.__condition:
+            suspended = self.__suspend()
+            self.__condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__resume(suspended)
+
+    def __runParticipant(self, function, args):
+        self.__threads.tokens += 1
+        try:
+            return function(*args)
+        finally:
+            self.__threads.tokens -= 1
+
+    def __releaseToken(self):
+        with self.__condition:
+            self.__tokens -= 1
+            self.__condition.notify_all()
+
+    def __suspend(self):
+        '''
+        Counts the tokens of the calling thread as waiting. Must be called while holding the
+        condition. Returns False if they already were (nested wait).
+        '''
+        state = self.__threads
+        if state.suspendedTokens != None:
+            return False
+        state.suspendedTokens = state.tokens
+        self.__suspendedTokens += state.tokens
+        return True
+
+    def __resume(self, suspended):
+        state = self.__threads
+        if suspended:
+            self.__suspendedTokens -= state.suspendedTokens
+            state.suspendedTokens = None
+
+    def __wait(self, predicate, timeout):
+        with self.__condition:
+            deadline = self.__now + max(timeout, 0) if timeout != None else None
+            self.__sequence += 1
+            waitId = self.__sequence
+            self.__waits[waitId] = (deadline, predicate)
+            suspended = self.__suspend()
+            try:
+                while True:
+                    if predicate():
+                        return True
+                    if deadline != None and self.__now >= deadline:
+                        return False
+                    if not self.__advance():
+                        self.__condition.wait(VirtualClock.POLL_SECONDS)
+            finally:
+                self.__resume(suspended)
+                del self.__waits[waitId]
+
+    def __advance(self):
+        '''
+        Moves the time to the end of the earliest wait, or runs the next event, if every
+        participant is waiting and no wait is about to end. Must be called while holding the
+        condition. Returns whether or not it did.
+        '''
+        if self.__tokens > self.__suspendedTokens:
+            return False
+
+        deadlines = []
+        for deadline, predicate in self.__waits.values():
+            if deadline != None and deadline <= self.__now:
+                return False
+            if predicate():
+                return False
+            if deadline != None:
+                deadlines.append(deadline)
+
+        nextDeadline = min(deadlines) if len(deadlines) > 0 else None
+        if len(self.__events) > 0 and (nextDeadline == None or self.__events[0][0] <= nextDeadline):
+            self.__runNextEvent()
+        elif nextDeadline != None:
+            self.__now = nextDeadline
+        else:
+            return False        # Nothing will ever happen in virtual time: wait for another thread
+
+        self.__condition.notify_all()
+        return True
+
+    def __runNextEvent(self):
+        '''
+        Runs the next event without holding the condition, so that the callback can use
+        locks that other threads hold while reading the clock. Its token holds the time back.
+        '''
+        eventTime, _, callback = heapq.heappop(self.__events)
+        self.__now = max(self.__now, eventTime)
+        self.__tokens += 1
+        self.__condition.release()
+        try:
+            callback()
+        finally:
+            self.__condition.acquire()
+            self.__tokens -= 1
+
+_clock = RealClock()
+
+def getClock():
+    ''' Returns the clock used by the whole MachineApp '''
+    return _clock
+
+def setClock(clock):
+    '''
+    Replaces the clock used by the whole MachineApp, e.g. with a VirtualClock.
+    Must be called before the engine and sensors are created. BaseMachineAppEngine does it
+    when it is given a clock.
+    '''
+    global _clock
+    _clock = clock
@@ -0,0 +1,125 @@
+import math
+import logging
+import threading
+from internal.clock import getClock
+
+class MachineMotion:
+    '''
+    Stands in for internal.machine_motion.MachineMotion when developing locally (see
+    env.IS_DEVELOPMENT). Nothing is sent anywhere: every command is logged and recorded in
+    'commands', and moves take the time that a trapezoidal profile at the current speed and
+    acceleration would take on the controller. Moves are queued one after the other, like
+    in the controller's buffer, and waitForMotionCompletion waits for the last one to end
+    on the MachineApp clock (see internal.clock), so that runs can also be simulated.
+
+    MQTT messages can be simulated with 'publishMqtt'.
+    '''
+    DEFAULT_SPEED           = 300       # mm/s
+    DEFAULT_ACCELERATION    = 100       # mm/s^2
+
+    def __init__(self, machineIp='127.0.0.1', gCodeCallback=None):
+        self.__logger = logging.getLogger(__name__)
+        self.__lock = threading.Lock()
+        self.machineIp = machineIp
+        self.commands = []                  # (name, args) of every command received, in order
+        self.positions = {}                 # Maps axes to their position once the queued moves are done
+        self.speed = MachineMotion.DEFAULT_SPEED
+        self.acceleration = MachineMotion.DEFAULT_ACCELERATION
+        self.__motionEndTime = 0            # Monotonic time at which the queued moves are done
+        self.__mqttCallbacks = []
+
+    def configAxis(self, axis, uStep, mechGain):
+        self.__record('configAxis', axis, uStep, mechGain)
+
+    def configAxisDirection(self, axis, direction):
+        self.__record('configAxisDirection', axis, direction)
+
+    def emitSpeed(self, speed):
+        self.__record('emitSpeed', speed)
+        with self.__lock:
+            self.speed = speed
+
+    def emitAcceleration(self, acceleration):
+        self.__record('emitAcceleration', acceleration)
+        with self.__lock:
+            self.acceleration = acceleration
+
+    def emitAbsoluteMove(self, axis, position):
+        self.__record('emitAbsoluteMove', axis, position)
+        self.__queueMove(axis, position)
+
+    def emitRelativeMove(self, axis, direction, distance):
+        self.__record('emitRelativeMove', axis, direction, distance)
+        with self.__lock:
+            start = self.positions.get(axis, 0)
+        self.__queueMove(axis, start + distance if direction == 'positive' else start - distance)
+
+    def emitHome(self, axis):
+        self.__record('emitHome', axis)
+        self.__queueMove(axis, 0)
+
+    def emitStop(self):
+        ''' Drops the queued moves: the axes stop where they are planned to end '''
+        self.__record('emitStop')
+        with self.__lock:
+            self.__motionEndTime = getClock().monotonic()
+
+    def isMotionCompleted(self):
+        with self.__lock:
+            return getClock().monotonic() >= self.__motionEndTime
+
+    def waitForMotionCompletion(self):
+        self.__record('waitForMotionCompletion')
+        with self.__lock:
+            remaining = self.__motionEndTime - getClock().monotonic()
+        if remaining > 0:
+            getClock().sleep(remaining)
+
+    def addMqttCallback(self, callback):
+        with self.__lock:
+            self.__mqttCallbacks.append(callback)
+
+    def publishMqtt(self, topic, msg):
+        ''' Calls the MQTT callbacks as if the controller had published 'msg' on 'topic' '''
+        with self.__lock:
+            callbacks = list(self.__mqttCallbacks)
+        for callback in callbacks:
+            callback(topic, msg)
+
+    def triggerEstop(self):
+        self.__record('triggerEstop')
+        self.emitStop()
+        return True
+
+    def releaseEstop(self):
+        self.__record('releaseEstop')
+        return True
+
+    def resetSystem(self):
+        self.__record('resetSystem')
+        return True
+
+    def getMoveDuration(self, distance):
+        '''
+        Returns how long a move of 'distance' takes at the current speed and acceleration:
+        a trapezoid, or a triangle when the move is too short to reach the speed.
+        '''
+        with self.__lock:
+            speed, acceleration = self.speed, self.acceleration
+        distance = abs(distance)
+        if distance * acceleration >= speed * speed:
+            return distance / speed + speed / acceleration
+        return 2 * math.sqrt(distance / acceleration)
+
+    def __queueMove(self, axis, position):
+        with self.__lock:
+            distance = position - self.positions.get(axis, 0)
+            self.positions[axis] = position
+        duration = self.getMoveDuration(distance)
+        with self.__lock:
+            self.__motionEndTime = max(self.__motionEndTime, getClock().monotonic()) + duration
+
+    def __record(self, name, *args):
+        self.__logger.debug('{}{}'.format(name, args))
+        with self.__lock:
+            self.commands.append((name, args))
@@ -1,4 +1,11 @@
+import time
+import threading
 from internal.notifier import NotificationLevel, sendNotification
+from internal.journal import RecordType, getJournal
+from internal.metrics import registry
+import internal.tracing as tracing
+
+MQTT_MESSAGES = registry.counter('machineapp_mqtt_messages_total', 'MQTT messages received, by receiver', ['component', 'name'])
 
 class IOValue:
     def __init__(self, name, isInput, device, pin):
@@ -7,6 +14,9 @@ class IOValue:
         self.device = device
         self.pin = pin
         self.state = 0
+        self.sentState = None           # Last value sent to the Web Client
+        self.sentTime = None            # time.monotonic() at which it was sent
+        self.isPending = False          # A change is waiting for the end of the conflation window
 
     def isEqual(self, isInput, device, pin):
         return self.isInput == isInput and self.device == device and self.pin == pin
@@ -20,16 +30,63 @@ class IOValue:
             "value": self.state
         }
 
+def _toFloat(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
 class IOMonitor:
     '''
     Used to monitor the state of a group of IO modules and return their
     current values to the Web Client via the Notifier.
+
+    Only changes are sent: a message repeating the value last sent is dropped. Conflation is
+    opt-in: with a conflationWindowSeconds above 0, a pin that changes again within that
+    window of its last notification is held back, and only its latest value is sent when the
+    window ends. It trades latency, and the intermediate values, for fewer messages.
+
+    Periodic resyncs are opt-in too: with a resyncIntervalSeconds above 0, the value of every
+    monitored IO is sent again at that period, so that clients that missed something catch up.
+
+    Both periods are in real time, even in a simulated run (see internal.clock): they pace
+    the traffic to the Web Client, not the machine. A background thread is only started when
+    one of them is enabled, once the first IO is monitored. Call 'close' when you are done
+    with the monitor, or create it with BaseMachineAppEngine.createIOMonitor, which closes it
+    at the end of the run.
     '''
+    MAX_CACHED_TOPICS = 1024
+    CONFLATION_WINDOW_SECONDS   = 0        # Every change is sent right away
+    RESYNC_INTERVAL_SECONDS     = 0        # No periodic resync
 
-    def __init__(self, machineMotion):
+    def __init__(self, machineMotion, conflationWindowSeconds=None, resyncIntervalSeconds=None):
+        '''
+        params:
+            machineMotion: MachineMotion
+                Machine whose IOs are monitored
+            conflationWindowSeconds: float
+                (Optional) Minimum time between two notifications of the same IO, e.g. 0.05 for a chattering input. 0 sends every change.
+                Defaults to CONFLATION_WINDOW_SECONDS.
+            resyncIntervalSeconds: float
+                (Optional) Period of the full resync. None or 0 disables it. Defaults to RESYNC_INTERVAL_SECONDS.
+        '''
         self.__machineMotion = machineMotion
+        self.__conflationWindowSeconds = conflationWindowSeconds if conflationWindowSeconds != None else IOMonitor.CONFLATION_WINDOW_SECONDS
+        self.__resyncIntervalSeconds = resyncIntervalSeconds if resyncIntervalSeconds != None else IOMonitor.RESYNC_INTERVAL_SECONDS
+
+        self.__monitoredByKey = {}      # Maps (isInput, device, pin) to the monitored IOValue
+        self.__monitoredByName = {}     # Maps names to the monitored IOValue
+        self.__topicCache = {}          # Maps MQTT topics to their parsed (isInput, device, pin), or None if the topic is not an IO value
+
+        self.__condition = threading.Condition()    # Guards the pending list and the sent state of every IOValue
+        self.__pending = []             # IOValues held back until the end of their conflation window
+        self.__isRunning = True
+        self.__stats = { "received": 0, "sent": 0, "suppressed": 0, "conflated": 0, "resyncs": 0 }
+
+        self.__messagesMetric = MQTT_MESSAGES.labels('io_monitor', '')
+
+        self.__flusherThread = None     # Started with the first monitored IO, if conflation or resyncs are enabled
 
-        self.__monitorList = []
         self.__machineMotion.addMqttCallback(self.__mqttEventCallback)
 
     def startMonitoring(self, name, isInput, device, pin):
@@ -39,7 +96,8 @@ class IOMonitor:
 
         params:
             name: str
-                Friendly name of the IO that you want to be sent to the Web Client. Must be unique.
+                Friendly name of the IO that you want to be sent to the Web Client. Must be unique,
+                and an IO can only be monitored under one name.
 
             isInput: bool
                 If set to True, we will monitor an input, otherwise, we will monitor an output
@@ -51,13 +109,16 @@ class IOMonitor:
 
         returns:
             bool
-                Specifies whether or not the provided name is already taken
+                False if the provided name is already taken, or the IO is already monitored
         '''
-        for monitoredItem in self.__monitorList:
-            if monitoredItem.name == name:
-                return False
+        key = (isInput, device, pin)
+        if name in self.__monitoredByName or key in self.__monitoredByKey:
+            return False
 
-        self.__monitorList.append(IOValue(name, isInput, device, pin))
+        ioValue = IOValue(name, isInput, device, pin)
+        self.__monitoredByName[name] = ioValue
+        self.__monitoredByKey[key] = ioValue
+        self.__startFlusher()
         return True
 
     def stopMonitoring(self, name):
@@ -72,34 +133,166 @@ class IOMonitor:
             bool
                 Whether or not it could be removed
         '''
-        for idx in range(self.__monitorList):
-            if self.__monitorList[idx].name == name:
-                del self.__monitorList[idx]
-                return True
-        
-        return False
+        ioValue = self.__monitoredByName.pop(name, None)
+        if ioValue == None:
+            return False
 
-    def __mqttEventCallback(self, topic, msg):
+        del self.__monitoredByKey[(ioValue.isInput, ioValue.device, ioValue.pin)]
+        return True
+
+    def getStats(self):
+        '''
+        Returns the number of MQTT messages received for monitored IOs, and what became of them.
+
+        returns:
+            dict
+                received, sent, suppressed (value unchanged), conflated (superseded within
+                the window) and resyncs
+        '''
+        with self.__condition:
+            return dict(self.__stats)
+
+    def resync(self):
+        ''' Sends the current value of every monitored IO, whether it changed or not '''
+        with self.__condition:
+            self.__stats["resyncs"] += 1
+            ioValues = list(self.__monitoredByKey.values())
+            for ioValue in ioValues:
+                ioValue.isPending = False
+            self.__pending = []
+
+        for ioValue in ioValues:
+            self.__send(ioValue)
+
+    def close(self):
+        '''
+        Stops monitoring: pending changes are sent, the background flusher is stopped and
+        the MQTT messages received from then on are ignored.
+        '''
+        with self.__condition:
+            self.__isRunning = False
+            self.__condition.notify()
+            flusherThread = self.__flusherThread
+
+        if flusherThread != None:
+            flusherThread.join()
+
+    def __startFlusher(self):
+        if self.__conflationWindowSeconds <= 0 and not self.__resyncIntervalSeconds:
+            return
+
+        with self.__condition:
+            if self.__flusherThread != None or not self.__isRunning:
+                return
+            self.__flusherThread = threading.Thread(name='IOMonitorFlusher', target=self.__runFlusher, daemon=True)
+            self.__flusherThread.start()
+
+    def __parseTopic(self, topic):
+        '''
+        Splits an MQTT topic into (isInput, device, pin). Returns None for topics
+        that do not carry an IO value. Results are cached per topic.
+        '''
+        try:
+            return self.__topicCache[topic]
+        except KeyError:
+            pass
+
+        key = None
         topicParts = topic.split('/')
-        deviceType = topicParts[1]
-        if deviceType != 'io-expander':
+        if len(topicParts) >= 5 and topicParts[1] == 'io-expander' and topicParts[3] != 'available':
+            isInput = topicParts[3] == 'digital-input'
+            try:
+                key = (isInput, int( topicParts[2] ), int( topicParts[4] ))
+            except ValueError:
+                key = None
+
+        if len(self.__topicCache) >= IOMonitor.MAX_CACHED_TOPICS:
+            self.__topicCache.clear()
+        self.__topicCache[topic] = key
+        return key
+
+    def __mqttEventCallback(self, topic, msg):
+        if not self.__isRunning:        # MachineMotion has no way to remove the callback
+            return
+
+        self.__messagesMetric.inc()
+        key = self.__parseTopic(topic)
+        if key == None:
             return
 
-        if (topicParts[3] == 'available'):
+        monitorItem = self.__monitoredByKey.get(key)
+        if monitorItem == None:
             return
 
-        isInput = False
-        if topicParts[3] == 'digital-output':
-            isInput = False
-        elif topicParts[3] == 'digital-input':
-            isInput = True
-
-        device = int( topicParts[2] )
-        pin = int( topicParts[4] )
-        value  = msg
-
-        for monitorItem in self.__monitorList:
-            if monitorItem.isEqual(isInput, device, pin):
-                monitorItem.state = value
-                sendNotification(NotificationLevel.IO_STATE, '', monitorItem.toJson())
-                break
\ No newline at end of file
+        if tracing.activeTracer != None:
+            tracing.activeTracer.instant('io ' + monitorItem.name, 'mqtt', {"topic": topic, "value": str(msg)})
+
+        journal = getJournal()
+        if journal != None and msg != monitorItem.state:
+            journal.record(RecordType.IO_EDGE, monitorItem.name, int(monitorItem.isInput), monitorItem.device, monitorItem.pin, _toFloat(msg))
+
+        with self.__condition:
+            self.__stats["received"] += 1
+            monitorItem.state = msg
+            if msg == monitorItem.sentState:
+                if monitorItem.isPending:       # Changed and changed back within the window
+                    monitorItem.isPending = False
+                    self.__pending.remove(monitorItem)
+                    self.__stats["conflated"] += 1
+                else:
+                    self.__stats["suppressed"] += 1
+                return
+
+            if monitorItem.isPending:
+                self.__stats["conflated"] += 1
+                return
+
+            now = time.monotonic()
+            if monitorItem.sentTime != None and now - monitorItem.sentTime < self.__conflationWindowSeconds:
+                monitorItem.isPending = True
+                self.__pending.append(monitorItem)
+                self.__condition.notify()
+                return
+
+        self.__send(monitorItem)
+
+    def __send(self, ioValue):
+        with self.__condition:
+            ioValue.sentState = ioValue.state
+            ioValue.sentTime = time.monotonic()
+            self.__stats["sent"] += 1
+            payload = ioValue.toJson()
+
+        sendNotification(NotificationLevel.IO_STATE, '', payload)
+
+    def __runFlusher(self):
+        '''
+        Sends held back changes when their conflation window ends, and resyncs periodically.
+        '''
+        nextResyncTime = time.monotonic() + self.__resyncIntervalSeconds if self.__resyncIntervalSeconds else float('inf')
+        while True:
+            with self.__condition:
+                if not self.__isRunning:
+                    due = list(self.__pending)
+                else:
+                    now = time.monotonic()
+                    due = [v for v in self.__pending if now - v.sentTime >= self.__conflationWindowSeconds]
+                    if len(due) == 0 and now < nextResyncTime:
+                        nextDueTime = min([v.sentTime + self.__conflationWindowSeconds for v in self.__pending], default=float('inf'))
+                        timeout = min(nextDueTime, nextResyncTime) - now
+                        self.__condition.wait(timeout if timeout != float('inf') else None)
+                        continue
+
+                for ioValue in due:
+                    ioValue.isPending = False
+                    self.__pending.remove(ioValue)
+
+            for ioValue in due:
+                self.__send(ioValue)
+
+            if not self.__isRunning:
+                return
+
+            if time.monotonic() >= nextResyncTime:
+                self.resync()
+                nextResyncTime = time.monotonic() + self.__resyncIntervalSeconds
@@ -0,0 +1,424 @@
+import os
+import mmap
+import atexit
+import bisect
+import struct
+import logging
+import threading
+from collections import deque, namedtuple
+from internal.clock import getClock
+
+JournalRecord = namedtuple('JournalRecord', ['timeSeconds', 'recordType', 'code', 'name', 'device', 'pin', 'value'])
+
+class RecordType:
+    '''
+    Kinds of records written to the journal. What the other fields hold depends on the kind:
+
+        RUN_START, RUN_END:     name = None
+        STATE_ENTER:            name = state entered, value = seconds spent in the previous state
+        NOTIFICATION:           name = message, code = level code (see wire_format.LEVEL_CODES)
+        IO_EDGE:                name = IO name, code = 1 for inputs, device, pin, value = new value
+        CYCLE_COMPLETE:         name = cycle name, value = seconds since the previous cycle (or the start of the run)
+    '''
+    RUN_START       = 1
+    RUN_END         = 2
+    STATE_ENTER     = 3
+    NOTIFICATION    = 4
+    IO_EDGE         = 5
+    CYCLE_COMPLETE  = 6
+
+class Journal:
+    '''
+    Append-only record of what happened on the machine, kept for weeks on the controller.
+
+    Records have a fixed 24 bytes layout (f64 time, u8 type, u8 code, u16 name id, u16 device,
+    u16 pin, f64 value) and are appended to segment files. Names are interned in a string
+    table written next to each segment, so that every segment can be read on its own.
+
+    'record' only queues the record: a background thread writes the queue in batches, so
+    that the code recording never waits for the disk, segment rotations included. When more
+    than maxPending records are waiting, new records are dropped (see droppedCount). Call
+    'flush' to make sure that every record so far is on disk. Queries flush first.
+
+    Record times are wall-clock times, which may go backwards (e.g. when the controller sets
+    its clock), so queries never assume that they increase. The header of each segment holds
+    the earliest and latest time of its records, so that queries only read the segments that
+    overlap them. Every INDEX_INTERVAL records, the latest time so far and the position of
+    the record are added to the segment's sparse index: a query binary searches the index
+    for the first position where a record in range can be, then reads the segment through
+    mmap from that position to its end.
+
+    Segments rotate once they reach MAX_SEGMENT_BYTES, and are ordered by sequence number.
+    The oldest segments are deleted once the journal exceeds MAX_TOTAL_BYTES.
+
+    Thread-safe.
+    '''
+    MAGIC               = b'MAJ1'
+    VERSION             = 2
+    MAX_SEGMENT_BYTES   = 4 * 1024 * 1024       # ~175k records
+    MAX_TOTAL_BYTES     = 512 * 1024 * 1024
+    MAX_PENDING         = 65536                 # Records waiting for the writer thread
+    INDEX_INTERVAL      = 256
+
+    SEGMENT_EXTENSION   = '.seg'
+    INDEX_EXTENSION     = '.idx'
+    STRINGS_EXTENSION   = '.str'
+
+    __header = struct.Struct('<4sHHdddI')       # Magic, version, record size, start time, earliest time, latest time, record count
+    __record = struct.Struct('<dBBHHHd')
+    __indexEntry = struct.Struct('<dI')         # Latest time up to the record, record number
+    __stringEntry = struct.Struct('<HH')        # Id, utf-8 size
+
+    NO_NAME = 0xFFFF
+
+    def __init__(self, directory, maxSegmentBytes=MAX_SEGMENT_BYTES, maxTotalBytes=MAX_TOTAL_BYTES, maxPending=MAX_PENDING):
+        '''
+        params:
+            directory: str
+                Directory holding the segments. Created if needed.
+            maxSegmentBytes: int
+                (Optional) Size at which a new segment is started
+            maxTotalBytes: int
+                (Optional) Size above which the oldest segments are deleted
+            maxPending: int
+                (Optional) Records that can wait for the writer thread before new ones are dropped
+        '''
+        self.__logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.maxSegmentBytes = maxSegmentBytes
+        self.maxTotalBytes = maxTotalBytes
+        self.maxPending = maxPending
+        self.droppedCount = 0           # Records dropped because too many were waiting
+
+        self.__condition = threading.Condition()    # Guards the queue of records and the state of the writer thread
+        self.__pending = deque()        # Records waiting for the writer thread
+        self.__isWriting = False        # The writer thread is writing a batch
+        self.__thread = None            # Started with the first record
+
+        self.__lock = threading.Lock()  # Guards the files of the current segment
+        self.__segmentPath = None       # Path of the segment being written, without extension
+        self.__segmentFile = None
+        self.__indexFile = None
+        self.__stringsFile = None
+        self.__stringIds = {}           # Maps the names of the current segment to their id
+        self.__recordCount = 0          # Records in the current segment
+        self.__startTime = None         # Time of the first record of the current segment
+        self.__earliestTime = float('inf')      # Earliest time in the current segment
+        self.__latestTime = float('-inf')       # Latest time in the current segment
+
+        self.__stringTablesLock = threading.Lock()
+        self.__stringTables = {}        # Maps segment paths to their (size, strings) read back by queries
+
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, recordType, name=None, code=0, device=0, pin=0, value=0.0, timeSeconds=None):
+        ''' Queues a record. Never waits for the disk. See RecordType for the meaning of the fields. '''
+        if timeSeconds == None:
+            timeSeconds = getClock().time()
+
+        with self.__condition:
+            if len(self.__pending) >= self.maxPending:
+                self.droppedCount += 1
+                return
+
+            self.__pending.append((timeSeconds, recordType, name, code, device, pin, value))
+            if self.__thread == None:
+                self.__thread = threading.Thread(name='JournalWriter', target=self.__run, daemon=True)
+                self.__thread.start()
+            self.__condition.notify_all()
+
+    def flush(self, timeout=None):
+        '''
+        Waits until every record queued so far is written to disk.
+
+        returns:
+            bool
+                False if the timeout expired first
+        '''
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: len(self.__pending) == 0 and not self.__isWriting, timeout):
+                return False
+
+        with self.__lock:
+            self.__flushLocked()
+        return True
+
+    def close(self):
+        self.flush()
+        with self.__lock:
+            self.__closeSegmentLocked()
+
+    def query(self, startTime=None, endTime=None, recordType=None, name=None):
+        '''
+        Returns the records between two times, in the order they were written.
+
+        params:
+            startTime: float
+                (Optional) Earliest time, in seconds since the epoch, inclusive
+            endTime: float
+                (Optional) Latest time, in seconds since the epoch, exclusive
+            recordType: int
+                (Optional) Only return records of this RecordType
+            name: str
+                (Optional) Only return records with this name
+
+        returns:
+            list<JournalRecord>
+        '''
+        return list(self.__iterate(startTime, endTime, recordType, name))
+
+    def count(self, recordType, startTime=None, endTime=None, name=None):
+        '''
+        Counts records, e.g. the sheets cut between 02:00 and 03:00:
+
+            journal.count(RecordType.CYCLE_COMPLETE, start, end, name='sheet')
+        '''
+        return sum(1 for _ in self.__iterate(startTime, endTime, recordType, name))
+
+    def getSegments(self):
+        ''' Returns the paths (without extension) of every segment, oldest first '''
+        names = [f[:-len(Journal.SEGMENT_EXTENSION)] for f in os.listdir(self.directory) if f.endswith(Journal.SEGMENT_EXTENSION)]
+        return [os.path.join(self.directory, name) for name in sorted(names, key=Journal.__getSequence)]
+
+    @staticmethod
+    def __getSequence(name):
+        ''' Segment names end with their sequence number, e.g. journal-001700000000000-00000012 '''
+        try:
+            return int(name.rsplit('-', 1)[1])
+        except (IndexError, ValueError):
+            return -1
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: len(self.__pending) > 0)
+                batch = list(self.__pending)
+                self.__pending.clear()
+                self.__isWriting = True
+
+            try:
+                with self.__lock:
+                    for record in batch:
+                        self.__writeLocked(*record)
+                    self.__flushLocked()
+            except Exception as e:
+                self.__logger.error('Unable to write {} journal records: {}'.format(len(batch), e))
+            finally:
+                with self.__condition:
+                    self.__isWriting = False
+                    self.__condition.notify_all()
+
+    def __writeLocked(self, timeSeconds, recordType, name, code, device, pin, value):
+        if self.__segmentFile == None or self.__segmentFile.tell() >= self.maxSegmentBytes:
+            self.__startSegment(timeSeconds)
+
+        nameId = self.__internLocked(name) if name != None else Journal.NO_NAME
+        self.__segmentFile.write(Journal.__record.pack(timeSeconds, recordType, code, nameId, device & 0xFFFF, pin & 0xFFFF, value))
+        self.__earliestTime = min(self.__earliestTime, timeSeconds)
+        self.__latestTime = max(self.__latestTime, timeSeconds)
+        if self.__recordCount % Journal.INDEX_INTERVAL == 0:
+            self.__indexFile.write(Journal.__indexEntry.pack(self.__latestTime, self.__recordCount))
+        self.__recordCount += 1
+
+    def __iterate(self, startTime, endTime, recordType, name):
+        self.flush()
+        startTime = startTime if startTime != None else float('-inf')
+        endTime = endTime if endTime != None else float('inf')
+
+        for path in self.getSegments():
+            bounds = self.__readBounds(path)
+            if bounds == None:
+                continue
+            earliestTime, latestTime, isComplete = bounds
+            if isComplete and (latestTime < startTime or earliestTime >= endTime):
+                continue
+            for record in self.__iterateSegment(path, startTime, endTime, recordType, name):
+                yield record
+
+    def __iterateSegment(self, path, startTime, endTime, recordType, name):
+        strings = self.__readStrings(path)
+        nameId = None
+        if name != None:
+            nameId = next((stringId for stringId, string in strings.items() if string == name), None)
+            if nameId == None:
+                return
+
+        firstRecord = self.__findFirstRecord(path, startTime)
+        recordSize = Journal.__record.size
+        with open(path + Journal.SEGMENT_EXTENSION, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= Journal.__header.size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = Journal.__header.size + firstRecord * recordSize
+                while offset + recordSize <= size:
+                    timeSeconds, rType, code, rNameId, device, pin, value = Journal.__record.unpack_from(data, offset)
+                    offset += recordSize
+                    if timeSeconds < startTime or timeSeconds >= endTime:
+                        continue
+                    if (recordType != None and rType != recordType) or (nameId != None and rNameId != nameId):
+                        continue
+                    yield JournalRecord(timeSeconds, rType, code, strings.get(rNameId), device, pin, value)
+
+    def __findFirstRecord(self, path, startTime):
+        '''
+        Returns the number of a record before which every record is earlier than startTime,
+        using the sparse index. Index times are the latest time so far, so they never decrease.
+        '''
+        try:
+            with open(path + Journal.INDEX_EXTENSION, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return 0
+
+        entries = list(Journal.__indexEntry.iter_unpack(content[:len(content) - len(content) % Journal.__indexEntry.size]))
+        position = bisect.bisect_left([entry[0] for entry in entries], startTime) - 1
+        return entries[position][1] if position >= 0 else 0
+
+    def __readBounds(self, path):
+        '''
+        Returns the (earliest time, latest time, is complete) of a segment, or None if it cannot
+        be read. The bounds are only complete if the header was updated after the last record
+        was written (i.e. the MachineApp did not stop in between).
+        '''
+        try:
+            with open(path + Journal.SEGMENT_EXTENSION, 'rb') as f:
+                magic, version, recordSize, _, earliestTime, latestTime, recordCount = Journal.__header.unpack(f.read(Journal.__header.size))
+                size = os.fstat(f.fileno()).st_size
+        except (OSError, struct.error):
+            return None
+
+        if magic != Journal.MAGIC or version != Journal.VERSION or recordSize != Journal.__record.size:
+            return None
+        return earliestTime, latestTime, recordCount == (size - Journal.__header.size) // recordSize
+
+    def __readStrings(self, path):
+        try:
+            size = os.path.getsize(path + Journal.STRINGS_EXTENSION)
+        except OSError:
+            return {}
+
+        with self.__stringTablesLock:
+            cached = self.__stringTables.get(path)
+        if cached != None and cached[0] == size:
+            return cached[1]
+
+        strings = {}
+        with open(path + Journal.STRINGS_EXTENSION, 'rb') as f:
+            content = f.read()
+        offset = 0
+        while offset + Journal.__stringEntry.size <= len(content):
+            stringId, length = Journal.__stringEntry.unpack_from(content, offset)
+            offset += Journal.__stringEntry.size
+            strings[stringId] = content[offset:offset + length].decode('utf-8', errors='replace')
+            offset += length
+
+        with self.__stringTablesLock:
+            self.__stringTables[path] = (size, strings)
+        return strings
+
+    def __internLocked(self, name):
+        nameId = self.__stringIds.get(name)
+        if nameId != None:
+            return nameId
+
+        if len(self.__stringIds) >= Journal.NO_NAME:     # Table full: the name is lost for this segment
+            return Journal.NO_NAME
+
+        nameId = len(self.__stringIds)
+        self.__stringIds[name] = nameId
+        encoded = name.encode('utf-8')[:0xFFFF]
+        self.__stringsFile.write(Journal.__stringEntry.pack(nameId, len(encoded)) + encoded)
+        return nameId
+
+    def __startSegment(self, timeSeconds):
+        self.__closeSegmentLocked()
+
+        # The time in the name is for humans only: segments are ordered by their sequence number
+        existing = self.getSegments()
+        sequence = Journal.__getSequence(os.path.basename(existing[-1])) + 1 if len(existing) > 0 else 0
+        self.__segmentPath = os.path.join(self.directory, 'journal-{:015d}-{:08d}'.format(max(int(timeSeconds * 1000), 0), sequence))
+        self.__segmentFile = open(self.__segmentPath + Journal.SEGMENT_EXTENSION, 'wb')
+        self.__indexFile = open(self.__segmentPath + Journal.INDEX_EXTENSION, 'wb')
+        self.__stringsFile = open(self.__segmentPath + Journal.STRINGS_EXTENSION, 'wb')
+        self.__stringIds = {}
+        self.__recordCount = 0
+        self.__startTime = timeSeconds
+        self.__earliestTime = float('inf')
+        self.__latestTime = float('-inf')
+        self.__segmentFile.write(self.__packHeader())
+        self.__enforceRetention()
+
+    def __packHeader(self):
+        return Journal.__header.pack(Journal.MAGIC, Journal.VERSION, Journal.__record.size, self.__startTime,
+            self.__earliestTime, self.__latestTime, self.__recordCount)
+
+    def __closeSegmentLocked(self):
+        if self.__segmentFile == None:
+            return
+
+        self.__flushLocked()
+        for f in (self.__segmentFile, self.__indexFile, self.__stringsFile):
+            f.close()
+        self.__segmentFile = self.__indexFile = self.__stringsFile = None
+
+    def __flushLocked(self):
+        if self.__segmentFile == None:
+            return
+
+        # Strings and index first: a record must never reference a name that is not on disk.
+        # The header is rewritten once the records are written: its bounds and count then
+        # cover every record in the file (seek writes the buffered records out first).
+        self.__stringsFile.flush()
+        self.__indexFile.flush()
+        self.__segmentFile.seek(0)
+        self.__segmentFile.write(self.__packHeader())
+        self.__segmentFile.seek(0, os.SEEK_END)
+        self.__segmentFile.flush()
+
+    def __enforceRetention(self):
+        segments = self.getSegments()
+        sizes = [self.__getSegmentBytes(path) for path in segments]
+        total = sum(sizes)
+        for path, size in zip(segments, sizes):
+            if total <= self.maxTotalBytes or path == self.__segmentPath:
+                break
+            for extension in (Journal.SEGMENT_EXTENSION, Journal.INDEX_EXTENSION, Journal.STRINGS_EXTENSION):
+                try:
+                    os.remove(path + extension)
+                except OSError as e:
+                    self.__logger.warning('Unable to delete journal file {}: {}'.format(path + extension, e))
+            with self.__stringTablesLock:
+                self.__stringTables.pop(path, None)
+            total -= size
+
+    def __getSegmentBytes(self, path):
+        size = 0
+        for extension in (Journal.SEGMENT_EXTENSION, Journal.INDEX_EXTENSION, Journal.STRINGS_EXTENSION):
+            try:
+                size += os.path.getsize(path + extension)
+            except OSError:
+                pass
+        return size
+
+globalJournal = None
+
+def initializeJournal(directory, **kwargs):
+    '''
+    Starts journaling to the provided directory. Until this is called, nothing is journaled.
+
+    returns:
+        Journal
+    '''
+    global globalJournal
+    if globalJournal != None:
+        logging.error('Attempting to initialize the globalJournal again')
+        return globalJournal
+
+    globalJournal = Journal(directory, **kwargs)
+    atexit.register(globalJournal.flush, 2)     # Records queued right before the process exits must not be lost
+    return globalJournal
+
+def getJournal():
+    ''' Retrieves the global journal, or None if journaling is not enabled '''
+    return globalJournal
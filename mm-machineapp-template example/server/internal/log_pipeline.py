@@ -0,0 +1,268 @@
+import os
+import sys
+import copy
+import queue
+import atexit
+import logging
+import threading
+from internal.clock import getClock
+
+DEFAULT_FORMAT = '%(asctime)s {%(name)s:%(lineno)d} (%(levelname)s) - %(message)s'
+
+class BoundedQueueHandler(logging.Handler):
+    '''
+    Logging handler that only puts records in a bounded queue, for a LogWriter to write them
+    from its own thread. When the queue is full, records are dropped and counted: emitting
+    a record never waits.
+    '''
+
+    def __init__(self, recordQueue):
+        super().__init__()
+        self.recordQueue = recordQueue
+        self.droppedCount = 0
+
+    def prepare(self, record):
+        '''
+        Renders the message and the exception now, while the arguments are still valid, so
+        that the writer thread only has to format plain strings.
+        '''
+        record = copy.copy(record)      # Other handlers may still need the original
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.recordQueue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.droppedCount += 1
+        except Exception:
+            self.handleError(record)
+
+class LogWriter:
+    '''
+    Background thread writing the records of a BoundedQueueHandler to the log file (and to
+    the console, which is read by the parent process). Everything that piled up is written
+    and flushed in one go. The log file is rotated once it reaches maxBytes, keeping
+    backupCount old files (machine_app.log.1, machine_app.log.2...).
+    '''
+    MAX_BATCH_SIZE = 512
+
+    def __init__(self, recordQueue, handler, path, formatter, maxBytes, backupCount, console=None):
+        self.__recordQueue = recordQueue
+        self.__handler = handler
+        self.__formatter = formatter
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.__console = console
+        self.__file = open(path, 'a', encoding='utf-8') if path != None else None
+        self.__reportedDroppedCount = 0
+        self.__stopSentinel = object()
+
+        self.__thread = threading.Thread(name='LogWriter', target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        ''' Writes the queued records, then stops the thread '''
+        try:
+            self.__recordQueue.put(self.__stopSentinel, timeout=timeout)
+        except queue.Full:
+            pass
+        self.__thread.join(timeout)
+
+    def __run(self):
+        isRunning = True
+        while isRunning:
+            batch = [self.__recordQueue.get()]
+            while len(batch) < LogWriter.MAX_BATCH_SIZE:
+                try:
+                    batch.append(self.__recordQueue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if self.__stopSentinel in batch:
+                isRunning = False
+                batch = [record for record in batch if record is not self.__stopSentinel]
+
+            lines = []
+            for record in batch:
+                try:
+                    lines.append(self.__formatter.format(record) + '\n')
+                except Exception:
+                    lines.append('Unable to format log record: {}\n'.format(record.msg))
+
+            droppedCount = self.__handler.droppedCount
+            if droppedCount != self.__reportedDroppedCount:
+                warning = logging.LogRecord(__name__, logging.WARNING, __file__, 0, '{} log records dropped: the log queue was full'.format(
+                    droppedCount - self.__reportedDroppedCount), None, None)
+                lines.append(self.__formatter.format(warning) + '\n')
+                self.__reportedDroppedCount = droppedCount
+
+            self.__write(''.join(lines))
+
+        if self.__file != None:
+            self.__file.close()
+
+    def __write(self, text):
+        if self.__console != None:
+            try:
+                self.__console.write(text)
+                self.__console.flush()
+            except Exception:
+                pass
+
+        if self.__file == None:
+            return
+
+        try:
+            self.__file.write(text)
+            self.__file.flush()
+            if self.maxBytes > 0 and self.__file.tell() >= self.maxBytes:
+                self.__rotate()
+        except OSError as e:
+            if self.__console != None:
+                self.__console.write('Unable to write to {}: {}\n'.format(self.path, e))
+
+    def __rotate(self):
+        self.__file.close()
+        for index in range(self.backupCount - 1, 0, -1):
+            source = '{}.{}'.format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, index + 1))
+        if self.backupCount > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.__file = open(self.path, 'a', encoding='utf-8')
+
+class RateLimitedLog:
+    '''
+    Wraps a logger for chatty messages (e.g. one per MQTT message): at most one message
+    per key is logged every minIntervalSeconds. The next one that goes through reports
+    how many were suppressed in the meantime.
+
+    Thread-safe.
+    '''
+
+    def __init__(self, logger, minIntervalSeconds=1.0):
+        self.logger = logger
+        self.minIntervalSeconds = minIntervalSeconds
+        self.__lock = threading.Lock()  # Guards the two dictionaries
+        self.__lastLogTimes = {}        # Maps keys to the monotonic time they were last logged
+        self.__suppressedCounts = {}
+
+    def log(self, level, msg, *args, key=None):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        key = key if key != None else msg
+        now = getClock().monotonic()
+        with self.__lock:
+            lastLogTime = self.__lastLogTimes.get(key)
+            if lastLogTime != None and now - lastLogTime < self.minIntervalSeconds:
+                self.__suppressedCounts[key] = self.__suppressedCounts.get(key, 0) + 1
+                return
+
+            self.__lastLogTimes[key] = now
+            suppressedCount = self.__suppressedCounts.pop(key, 0)
+
+        if suppressedCount > 0:
+            msg = msg + ' ({} similar messages suppressed)'.format(suppressedCount)
+        if sys.version_info >= (3, 8):
+            self.logger.log(level, msg, *args, stacklevel=3)    # Report the line of the caller, not this one
+        else:
+            self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args, key=None):
+        self.log(logging.DEBUG, msg, *args, key=key)
+
+    def info(self, msg, *args, key=None):
+        self.log(logging.INFO, msg, *args, key=key)
+
+activeWriter = None
+replacedHandlers = []       # Handlers of the root logger removed by installLogPipeline, restored by uninstallLogPipeline
+replacedLevel = None        # Level of the root logger before installLogPipeline
+
+def installLogPipeline(path='machine_app.log', maxBytes=5 * 1024 * 1024, backupCount=3, maxQueueSize=10000, level=None, console=True):
+    '''
+    Routes every log record of the process through a bounded queue and a LogWriter thread,
+    so that logging never waits on the disk. The handlers of the root logger writing to the
+    same file or to the console are replaced (their formatter is kept) until uninstallLogPipeline
+    is called. Does nothing if the pipeline is already installed.
+
+    params:
+        path: str
+            Log file. None only logs to the console.
+        maxBytes: int
+            Size at which the log file is rotated. 0 disables rotation.
+        backupCount: int
+            Number of rotated files kept
+        maxQueueSize: int
+            Records waiting to be written, beyond which new records are dropped
+        level: int
+            (Optional) Level of the root logger. By default, the current level is kept, or set to
+            INFO if logging was not configured yet.
+        console: bool
+            Whether or not records are also written to stdout
+
+    returns:
+        LogWriter
+    '''
+    global activeWriter, replacedLevel
+    if activeWriter != None:
+        return activeWriter
+
+    root = logging.getLogger()
+    replacedLevel = root.level
+    if level == None and len(root.handlers) == 0:
+        level = logging.INFO
+    formatter = logging.Formatter(DEFAULT_FORMAT)
+    absolutePath = os.path.abspath(path) if path != None else None
+    for handler in list(root.handlers):
+        isSameFile = isinstance(handler, logging.FileHandler) and handler.baseFilename == absolutePath
+        isConsole = type(handler) == logging.StreamHandler
+        if isSameFile or isConsole:
+            if handler.formatter != None:
+                formatter = handler.formatter
+            root.removeHandler(handler)
+            replacedHandlers.append(handler)
+
+    recordQueue = queue.Queue(maxQueueSize)
+    queueHandler = BoundedQueueHandler(recordQueue)
+    activeWriter = LogWriter(recordQueue, queueHandler, path, formatter, maxBytes, backupCount, sys.stdout if console else None)
+    root.addHandler(queueHandler)
+    if level != None:
+        root.setLevel(level)
+    atexit.register(activeWriter.stop, 2)
+    return activeWriter
+
+def uninstallLogPipeline(timeout=2):
+    '''
+    Undoes installLogPipeline: writes the queued records, stops the LogWriter and gives the
+    root logger its handlers and level back. Does nothing if the pipeline is not installed.
+
+    params:
+        timeout: float
+            Maximum number of seconds to wait for the queued records to be written
+    '''
+    global activeWriter, replacedLevel
+    if activeWriter == None:
+        return
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, BoundedQueueHandler):
+            root.removeHandler(handler)
+    atexit.unregister(activeWriter.stop)
+    activeWriter.stop(timeout)
+    activeWriter = None
+
+    for handler in replacedHandlers:
+        root.addHandler(handler)
+    replacedHandlers.clear()
+    root.setLevel(replacedLevel)
+    replacedLevel = None
@@ -0,0 +1,309 @@
+import bisect
+import logging
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+class _Child:
+    ''' Value of a metric for one set of label values '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+class CounterChild(_Child):
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class GaugeChild(_Child):
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+class HistogramChild(_Child):
+    def __init__(self, buckets):
+        super().__init__()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # Last one is +Inf
+        self.count = 0
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.value += value
+
+class _Metric:
+    '''
+    Family of values sharing a name, one per set of label values. Metrics without labels
+    can be updated directly, e.g. counter.inc(). Otherwise, get the value of a set of labels
+    once with 'labels' and keep it around, so that updating it is a single locked addition.
+    '''
+    TYPE = None
+
+    def __init__(self, name, documentation, labelNames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self.__lock = threading.Lock()
+        self.__children = {}            # Maps tuples of label values to their child
+        self.__function = None
+        self._default = self.labels() if len(self.labelNames) == 0 else None     # Child of metrics without labels
+
+    def labels(self, *labelValues):
+        labelValues = tuple(str(value) for value in labelValues)
+        if len(labelValues) != len(self.labelNames):
+            raise ValueError('{} expects labels {}'.format(self.name, self.labelNames))
+
+        child = self.__children.get(labelValues)
+        if child == None:
+            with self.__lock:
+                child = self.__children.setdefault(labelValues, self._createChild())
+        return child
+
+    def remove(self, *labelValues):
+        with self.__lock:
+            self.__children.pop(tuple(str(value) for value in labelValues), None)
+
+    def setFunction(self, function):
+        '''
+        Computes the values when the metrics are collected instead, which costs nothing in between.
+
+        params:
+            function: func() -> float | dict<tuple, float>
+                Returns the value, or a dict mapping tuples of label values to values for metrics with labels
+        '''
+        self.__function = function
+
+    def _createChild(self):
+        raise NotImplementedError()
+
+    def _getChildren(self):
+        if self.__function == None:
+            with self.__lock:
+                return list(self.__children.items())
+
+        result = self.__function()
+        if not isinstance(result, dict):
+            result = { (): result }
+
+        children = []
+        for labelValues, value in result.items():
+            child = self._createChild()
+            child.value = value
+            children.append((tuple(str(v) for v in labelValues), child))
+        return children
+
+    def _formatLabels(self, labelValues, extra=None):
+        pairs = list(zip(self.labelNames, labelValues))
+        if extra != None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(['{}="{}"'.format(name, _escape(value)) for name, value in pairs]) + '}'
+
+    def format(self):
+        ''' Returns the metric in the Prometheus text exposition format '''
+        lines = ['# HELP {} {}'.format(self.name, self.documentation.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE {} {}'.format(self.name, self.TYPE)]
+        for labelValues, child in self._getChildren():
+            lines.extend(self._formatChild(labelValues, child))
+        return '\n'.join(lines)
+
+    def _formatChild(self, labelValues, child):
+        return ['{}{} {}'.format(self.name, self._formatLabels(labelValues), _formatValue(child.value))]
+
+class Counter(_Metric):
+    ''' Value that only goes up, e.g. the number of sheets cut '''
+    TYPE = 'counter'
+
+    def _createChild(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+class Gauge(_Metric):
+    ''' Value that goes up and down, e.g. a queue depth '''
+    TYPE = 'gauge'
+
+    def _createChild(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+class Histogram(_Metric):
+    ''' Distribution of observed values, e.g. durations, over fixed buckets '''
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = sorted(buckets)
+        super().__init__(name, documentation, labelNames)
+
+    def _createChild(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _formatChild(self, labelValues, child):
+        with child._lock:
+            counts, count, total = list(child.counts), child.count, child.value
+
+        lines = []
+        cumulative = 0
+        for bound, bucketCount in zip(self.buckets + ['+Inf'], counts):
+            cumulative += bucketCount
+            le = bound if bound == '+Inf' else _formatValue(bound)
+            lines.append('{}_bucket{} {}'.format(self.name, self._formatLabels(labelValues, ('le', le)), cumulative))
+        lines.append('{}_sum{} {}'.format(self.name, self._formatLabels(labelValues), _formatValue(total)))
+        lines.append('{}_count{} {}'.format(self.name, self._formatLabels(labelValues), count))
+        return lines
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _formatValue(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    '''
+    Holds the metrics of the process. Use 'counter', 'gauge' and 'histogram' to get a metric,
+    which is created the first time it is asked for.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__metrics = {}         # Maps names to metrics, in creation order
+
+    def counter(self, name, documentation, labelNames=()):
+        return self.__getOrCreate(Counter, name, documentation, labelNames)
+
+    def gauge(self, name, documentation, labelNames=()):
+        return self.__getOrCreate(Gauge, name, documentation, labelNames)
+
+    def histogram(self, name, documentation, labelNames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.__getOrCreate(Histogram, name, documentation, labelNames, buckets=buckets)
+
+    def format(self):
+        ''' Returns every metric in the Prometheus text exposition format '''
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+
+        sections = []
+        for metric in metrics:
+            try:
+                sections.append(metric.format())
+            except Exception as e:
+                logging.getLogger(__name__).error('Unable to collect {}: {}'.format(metric.name, e))
+        return '\n'.join(sections) + '\n'
+
+    def __getOrCreate(self, metricClass, name, documentation, labelNames, **kwargs):
+        with self.__lock:
+            metric = self.__metrics.get(name)
+            if metric == None:
+                metric = metricClass(name, documentation, labelNames, **kwargs)
+                self.__metrics[name] = metric
+            elif not isinstance(metric, metricClass) or metric.labelNames != tuple(labelNames):
+                raise ValueError('Metric {} is already registered with another type or labels'.format(name))
+            return metric
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class MetricsServer:
+    '''
+    Serves a registry in the Prometheus text format on http://<ip>:<port>/metrics, from its
+    own thread. Metrics are only formatted when scraped.
+
+    The metrics are not authenticated: by default, they are only served to the controller
+    itself. Pass ip='0.0.0.0' to let a scraper on the network read them.
+    '''
+    DEFAULT_IP = '127.0.0.1'
+
+    def __init__(self, registry, ip=DEFAULT_IP, port=8082):
+        self.__logger = logging.getLogger(__name__)
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] not in ('/', '/metrics'):
+                    handler.send_error(404)
+                    return
+                body = registry.format().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass        # Scrapes would flood the log
+
+        self.__server = _ThreadingHTTPServer((ip, port), Handler)
+        self.port = self.__server.server_address[1]
+        thread = threading.Thread(name='MetricsServer', target=self.__server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.__logger.info('Serving metrics on {}:{}'.format(ip, self.port))
+
+    def stop(self):
+        ''' Stops serving and frees the port '''
+        self.__server.shutdown()
+        self.__server.server_close()
+
+registry = MetricsRegistry()        # Registry of the process, the one served by startMetricsServer
+globalMetricsServer = None
+
+def startMetricsServer(port=8082, ip=MetricsServer.DEFAULT_IP):
+    '''
+    Starts serving the process registry. Does nothing if it is already served.
+
+    params:
+        port: int
+            Port to listen on. 0 picks a free port.
+        ip: str
+            (Optional) Address to listen on. Only the controller itself can scrape by default.
+
+    returns:
+        MetricsServer
+            None if the port could not be opened
+    '''
+    global globalMetricsServer
+    if globalMetricsServer != None:
+        return globalMetricsServer
+
+    try:
+        globalMetricsServer = MetricsServer(registry, ip, port)
+    except OSError as e:
+        logging.getLogger(__name__).error('Unable to serve metrics on port {}: {}'.format(port, e))
+    return globalMetricsServer
+
+def stopMetricsServer():
+    ''' Stops serving the process registry, if it is served, and frees its port '''
+    global globalMetricsServer
+    if globalMetricsServer == None:
+        return
+
+    globalMetricsServer.stop()
+    globalMetricsServer = None
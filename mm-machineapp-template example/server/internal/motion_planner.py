@@ -0,0 +1,130 @@
+import math
+from collections import OrderedDict, namedtuple
+
+class AxisLimits:
+    '''
+    Kinematic limits of an axis, in mm/s, mm/s^2 and mm/s^3. maxJerk is None when the
+    acceleration may change instantly. See MotionPlanner for what a jerk limit does.
+    '''
+
+    def __init__(self, maxSpeed, maxAcceleration, maxJerk=None):
+        if maxSpeed <= 0 or maxAcceleration <= 0 or (maxJerk != None and maxJerk <= 0):
+            raise ValueError('Axis limits must be positive')
+
+        self.maxSpeed = maxSpeed
+        self.maxAcceleration = maxAcceleration
+        self.maxJerk = maxJerk
+
+    def __repr__(self):
+        return 'AxisLimits(maxSpeed={}, maxAcceleration={}, maxJerk={})'.format(self.maxSpeed, self.maxAcceleration, self.maxJerk)
+
+# Rest-to-rest move computed by MotionPlanner.
+#   speed, acceleration:    Values to send with emitSpeed and emitAcceleration for this move
+#   duration:               Expected duration of the move, in seconds
+#   rampTime:               Time spent accelerating (and as much decelerating), in seconds
+#   cruiseTime:             Time spent at constant speed, in seconds. 0 when the move is too short to cruise.
+MotionProfile = namedtuple('MotionProfile', ['distance', 'speed', 'acceleration', 'duration', 'rampTime', 'cruiseTime'])
+
+class MotionPlanner:
+    '''
+    Computes the speed and acceleration to send to the MachineMotion for a rest-to-rest
+    move of an axis, within its AxisLimits, along with how long the move will take.
+
+    The MachineMotion only takes a constant speed and acceleration, and always ramps
+    linearly (trapezoidal profile). The planner therefore does not make moves any faster
+    than sending maxSpeed and maxAcceleration:
+        - Without a jerk limit, the acceleration is maxAcceleration and the speed is
+          maxSpeed, or sqrt(distance * maxAcceleration) for moves too short to reach it,
+          which is the peak the controller would reach anyway. The moves are the same.
+        - With a jerk limit, the acceleration sent is lowered so that each ramp lasts as
+          long as a ramp whose acceleration changes at most at maxJerk would. The
+          controller still ramps at a constant acceleration: this only softens the moves,
+          and makes them slower.
+    What it does bring is the expected duration of every move, and one place for the
+    limits of each axis.
+
+    Profiles are cached by distance, so planning a length that was already planned is a
+    dictionary lookup.
+
+    Example:
+        planner = MotionPlanner(AxisLimits(maxSpeed=900, maxAcceleration=850))
+        program.profile(planner.plan(1900)).relativeMove(axis, 'positive', 1900)
+    '''
+    MAX_CACHE_SIZE  = 1024
+    DISTANCE_DIGITS = 3         # Distances are rounded to the micrometer before being looked up
+
+    def __init__(self, limits):
+        '''
+        params:
+            limits: AxisLimits
+        '''
+        self.limits = limits
+        self.__cache = OrderedDict()        # Maps rounded distances to their MotionProfile, least recently used first
+
+    def plan(self, distance):
+        '''
+        Returns the fastest profile for a move of 'distance' mm (in either direction).
+
+        returns:
+            MotionProfile
+        '''
+        distance = round(abs(distance), MotionPlanner.DISTANCE_DIGITS)
+        profile = self.__cache.get(distance)
+        if profile != None:
+            self.__cache.move_to_end(distance)
+            return profile
+
+        profile = self.__computeProfile(distance)
+        self.__cache[distance] = profile
+        if len(self.__cache) > MotionPlanner.MAX_CACHE_SIZE:
+            self.__cache.popitem(last=False)
+        return profile
+
+    def getCacheSize(self):
+        return len(self.__cache)
+
+    def clearCache(self):
+        ''' Forgets every profile. Call it after changing the limits. '''
+        self.__cache.clear()
+
+    def __computeProfile(self, distance):
+        limits = self.limits
+        if distance == 0:
+            return MotionProfile(0.0, limits.maxSpeed, limits.maxAcceleration, 0.0, 0.0, 0.0)
+
+        # Ramping to the maximum speed and back down covers twice the ramp distance
+        speed = limits.maxSpeed
+        rampTime = self.__rampTime(speed)
+        if speed * rampTime > distance:
+            # Too short to cruise: find the peak speed whose two ramps cover the distance exactly
+            speed = self.__peakSpeed(distance)
+            rampTime = self.__rampTime(speed)
+
+        cruiseTime = max(distance - speed * rampTime, 0.0) / speed
+        return MotionProfile(distance, speed, speed / rampTime, 2 * rampTime + cruiseTime, rampTime, cruiseTime)
+
+    def __rampTime(self, speed):
+        ''' Time the fastest ramp from rest to 'speed' takes '''
+        a, j = self.limits.maxAcceleration, self.limits.maxJerk
+        if j == None:
+            return speed / a
+        if speed * j >= a * a:
+            return speed / a + a / j        # The acceleration reaches a, and holds it
+        return 2 * math.sqrt(speed / j)     # The acceleration peaks below a
+
+    def __peakSpeed(self, distance):
+        '''
+        Peak speed of a move without cruise. A ramp to v covers v * rampTime(v) / 2, so both
+        ramps cover v * rampTime(v), which is solved for v in each regime of __rampTime.
+        '''
+        a, j = self.limits.maxAcceleration, self.limits.maxJerk
+        if j == None:
+            return math.sqrt(distance * a)
+
+        # Peak acceleration below a: d = 2 * v^1.5 / sqrt(j)
+        speed = (distance * math.sqrt(j) / 2) ** (2.0 / 3.0)
+        if speed * j < a * a:
+            return speed
+
+        # Acceleration held at a: d = v^2 / a + v * a / j
+        return (-a * a / j + math.sqrt((a * a / j) ** 2 + 4 * a * distance)) / 2
@@ -0,0 +1,215 @@
+import logging
+import asyncio
+from concurrent.futures import TimeoutError
+from internal.clock import getClock
+import internal.tracing as tracing
+
+class MotionProgram:
+    '''
+    Builder for a sequence of MachineMotion commands that is run as one unit on the motion
+    executor of its machine.
+
+    Steps are recorded as you call the builder methods, then 'submit' sends them to the
+    controller in order and waits for motion completion only where it is needed: before each
+    'then' callback and once at the end of the program. You get a single MotionProgramHandle
+    to wait on.
+
+    The MachineMotion API has no way to send several commands at once, so every step is
+    still its own call to the controller: a program saves the waits between moves, not the
+    round-trips. A speed or acceleration equal to the last one sent by the same program is
+    skipped, but a program does not know what other programs or the engine sent before it,
+    so its first speed and acceleration are always sent. 'run' blocks the calling thread
+    (usually the engine thread) until the whole program is complete; use 'submit' to keep
+    working while it runs.
+
+    Example:
+        program = self.engine.createMotionProgram(self.engine.MachineMotion)
+        program.absoluteMove(1, 0).then(knife.high)
+        program.speed(900).acceleration(850).relativeMove(1, 'positive', 1900).then(knife.low)
+        program.submit().wait()
+
+    Create programs with BaseMachineAppEngine.createMotionProgram, so that the programs of
+    a MachineMotion are always executed in the order in which they were submitted.
+    '''
+
+    SPEED           = 'speed'
+    ACCELERATION    = 'acceleration'
+    ABSOLUTE_MOVE   = 'absolute_move'
+    RELATIVE_MOVE   = 'relative_move'
+    HOME            = 'home'
+    WAIT            = 'wait'
+    CALL            = 'call'
+
+    def __init__(self, machineMotion, executor, clock=None):
+        '''
+        params:
+            machineMotion: MachineMotion
+                Machine that will run the program
+            executor: concurrent.futures.Executor
+                Executor on which the program is run. Must run one program at a time.
+            clock: RealClock | VirtualClock
+                (Optional) Clock used to run the program and wait for it. Defaults to the MachineApp clock.
+        '''
+        self.__logger = logging.getLogger(__name__)
+        self.__machineMotion = machineMotion
+        self.__executor = executor
+        self.__clock = clock if clock != None else getClock()
+        self.__steps = []
+
+    def getMachineMotion(self):
+        return self.__machineMotion
+
+    def getSteps(self):
+        '''
+        Returns the recorded steps as (kind, args) tuples.
+
+        returns:
+            list<(str, tuple)>
+        '''
+        return list(self.__steps)
+
+    def speed(self, speed):
+        ''' Sets the speed of the following moves '''
+        self.__steps.append((MotionProgram.SPEED, (speed,)))
+        return self
+
+    def acceleration(self, acceleration):
+        ''' Sets the acceleration of the following moves '''
+        self.__steps.append((MotionProgram.ACCELERATION, (acceleration,)))
+        return self
+
+    def profile(self, profile):
+        ''' Sets the speed and acceleration of the following moves to those of a MotionProfile (see internal.motion_planner) '''
+        return self.speed(profile.speed).acceleration(profile.acceleration)
+
+    def absoluteMove(self, axis, position):
+        ''' Moves an axis to an absolute position '''
+        self.__steps.append((MotionProgram.ABSOLUTE_MOVE, (axis, position)))
+        return self
+
+    def relativeMove(self, axis, direction, distance):
+        ''' Moves an axis by a distance in the provided direction ('positive' or 'negative') '''
+        self.__steps.append((MotionProgram.RELATIVE_MOVE, (axis, direction, distance)))
+        return self
+
+    def home(self, axis):
+        ''' Homes an axis '''
+        self.__steps.append((MotionProgram.HOME, (axis,)))
+        return self
+
+    def waitForCompletion(self):
+        ''' Waits until every previous move is complete before sending the next steps '''
+        self.__steps.append((MotionProgram.WAIT, ()))
+        return self
+
+    def then(self, callback):
+        '''
+        Calls a function (e.g. to toggle an output) once every previous move is complete.
+
+        params:
+            callback: func() -> void
+        '''
+        self.__steps.append((MotionProgram.CALL, (callback,)))
+        return self
+
+    def submit(self):
+        '''
+        Sends the program to the MachineMotion. Returns immediately.
+
+        returns:
+            MotionProgramHandle
+        '''
+        steps = list(self.__steps)
+        return MotionProgramHandle(self.__clock.submit(self.__executor, self.__execute, steps), self.__clock)
+
+    def run(self):
+        ''' Submits the program and blocks the calling thread until it is complete '''
+        return self.submit().wait()
+
+    def __execute(self, steps):
+        tracer = tracing.activeTracer
+        if tracer == None:
+            return self.__executeSteps(steps)
+
+        with tracer.span('Motion program', 'motion', {"steps": [kind for kind, _ in steps]}):
+            return self.__executeSteps(steps)
+
+    def __executeSteps(self, steps):
+        machineMotion = self.__machineMotion
+        currentSpeed = None
+        currentAcceleration = None
+        hasPendingMotion = False
+
+        tracer = tracing.activeTracer
+        for kind, args in steps:
+            if tracer != None:
+                tracer.instant('motion ' + kind, 'motion', {"args": [str(arg) for arg in args]})
+
+            if kind == MotionProgram.SPEED:
+                if args[0] != currentSpeed:
+                    machineMotion.emitSpeed(*args)
+                    currentSpeed = args[0]
+            elif kind == MotionProgram.ACCELERATION:
+                if args[0] != currentAcceleration:
+                    machineMotion.emitAcceleration(*args)
+                    currentAcceleration = args[0]
+            elif kind == MotionProgram.ABSOLUTE_MOVE:
+                machineMotion.emitAbsoluteMove(*args)
+                hasPendingMotion = True
+            elif kind == MotionProgram.RELATIVE_MOVE:
+                machineMotion.emitRelativeMove(*args)
+                hasPendingMotion = True
+            elif kind == MotionProgram.HOME:
+                machineMotion.emitHome(*args)
+                hasPendingMotion = True
+            elif kind == MotionProgram.WAIT or kind == MotionProgram.CALL:
+                if hasPendingMotion:
+                    self.__waitForMotionCompletion()
+                    hasPendingMotion = False
+                if kind == MotionProgram.CALL:
+                    args[0]()
+
+        if hasPendingMotion:
+            self.__waitForMotionCompletion()
+
+        return True
+
+    def __waitForMotionCompletion(self):
+        tracer = tracing.activeTracer
+        if tracer == None:
+            self.__machineMotion.waitForMotionCompletion()
+            return
+
+        with tracer.span('waitForMotionCompletion', 'motion'):
+            self.__machineMotion.waitForMotionCompletion()
+
+class MotionProgramHandle:
+    '''
+    Completion handle of a submitted MotionProgram.
+    '''
+
+    def __init__(self, future, clock=None):
+        self.__future = future
+        self.__clock = clock if clock != None else getClock()
+
+    def isDone(self):
+        ''' Returns True once the program has completed, successfully or not '''
+        return self.__future.done()
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until the program is complete. Exceptions raised while running the program
+        are raised again here.
+
+        params:
+            timeout: float
+                (Optional) Maximum number of seconds to wait. concurrent.futures.TimeoutError
+                is raised if it expires.
+        '''
+        if len(self.__clock.waitFutures([self.__future], timeout)) == 0:
+            raise TimeoutError()
+        return self.__future.result()
+
+    async def waitAsync(self):
+        ''' Awaitable version of 'wait', for use in 'async def' state callbacks '''
+        return await asyncio.wrap_future(self.__future)
@@ -0,0 +1,278 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from internal.mqtt_topic_subscriber import MqttTopicSubscriber
+
+class MqttDispatchMode:
+    '''
+    How the callbacks registered on an MqttSubscriptionPool are delivered.
+
+        POLL:           Messages are queued by MqttTopicSubscriber and delivered by the engine
+                        thread. The engine is woken up when a message arrives on a topic that
+                        a state holds, whatever the update interval of the state.
+        ENGINE_THREAD:  Messages are pushed by the MachineMotion as they arrive. The engine is
+                        woken up and runs the callbacks right away, on its own thread.
+        EXECUTOR:       Messages are pushed by the MachineMotion as they arrive and the callbacks
+                        run right away on a dedicated thread. Callbacks must be thread-safe.
+
+    In every mode, the callbacks are called in the order in which the messages were received.
+    '''
+    POLL            = 'poll'
+    ENGINE_THREAD   = 'engine_thread'
+    EXECUTOR        = 'executor'
+
+class MqttSubscriptionHandle:
+    '''
+    Callback registered on an MqttSubscriptionPool. Returned by MqttSubscriptionPool.acquire.
+    '''
+
+    def __init__(self, pool, machineMotion, topic, callback):
+        self.machineMotion = machineMotion
+        self.topic = topic
+        self.callback = callback
+        self.__pool = pool
+
+    def isActive(self):
+        return self.__pool.isActive(self)
+
+    def release(self):
+        ''' Stops calling the callback. The underlying subscription stays open. '''
+        self.__pool.release(self)
+
+class _PushForwarder:
+    '''
+    MQTT callback registered on a MachineMotion by a pool (in POLL mode, only to wake the
+    engine up; the messages themselves go through MqttTopicSubscriber). MachineMotion has no
+    way to remove an MQTT callback, so the pool deactivates its forwarders when it is freed
+    instead: the MachineMotion then only keeps a small inert object, and nothing keeps the
+    MachineMotion.
+    '''
+
+    def __init__(self, onMessage):
+        self.__onMessage = onMessage
+
+    def __call__(self, topic, msg):
+        onMessage = self.__onMessage
+        if onMessage != None:
+            onMessage(topic, msg)
+
+    def deactivate(self):
+        self.__onMessage = None
+
+class _PooledTopic:
+    def __init__(self, subscriber):
+        self.subscriber = subscriber
+        self.handles = []           # Handles currently interested in the topic, in registration order
+
+class MqttSubscriptionPool:
+    '''
+    Engine-wide pool of MQTT topic subscriptions, keyed by MachineMotion and topic.
+
+    States acquire a handle for each callback and release it when they leave. The subscription
+    itself is only opened the first time a topic is acquired and then stays open until 'free'
+    is called at the end of the run, so going back and forth between states does not subscribe
+    and unsubscribe over and over again. Messages received on a topic that nobody holds are
+    dropped.
+
+    Every method must be called from the engine thread.
+    '''
+
+    def __init__(self, dispatchMode=MqttDispatchMode.POLL, onMessage=None):
+        '''
+        params:
+            dispatchMode: MqttDispatchMode
+                (Optional) How callbacks are delivered
+            onMessage: func() -> void
+                (Optional) Called from the MQTT thread whenever a message is waiting for the
+                engine thread (POLL and ENGINE_THREAD modes), e.g. BaseMachineAppEngine.wakeup
+        '''
+        self.__logger = logging.getLogger(__name__)
+        self.__dispatchMode = dispatchMode
+        self.__onMessage = onMessage
+        self.__subscribers = {}         # Maps id(MachineMotion) to its MqttTopicSubscriber (POLL mode)
+        self.__pushSources = {}         # Maps id(MachineMotion) to the _PushForwarder registered on it for this run
+        self.__topics = {}              # Maps (id(MachineMotion), topic) to a _PooledTopic
+        self.__pending = deque()        # Messages waiting for the engine thread (ENGINE_THREAD mode)
+        self.__deferred = deque()       # Messages of other topics polled while a topic was drained, delivered by the next update (POLL mode)
+        self.__drainedKey = None        # Key of the topic being drained (POLL mode)
+        self.__hasPolledMessages = False    # A message arrived on a held topic since the last update (POLL mode)
+        self.__executor = None          # Thread running the callbacks (EXECUTOR mode)
+
+    def getDispatchMode(self):
+        return self.__dispatchMode
+
+    def acquire(self, machineMotion, topic, callback):
+        '''
+        Calls 'callback' whenever a message is received on 'topic' until the returned handle
+        is released.
+
+        params:
+            machineMotion: MachineMotion
+                Machine whose MQTT topic you want to subscribe to
+            topic: str
+                MQTT topic
+            callback: func(topic: str, msg: str) -> void
+                Callback that gets called when we receive data on that topic
+
+        returns:
+            MqttSubscriptionHandle
+        '''
+        key = (id(machineMotion), topic)
+        pooledTopic = self.__topics.get(key)
+        if pooledTopic == None and self.__dispatchMode != MqttDispatchMode.POLL:
+            self.__addPushSource(machineMotion)
+            pooledTopic = _PooledTopic(None)
+            self.__topics[key] = pooledTopic
+        elif pooledTopic == None:
+            pooledTopic = _PooledTopic(self.__getSubscriber(machineMotion))
+            self.__topics[key] = pooledTopic
+            pooledTopic.subscriber.registerCallback(topic, lambda t, msg: self.__onPolledMessage(key, pooledTopic, t, msg))
+            self.__addPushSource(machineMotion)     # Registered after the subscriber, so that it queued the message when the engine wakes up
+        elif len(pooledTopic.handles) == 0 and pooledTopic.subscriber != None:
+            # A warm topic may still hold messages received while nobody was interested in it:
+            # drop them, so that the new callback only sees what arrives after it is registered.
+            self.__drain(key, pooledTopic.subscriber)
+
+        # Handles are replaced rather than mutated: the MQTT thread reads them without locking
+        handle = MqttSubscriptionHandle(self, machineMotion, topic, callback)
+        pooledTopic.handles = pooledTopic.handles + [handle]
+        return handle
+
+    def release(self, handle):
+        pooledTopic = self.__topics.get((id(handle.machineMotion), handle.topic))
+        if pooledTopic != None and handle in pooledTopic.handles:
+            pooledTopic.handles = [h for h in pooledTopic.handles if h != handle]
+
+    def isActive(self, handle):
+        pooledTopic = self.__topics.get((id(handle.machineMotion), handle.topic))
+        return pooledTopic != None and handle in pooledTopic.handles
+
+    def getReferenceCounts(self):
+        '''
+        Returns the number of handles held on each open subscription.
+
+        returns:
+            dict<str, int>
+                Maps topics to the number of handles
+        '''
+        return {topic: len(pooledTopic.handles) for (_, topic), pooledTopic in self.__topics.items()}
+
+    def hasPendingMessages(self):
+        ''' Whether messages are waiting to be delivered by 'update' '''
+        return self.__hasPolledMessages or len(self.__pending) > 0 or len(self.__deferred) > 0
+
+    def update(self):
+        '''
+        Delivers the messages received since the last update. In POLL mode, every subscriber
+        is polled. In ENGINE_THREAD mode, the messages pushed so far are delivered in order.
+        '''
+        if self.__dispatchMode == MqttDispatchMode.POLL:
+            self.__hasPolledMessages = False        # Cleared first: a message arriving during the update is polled again by the next one
+            while len(self.__deferred) > 0:
+                handles, topic, msg = self.__deferred.popleft()
+                self.__dispatch(handles, topic, msg)
+            for subscriber in self.__subscribers.values():
+                subscriber.update()
+            return
+
+        while len(self.__pending) > 0:
+            handles, topic, msg = self.__pending.popleft()
+            self.__dispatch(handles, topic, msg)
+
+    def free(self):
+        ''' Closes every subscription. Outstanding handles become inactive. '''
+        for subscriber in self.__subscribers.values():
+            subscriber.delete()
+
+        self.__subscribers.clear()
+        self.__topics.clear()
+
+        for forwarder in self.__pushSources.values():
+            forwarder.deactivate()
+        self.__pushSources.clear()
+        self.__pending.clear()
+        self.__deferred.clear()
+        self.__hasPolledMessages = False
+
+        if self.__executor != None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def __getSubscriber(self, machineMotion):
+        subscriber = self.__subscribers.get(id(machineMotion))
+        if subscriber == None:
+            subscriber = MqttTopicSubscriber(machineMotion)
+            self.__subscribers[id(machineMotion)] = subscriber
+        return subscriber
+
+    def __drain(self, key, subscriber):
+        '''
+        Drops the messages the subscriber holds for the topic of 'key'. MqttTopicSubscriber can
+        only deliver all of its topics at once: the messages of the other topics are kept, in
+        order, for the next 'update', so that their callbacks are not called from here.
+        '''
+        self.__drainedKey = key
+        try:
+            subscriber.update()
+        finally:
+            self.__drainedKey = None
+
+    def __onPolledMessage(self, key, pooledTopic, topic, msg):
+        ''' Called by the MqttTopicSubscribers, from 'update' or '__drain' (POLL mode) '''
+        if self.__drainedKey == None:
+            self.__dispatch(pooledTopic.handles, topic, msg)
+        elif key != self.__drainedKey:
+            self.__deferred.append((pooledTopic.handles, topic, msg))
+
+    def __addPushSource(self, machineMotion):
+        if self.__dispatchMode == MqttDispatchMode.EXECUTOR and self.__executor == None:
+            self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='MqttDispatch')
+
+        machineMotionId = id(machineMotion)
+        if machineMotionId in self.__pushSources:
+            return
+
+        # The MachineMotions of a run stay alive until the pool is freed, so their ids are not reused in the meantime
+        forwarder = _PushForwarder(lambda topic, msg: self.__onPushedMessage(machineMotionId, topic, msg))
+        self.__pushSources[machineMotionId] = forwarder
+        machineMotion.addMqttCallback(forwarder)
+
+    def __onPushedMessage(self, machineMotionId, topic, msg):
+        ''' Called on the MQTT thread for every message received by the MachineMotion '''
+        pooledTopic = self.__topics.get((machineMotionId, topic))
+        if pooledTopic == None:
+            return
+
+        # Only the handles held when the message arrives receive it
+        handles = pooledTopic.handles
+        if len(handles) == 0:
+            return
+
+        if self.__dispatchMode == MqttDispatchMode.POLL:
+            self.__hasPolledMessages = True
+            if self.__onMessage != None:
+                self.__onMessage()
+            return
+
+        if self.__dispatchMode == MqttDispatchMode.EXECUTOR:
+            executor = self.__executor
+            try:
+                executor.submit(self.__dispatchSafely, handles, topic, msg)
+            except (AttributeError, RuntimeError):    # The pool was freed in the meantime
+                pass
+            return
+
+        self.__pending.append((handles, topic, msg))
+        if self.__onMessage != None:
+            self.__onMessage()
+
+    def __dispatch(self, handles, topic, msg):
+        for handle in handles:
+            if handle.isActive():
+                handle.callback(topic, msg)
+
+    def __dispatchSafely(self, handles, topic, msg):
+        try:
+            self.__dispatch(handles, topic, msg)
+        except Exception as e:
+            self.__logger.error('MQTT callback on {} failed: {}'.format(topic, e))
@@ -1,10 +1,18 @@
 import websockets
 import asyncio
-from threading import RLock, Thread
+from threading import Thread
 import logging
 import json
-import time
+import atexit
+import heapq
+import threading
+from collections import deque, OrderedDict
 from internal.interprocess_message import sendSubprocessToParentMsg, SubprocessToParentMessage
+import internal.tracing as tracing
+from internal.clock import getClock
+from internal.wire_format import Encoding, PackedEncoder, getEncoding, LEVEL_CODES
+from internal.journal import RecordType, getJournal
+from internal.metrics import registry, MetricsServer
 
 class NotificationLevel:
     ''' 
@@ -24,10 +32,114 @@ class NotificationLevel:
     ERROR               = 'error'
     IO_STATE            = 'io_state'
     UI_INFO             = 'ui_info'
+    PROFILE             = 'profile'     # State timings, see BaseMachineAppEngine.getStateTimings
+
+class NotificationTransport:
+    '''
+    Hands notifications over to the parent process from a background thread, so that
+    sendNotification only appends to a queue and never waits for the cross-process send.
+
+    Everything that piled up while the previous batch was being sent is taken in one go.
+    Notifications are delivered in order. When more than maxPending notifications are
+    waiting, the oldest IO_STATE notification is dropped (IOMonitor can resync periodically),
+    or the oldest notification if there is none.
+
+    For internal use only! Use sendNotification and flushNotifications.
+    '''
+    MAX_PENDING = 4096
+
+    def __init__(self, maxPending=MAX_PENDING):
+        self.__logger = logging.getLogger(__name__)
+        self.maxPending     = maxPending
+        self.__condition    = threading.Condition()
+        self.__pending      = deque()           # (sequence, notification) waiting for the flusher thread, except IO_STATE ones
+        self.__pendingIo    = deque()           # (sequence, notification) of the IO_STATE notifications waiting, so that dropping one is O(1)
+        self.__sequence     = 0                 # Orders the notifications of both queues
+        self.__isSending    = False             # The flusher thread is sending a batch
+        self.__thread       = None              # Started with the first notification
+
+        self.sentCount      = 0
+        self.droppedCount   = 0
+        self.batchCount     = 0
+        self.maxBatchSize   = 0
+
+    def send(self, notification):
+        ''' Queues a notification. Never blocks on the parent process. '''
+        with self.__condition:
+            if self.__getPendingCount() >= self.maxPending:
+                self.__dropOne()
+            self.__sequence += 1
+            queue = self.__pendingIo if notification["level"] == NotificationLevel.IO_STATE else self.__pending
+            queue.append((self.__sequence, notification))
+
+            if self.__thread == None:
+                self.__thread = threading.Thread(name='NotificationFlusher', target=self.__run, daemon=True)
+                self.__thread.start()
+            self.__condition.notify_all()
+
+    def flush(self, timeout=None):
+        '''
+        Waits until every queued notification has been handed over to the parent process.
+
+        returns:
+            bool
+                False if the timeout expired first
+        '''
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__getPendingCount() == 0 and not self.__isSending, timeout)
+
+    def getStats(self):
+        with self.__condition:
+            return {
+                "pending": self.__getPendingCount(),
+                "sentCount": self.sentCount,
+                "droppedCount": self.droppedCount,
+                "batchCount": self.batchCount,
+                "maxBatchSize": self.maxBatchSize
+            }
+
+    def __getPendingCount(self):
+        return len(self.__pending) + len(self.__pendingIo)
+
+    def __dropOne(self):
+        if len(self.__pendingIo) > 0:
+            self.__pendingIo.popleft()
+        else:
+            self.__pending.popleft()
+        self.droppedCount += 1
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__getPendingCount() > 0)
+                batch = [notification for _, notification in heapq.merge(self.__pending, self.__pendingIo)]
+                self.__pending.clear()
+                self.__pendingIo.clear()
+                self.__isSending = True
+
+            for notification in batch:
+                try:
+                    sendSubprocessToParentMsg(SubprocessToParentMessage.NOTIFICATION, notification)
+                except Exception as e:
+                    self.__logger.error('Unable to send a notification to the parent process: {}'.format(e))
+
+            with self.__condition:
+                self.__isSending = False
+                self.sentCount += len(batch)
+                self.batchCount += 1
+                self.maxBatchSize = max(self.maxBatchSize, len(batch))
+                self.__condition.notify_all()
+
+notificationTransport = NotificationTransport()
+registry.gauge('machineapp_notifications_pending', 'Notifications waiting to be handed over to the parent process').setFunction(
+    lambda: notificationTransport.getStats()["pending"])
+registry.counter('machineapp_notifications_dropped_total', 'Notifications dropped because too many were waiting for the parent process').setFunction(
+    lambda: notificationTransport.getStats()["droppedCount"])
 
 def sendNotification(level, message, customPayload=None):
     '''
-        Broadcast a message to all connected clients
+        Broadcast a message to all connected clients. The message is sent from a background
+        thread: this returns immediately.
 
         params:
             level: str
@@ -37,45 +149,273 @@ def sendNotification(level, message, customPayload=None):
             customPayload: dict
                 (Optional) Custom data to be sent to the client, if any
     '''
-    sendSubprocessToParentMsg(SubprocessToParentMessage.NOTIFICATION, {
-        "timeSeconds": time.time(),
+    if tracing.activeTracer != None:
+        tracing.activeTracer.instant('notify ' + level, 'notifier', {"message": message})
+
+    timeSeconds = getClock().time()
+    journal = getJournal()
+    if journal != None and level != NotificationLevel.IO_STATE:     # IO changes are journaled as IO_EDGE records
+        journal.record(RecordType.NOTIFICATION, message, code=LEVEL_CODES.get(level, 255), timeSeconds=timeSeconds)
+
+    notificationTransport.send({
+        "timeSeconds": timeSeconds,
         "level": level,
         "message": message,
         "customPayload": customPayload
     })
 
+def flushNotifications(timeout=None):
+    '''
+    Waits until every notification sent so far has reached the parent process.
+
+    returns:
+        bool
+            False if the timeout expired first
+    '''
+    return notificationTransport.flush(timeout)
+
+# Notifications queued right before the process exits must not be lost
+atexit.register(flushNotifications, 2)
+
+
+class OverflowPolicy:
+    '''
+    Determines what happens when a client's outbound queue is full.
+    '''
+    DROP_OLDEST = 'drop_oldest'     # Discard the oldest queued message to make room for the new one
+    CONFLATE    = 'conflate'        # Replace a queued message for the same IO with the new one, otherwise discard the oldest
+    DISCONNECT  = 'disconnect'      # Close the connection. The client is expected to reconnect.
+
+def getConflationKey(item):
+    '''
+    Returns the key under which two messages are considered interchangeable (i.e. only the
+    latest one matters), or None if the message must never be conflated.
+    '''
+    if item["level"] != NotificationLevel.IO_STATE:
+        return None
+
+    payload = item["customPayload"]
+    if not isinstance(payload, dict):
+        return None
+
+    return (payload.get("isInput"), payload.get("device"), payload.get("pin"))
+
+class NotifierClient:
+    '''
+    Outbound side of a single websocket client. Each client owns a bounded queue that
+    is drained by its own writer task, so that a slow client only ever delays itself.
+
+    For internal use only! Must only be touched from the notifier event loop.
+    '''
+    def __init__(self, websocket, maxQueueSize, overflowPolicy, encoding=Encoding.JSON):
+        self.__logger = logging.getLogger(__name__)
+        self.websocket          = websocket
+        self.maxQueueSize       = maxQueueSize
+        self.overflowPolicy     = overflowPolicy
+        self.encoding           = encoding          # One of Encoding, requested by the client when connecting
+        self.__queue            = deque()           # Entries are [frame, conflationKey, enqueueTimeSeconds, traceId, isPinned]
+        self.__conflatable      = {}                # Maps conflation keys to their entry in __queue
+        self.__hasData          = asyncio.Event()
+        self.isClosing          = False
+
+        # Lag counters
+        self.sentCount          = 0                 # Messages written to the socket
+        self.droppedCount       = 0                 # Messages discarded because the queue was full
+        self.conflatedCount     = 0                 # Messages replaced by a newer value for the same IO
+        self.maxQueueDepth      = 0                 # High-water mark of the outbound queue
+
+    def push(self, frame, conflationKey=None, traceId=None, isPinned=False):
+        '''
+        Queues an encoded frame for this client. Never blocks.
+
+        Pinned frames (e.g. packed encoding definitions) are never dropped when the queue is full.
+        If it is full of pinned frames, a new frame is dropped, or the client is disconnected
+        if the new frame is pinned too: the queue never holds more than maxQueueSize frames.
+        '''
+        if self.isClosing:
+            return
+
+        if len(self.__queue) >= self.maxQueueSize:
+            if self.overflowPolicy == OverflowPolicy.DISCONNECT:
+                self.__disconnect('Client outbound queue is full, disconnecting it.')
+                return
+
+            if self.overflowPolicy == OverflowPolicy.CONFLATE and conflationKey != None:
+                entry = self.__conflatable.get(conflationKey)
+                if entry != None:
+                    entry[0] = frame
+                    entry[3] = traceId
+                    self.conflatedCount = self.conflatedCount + 1
+                    return
+
+            oldest = next((entry for entry in self.__queue if not entry[4]), None)
+            if oldest != None:
+                self.__queue.remove(oldest)
+                if oldest[1] != None and self.__conflatable.get(oldest[1]) is oldest:
+                    del self.__conflatable[oldest[1]]
+                self.droppedCount = self.droppedCount + 1
+            elif isPinned:
+                # The client cannot decode anything without the definitions: it gets them all
+                # in a single frame when it reconnects
+                self.__disconnect('Client outbound queue is full of pinned frames, disconnecting it.')
+                return
+            else:
+                self.droppedCount = self.droppedCount + 1
+                return
+
+        entry = [frame, conflationKey, getClock().time(), traceId, isPinned]
+        self.__queue.append(entry)
+        if conflationKey != None:
+            self.__conflatable[conflationKey] = entry
+
+        if len(self.__queue) > self.maxQueueDepth:
+            self.maxQueueDepth = len(self.__queue)
+        self.__hasData.set()
+
+    def __disconnect(self, reason):
+        self.__logger.warning(reason)
+        self.isClosing = True
+        self.droppedCount = self.droppedCount + len(self.__queue) + 1
+        self.__queue.clear()
+        self.__conflatable.clear()
+        asyncio.ensure_future(self.websocket.close())
+        self.__hasData.set()
+
+    async def writer(self):
+        '''
+        Sends the queued frames, in order, until the client goes away.
+        '''
+        while not self.isClosing:
+            await self.__hasData.wait()
+            while len(self.__queue) > 0 and not self.isClosing:
+                entry = self.__queue.popleft()
+                if entry[1] != None and self.__conflatable.get(entry[1]) is entry:
+                    del self.__conflatable[entry[1]]
+
+                tracer = tracing.activeTracer
+                if tracer == None:
+                    await self.websocket.send(entry[0])
+                else:
+                    with tracer.span('ws send', 'notifier', {"id": entry[3], "queuedSeconds": getClock().time() - entry[2]}):
+                        await self.websocket.send(entry[0])
+                self.sentCount = self.sentCount + 1
+
+            self.__hasData.clear()
+
+    def getLagSeconds(self):
+        ''' Returns how long the oldest queued message has been waiting, in seconds '''
+        if len(self.__queue) == 0:
+            return 0
+        return getClock().time() - self.__queue[0][2]
+
+    def getStats(self):
+        return {
+            "queueDepth": len(self.__queue),
+            "maxQueueDepth": self.maxQueueDepth,
+            "lagSeconds": self.getLagSeconds(),
+            "sentCount": self.sentCount,
+            "droppedCount": self.droppedCount,
+            "conflatedCount": self.conflatedCount
+        }
 
 class Notifier:
 
     ''' 
     Websocket server used to stream information about a run in progress to the web client
 
+    Clients joining mid-run are first sent the recent history (the last REPLAY_HISTORY_SIZE
+    notifications, IO states excepted) followed by a snapshot of the current situation: run
+    status, current state and last value of each IO (at most MAX_SNAPSHOT_IO_STATES).
+
+    The Notifier runs in the server process, not in the MachineApp subprocess serving its metrics
+    on port 8082. Its gauges (pending messages, queue depth and lag of each client) are served
+    with the rest of its process registry on their own port, METRICS_PORT by default.
+
     For internal use only! If you plan to send notifications 
     
     '''
-    def __init__(self):
+    DEFAULT_CLIENT_QUEUE_SIZE = 256
+    REPLAY_HISTORY_SIZE     = 64
+    MAX_SNAPSHOT_IO_STATES  = 128
+    METRICS_PORT            = 8083      # Port on which the global notifier serves the metrics of its process. None disables it.
+    RUN_STATUS_LEVELS       = (NotificationLevel.APP_START, NotificationLevel.APP_COMPLETE, NotificationLevel.APP_PAUSE,
+                                NotificationLevel.APP_RESUME, NotificationLevel.APP_ESTOP, NotificationLevel.APP_ESTOP_RELEASE)
+
+    def __init__(self, maxClientQueueSize=DEFAULT_CLIENT_QUEUE_SIZE, overflowPolicy=OverflowPolicy.DROP_OLDEST, ip='0.0.0.0', port='8081',
+                 metricsPort=None, metricsIp=MetricsServer.DEFAULT_IP):
+        '''
+        params:
+            maxClientQueueSize: int
+                Maximum number of messages waiting to be sent to a single client
+            overflowPolicy: str
+                One of OverflowPolicy, applied when a client's queue is full
+            ip: str
+                Address the websocket server listens on
+            port: str
+                Port the websocket server listens on
+            metricsPort: int
+                (Optional) Port on which the registry of the process is served. 0 picks a free port.
+                None does not serve it.
+            metricsIp: str
+                (Optional) Address the metrics are served on. Only the controller itself can scrape by default.
+        '''
         self.__logger = logging.getLogger(__name__)
-        self.lock = RLock()
-        self.queue = []
+        self.__loop = asyncio.new_event_loop()          # Event loop owned by the notifier thread. Every client interaction happens on it.
+        self.__queue = None                             # asyncio.Queue of pending messages, created on the notifier thread
+        self.clients = {}                               # Maps websockets to their NotifierClient
+        self.__packedEncoder = PackedEncoder()          # Shared by every client asking for the packed encoding
+        self.__history = deque(maxlen=Notifier.REPLAY_HISTORY_SIZE)    # Recent notifications, replayed to new clients
+        self.__runStatus = None                         # Last notification changing the run status (start, pause, estop...)
+        self.__appState = None                          # Last APP_STATE_CHANGE notification
+        self.__ioStates = OrderedDict()                 # Maps IO conflation keys to their last IO_STATE notification, least recently updated first
+        self.isRunning = False
+        self.maxClientQueueSize = maxClientQueueSize
+        self.overflowPolicy = overflowPolicy
+        self.metricsServer = None                       # MetricsServer of the process, if metricsPort is provided
+
+        registry.gauge('machineapp_notifier_pending_messages', 'Messages waiting to be broadcast by the Notifier').setFunction(
+            lambda: self.__queue.qsize() if self.__queue != None else 0)
+        registry.gauge('machineapp_notifier_client_queue_depth', 'Messages queued for each Notifier client', ['client']).setFunction(
+            lambda: { (client,): stats["queueDepth"] for client, stats in self.__getClientStatsByAddress().items() })
+        registry.gauge('machineapp_notifier_client_lag_seconds', 'Age of the oldest message queued for each Notifier client', ['client']).setFunction(
+            lambda: { (client,): stats["lagSeconds"] for client, stats in self.__getClientStatsByAddress().items() })
+        registry.counter('machineapp_notifier_client_dropped_total', 'Messages dropped for each Notifier client', ['client']).setFunction(
+            lambda: { (client,): stats["droppedCount"] for client, stats in self.__getClientStatsByAddress().items() })
+        if metricsPort != None:
+            try:
+                self.metricsServer = MetricsServer(registry, metricsIp, metricsPort)
+            except OSError as e:
+                self.__logger.error('Unable to serve the notifier metrics on port {}: {}'.format(metricsPort, e))
 
-        thread = Thread(name='Notifier', target=self.__run, args=('0.0.0.0', '8081'))
+        thread = Thread(name='Notifier', target=self.__run, args=(ip, port))
         thread.daemon = True
         thread.start() 
 
     def __run(self, ip, port):
         self.__logger.info('Running the socket API on port {}'.format(port))
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        asyncio.set_event_loop(self.__loop)
+        self.__queue = asyncio.Queue()
         self.server = websockets.serve(self.handler, ip, port)
-        self.clients = set()
         
-        asyncio.get_event_loop().create_task(self.run())
-        asyncio.get_event_loop().run_until_complete(self.server)
-        asyncio.get_event_loop().run_forever()
+        self.__loop.create_task(self.run())
+        self.__loop.run_until_complete(self.server)
+        self.__loop.run_forever()
 
     async def handler(self, websocket, path):
-        self.__logger.info('Received new client.')
-        self.clients.add(websocket)
+        '''
+        Serves a websocket client. Clients connecting with '?encoding=packed' receive binary
+        frames (see wire_format.PackedEncoder) instead of JSON text.
+        '''
+        encoding = getEncoding(path)
+        self.__logger.info('Received new client ({} encoding).'.format(encoding))
+        client = NotifierClient(websocket, self.maxClientQueueSize, self.overflowPolicy, encoding)
+        if encoding == Encoding.PACKED:
+            definitions = self.__packedEncoder.getDefinitionsFrame()
+            if definitions != None:
+                client.push(definitions, isPinned=True)
+        self.__replay(client)
+        self.clients[websocket] = client
+        writerTask = asyncio.ensure_future(self.__runWriter(client))
         try:
             while True:
                 message = await websocket.recv()
@@ -83,32 +423,151 @@ class Notifier:
         except websockets.ConnectionClosed:
             pass
         finally:
-            self.clients.remove(websocket)
+            del self.clients[websocket]
+            writerTask.cancel()
+
+    async def __runWriter(self, client):
+        try:
+            await client.writer()
+        except websockets.ConnectionClosed:
+            pass
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.__logger.error('Exception while trying to send data: {}'.format(str(e)))
 
     async def run(self):
         self.isRunning = True
         while self.isRunning:
-            sendQueue = []
-            with self.lock:
-                sendQueue = self.queue.copy()
-                self.queue.clear()
+            # Sleep until something is enqueued, then take everything that piled up in the meantime
+            sendQueue = [await self.__queue.get()]
+            while not self.__queue.empty():
+                sendQueue.append(self.__queue.get_nowait())
 
-            for item in sendQueue:
-                jsonifiedMsg = json.dumps(item)
-                try:
-                    await asyncio.gather(
-                        *[ws.send(jsonifiedMsg) for ws in self.clients],
-                        return_exceptions=False
-                    )
-                except Exception as e:
-                    self.__logger.error('Exception while trying to send data: {}'.format(str(e)))
+            if None in sendQueue:   # Sentinel pushed by setDead
+                self.isRunning = False
+                sendQueue = [item for item in sendQueue if item != None]
 
-            await asyncio.sleep(0.16)
+            for item, traceId in sendQueue:
+                self.__recordForReplay(item)
+
+            tracer = tracing.activeTracer
+            if tracer != None:
+                for item, traceId in sendQueue:
+                    tracer.asyncEnd('notification', 'notifier', traceId, {"clients": len(self.clients)})
+
+            if len(self.clients) == 0:
+                continue
+
+            # Each message is serialized once per encoding in use, and the same frame is queued for
+            # every client of that encoding. The clients' writer tasks take care of the actual sends.
+            for item, traceId in sendQueue:
+                jsonifiedMsg = None
+                packedFrame = None
+                conflationKey = getConflationKey(item)
+                for client in self.clients.values():
+                    if client.encoding == Encoding.PACKED:
+                        if packedFrame == None:
+                            packedFrame, hasNewDefinitions = self.__encodePacked(item)
+                        # A frame that needed new definitions must stay behind them: no conflation
+                        client.push(packedFrame, conflationKey if not hasNewDefinitions else None, traceId)
+                    else:
+                        if jsonifiedMsg == None:
+                            jsonifiedMsg = json.dumps(item)
+                        client.push(jsonifiedMsg, conflationKey, traceId)
+                await asyncio.sleep(0) # Give the writers a chance to keep up with large bursts
         
         self.__logger.info('Websocket loop exiting.')
+
+    def __encodePacked(self, item, newClient=None):
+        '''
+        Encodes an item with the shared PackedEncoder. Definitions it introduces are queued right
+        away for every packed client (and for 'newClient', not registered yet), ahead of the frame.
+
+        returns:
+            (bytes, bool)
+                The frame, and whether or not it introduced definitions
+        '''
+        definitions, frame = self.__packedEncoder.encode(item)
+        if len(definitions) > 0:
+            clients = [client for client in self.clients.values() if client.encoding == Encoding.PACKED]
+            if newClient != None:
+                clients.append(newClient)
+            for client in clients:
+                for definition in definitions:
+                    client.push(definition, isPinned=True)
+
+        return frame, len(definitions) > 0
+
+    def __recordForReplay(self, item):
+        ''' Keeps track of what a client joining later must be sent. Runs on the notifier event loop. '''
+        level = item["level"]
+        if level == NotificationLevel.IO_STATE:
+            key = getConflationKey(item)
+            if key == None:
+                return
+            self.__ioStates.pop(key, None)
+            self.__ioStates[key] = item
+            if len(self.__ioStates) > Notifier.MAX_SNAPSHOT_IO_STATES:
+                self.__ioStates.popitem(last=False)
+            return
+
+        if level in Notifier.RUN_STATUS_LEVELS:
+            self.__runStatus = item
+        elif level == NotificationLevel.APP_STATE_CHANGE:
+            self.__appState = item
+        self.__history.append(item)
+
+    def __replay(self, client):
+        '''
+        Queues the recent history, then the current snapshot, for a client that just connected.
+        At most half of the client's queue is used, keeping the most recent items.
+        '''
+        items = list(self.__history)
+        items.extend([item for item in (self.__runStatus, self.__appState) if item != None and not item in self.__history])
+        items.extend(self.__ioStates.values())
+        items = items[-(client.maxQueueSize // 2):] if client.maxQueueSize >= 2 else []
+
+        for item in items:
+            if client.encoding == Encoding.PACKED:
+                frame, _ = self.__encodePacked(item, client)
+            else:
+                frame = json.dumps(item)
+            client.push(frame)
+
+    def getClientStats(self):
+        '''
+        Returns the lag counters of every connected client.
+
+        returns:
+            list<dict>
+        '''
+        return [client.getStats() for client in list(self.clients.values())]
+
+    def __getClientStatsByAddress(self):
+        stats = {}
+        for websocket, client in list(self.clients.items()):
+            address = getattr(websocket, 'remote_address', None)
+            key = '{}:{}'.format(*address[:2]) if address else str(id(websocket))
+            stats[key] = client.getStats()
+        return stats
+
+    def __enqueue(self, item):
+        ''' Runs on the notifier event loop. Use __post to call it from another thread. '''
+        self.__queue.put_nowait(item)
+
+    def __post(self, item):
+        '''
+        Hands an item over to the notifier event loop. Safe to call from any thread.
+        Items are (message, traceId) tuples, or None to stop the send loop.
+        '''
+        try:
+            self.__loop.call_soon_threadsafe(self.__enqueue, item)
+        except RuntimeError:
+            self.__logger.error('Unable to send data: the notifier event loop is closed')
             
     def setDead(self):
-        self.isRunning = False
+        self.__post(None)
         self.__logger.info('Websocket server set to die')
 
     def sendMessage(self, level, message, customPayload=None):
@@ -125,14 +584,19 @@ class Notifier:
         '''
 
         jsonMsg = {
-            "timeSeconds": time.time(),
+            "timeSeconds": getClock().time(),
             "level": level,
             "message": message,
             "customPayload": customPayload
         }
 
-        with self.lock:
-            self.queue.append(jsonMsg)
+        traceId = None
+        tracer = tracing.activeTracer
+        if tracer != None:
+            traceId = tracer.nextId()
+            tracer.asyncBegin('notification', 'notifier', traceId, {"level": level, "message": message})
+
+        self.__post((jsonMsg, traceId))
 
 globalNotifier = None
 
@@ -142,12 +606,12 @@ def initializeNotifier():
         logging.error('Attempting to initialize the globalNotifier again')
         return
         
-    globalNotifier = Notifier()
+    globalNotifier = Notifier(metricsPort=Notifier.METRICS_PORT)
 
 def getNotifier():
     ''' Retrieves the singleton instance of the global notifier '''
     global globalNotifier
     if globalNotifier == None:
-        globalNotifier = Notifier()
+        globalNotifier = Notifier(metricsPort=Notifier.METRICS_PORT)
 
     return globalNotifier
\ No newline at end of file
@@ -0,0 +1,129 @@
+import math
+import threading
+
+class LatencyHistogram:
+    '''
+    Histogram of durations with logarithmic buckets.
+
+    Recording a value is a log and a list increment, whatever the number of samples.
+    Percentiles are accurate to the bucket width (GROWTH, i.e. 5%).
+    '''
+    MIN_SECONDS = 1e-6
+    GROWTH      = 1.05
+    NUM_BUCKETS = 480       # Covers 1us to ~1.4e4s
+
+    def __init__(self):
+        self.__buckets = [0] * LatencyHistogram.NUM_BUCKETS
+        self.__logGrowth = math.log(LatencyHistogram.GROWTH)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.min = None
+
+    def record(self, seconds):
+        if seconds <= LatencyHistogram.MIN_SECONDS:
+            idx = 0
+        else:
+            idx = min(int(math.log(seconds / LatencyHistogram.MIN_SECONDS) / self.__logGrowth), LatencyHistogram.NUM_BUCKETS - 1)
+
+        self.__buckets[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if self.min == None or seconds < self.min:
+            self.min = seconds
+
+    def percentile(self, p):
+        '''
+        Returns the upper bound of the bucket holding the p-th percentile (0 < p <= 100),
+        capped to the largest recorded value. The last bucket holds every longer duration,
+        so its percentiles are the largest recorded value.
+        '''
+        if self.count == 0:
+            return None
+
+        threshold = self.count * p / 100.0
+        seen = 0
+        for idx, bucketCount in enumerate(self.__buckets):
+            seen += bucketCount
+            if seen >= threshold and bucketCount > 0:
+                if idx == LatencyHistogram.NUM_BUCKETS - 1:
+                    return self.max
+                return min(LatencyHistogram.MIN_SECONDS * LatencyHistogram.GROWTH ** (idx + 1), self.max)
+
+        return self.max
+
+    def getSummary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count > 0 else None
+        }
+
+class StateProfiler:
+    '''
+    Records how long each state spends in each phase of its lifecycle.
+
+    Phases recorded by the engine:
+        onEnter, update, onLeave:   duration of the corresponding callback
+        transition:                 whole state transition (onLeave + onEnter + bookkeeping)
+        transitionLatency:          time between the gotoState call and the start of the transition
+        inState:                    time between entering and leaving the state
+    '''
+    ON_ENTER    = 'onEnter'
+    UPDATE      = 'update'
+    ON_LEAVE    = 'onLeave'
+    TRANSITION  = 'transition'
+    TRANSITION_LATENCY = 'transitionLatency'
+    IN_STATE    = 'inState'
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__histograms = {}      # Maps state names to a dict of phase -> LatencyHistogram
+
+    def record(self, state, phase, seconds):
+        phases = self.__histograms.get(state)
+        if phases == None:
+            with self.__lock:
+                phases = self.__histograms.setdefault(state, {})
+
+        histogram = phases.get(phase)
+        if histogram == None:
+            with self.__lock:
+                histogram = phases.setdefault(phase, LatencyHistogram())
+
+        histogram.record(seconds)
+
+    def reset(self):
+        with self.__lock:
+            self.__histograms = {}
+
+    def getSummary(self):
+        '''
+        Returns the statistics of every recorded state and phase, in seconds.
+
+        returns:
+            dict<str, dict<str, dict>>
+                e.g. summary['Cut']['onEnter']['p95']
+        '''
+        with self.__lock:
+            histograms = {state: dict(phases) for state, phases in self.__histograms.items()}
+
+        return {state: {phase: histogram.getSummary() for phase, histogram in phases.items()}
+                for state, phases in histograms.items()}
+
+    def format(self):
+        ''' Returns a human readable table of the summary '''
+        def ms(value):
+            return '{:9.1f}'.format(value * 1000.0) if value != None else '        -'
+
+        lines = ['{:<20} {:<11} {:>7} {:>9} {:>9} {:>9} {:>9}  (ms)'.format('State', 'Phase', 'Count', 'p50', 'p95', 'p99', 'max')]
+        for state, phases in sorted(self.getSummary().items()):
+            for phase, stats in sorted(phases.items()):
+                lines.append('{:<20} {:<11} {:>7} {} {} {} {}'.format(
+                    state, phase, stats["count"], ms(stats["p50"]), ms(stats["p95"]), ms(stats["p99"]), ms(stats["max"])))
+        return '\n'.join(lines)
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+import logging
+import atexit
+
+TRACE_FILE_ENVIRONMENT_VARIABLE = 'MACHINEAPP_TRACE_FILE'
+
+class Tracer:
+    '''
+    Writes events in the Trace Event Format (JSON array flavour), which can be opened in
+    Perfetto (ui.perfetto.dev) or chrome://tracing.
+
+    Timestamps come from time.monotonic, which is shared by every process of the machine,
+    so traces written by the MachineApp subprocess and by the server process line up once
+    merged with mergeTraceFiles.
+
+    Do not instantiate this directly: use enableTracing, then guard every call with
+    'if tracing.activeTracer != None' so that disabled tracing costs a single attribute lookup.
+    '''
+    FLUSH_EVERY_EVENTS = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+        self.__buffer = []
+        self.__file = open(path, 'w')
+        self.__file.write('[')
+        self.__hasEvents = False         # Every event but the first is preceded by a comma
+        self.__nextId = 0
+
+    @staticmethod
+    def now():
+        ''' Returns the current trace timestamp, in microseconds '''
+        return time.monotonic() * 1e6
+
+    def nextId(self):
+        ''' Returns a unique id, to pair asynchronous begin and end events '''
+        with self.__lock:
+            self.__nextId += 1
+            return self.__nextId
+
+    def complete(self, name, category, startUs, durationUs, args=None):
+        ''' Records a span that started at startUs and lasted durationUs '''
+        self.__append({"name": name, "cat": category, "ph": "X", "ts": startUs, "dur": durationUs}, args)
+
+    def instant(self, name, category, args=None):
+        ''' Records a point in time on the calling thread '''
+        self.__append({"name": name, "cat": category, "ph": "i", "s": "t", "ts": Tracer.now()}, args)
+
+    def asyncBegin(self, name, category, eventId, args=None):
+        ''' Starts a span that may end on another thread (see asyncEnd) '''
+        self.__append({"name": name, "cat": category, "ph": "b", "id": eventId, "ts": Tracer.now()}, args)
+
+    def asyncEnd(self, name, category, eventId, args=None):
+        self.__append({"name": name, "cat": category, "ph": "e", "id": eventId, "ts": Tracer.now()}, args)
+
+    def span(self, name, category, args=None):
+        '''
+        Context manager recording the duration of a block:
+
+            with tracing.activeTracer.span('Cut', 'state'):
+                ...
+        '''
+        return _Span(self, name, category, args)
+
+    def flush(self):
+        with self.__lock:
+            self.__flushLocked()
+
+    def close(self):
+        with self.__lock:
+            self.__flushLocked()
+            self.__file.write('\n]\n')
+            self.__file.close()
+
+    def __append(self, event, args):
+        event["pid"] = self.__pid
+        event["tid"] = threading.get_ident()
+        if args != None:
+            event["args"] = args
+
+        with self.__lock:
+            self.__buffer.append(event)
+            if len(self.__buffer) >= Tracer.FLUSH_EVERY_EVENTS:
+                self.__flushLocked()
+
+    def __flushLocked(self):
+        if len(self.__buffer) == 0 or self.__file.closed:
+            return
+        separator = ',\n' if self.__hasEvents else '\n'
+        self.__file.write(separator + ',\n'.join([json.dumps(event) for event in self.__buffer]))
+        self.__hasEvents = True
+        self.__file.flush()
+        self.__buffer = []
+
+class _Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.startUs = Tracer.now()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.tracer.complete(self.name, self.category, self.startUs, Tracer.now() - self.startUs, self.args)
+        return False
+
+activeTracer = None
+
+def enableTracing(path):
+    '''
+    Starts writing trace events of this process to the provided file.
+
+    returns:
+        Tracer
+    '''
+    global activeTracer
+    if activeTracer != None:
+        logging.getLogger(__name__).warning('Tracing is already enabled, writing to {}'.format(activeTracer.path))
+        return activeTracer
+
+    activeTracer = Tracer(path)
+    return activeTracer
+
+def disableTracing():
+    ''' Stops tracing and closes the trace file '''
+    global activeTracer
+    tracer = activeTracer
+    activeTracer = None
+    if tracer != None:
+        tracer.close()
+
+def mergeTraceFiles(paths, outputPath):
+    '''
+    Merges the trace files of several processes into one timeline. Files that were not
+    closed properly (e.g. the process was killed) are accepted.
+    '''
+    events = []
+    for path in paths:
+        with open(path) as f:
+            content = f.read().strip()
+        if not content.endswith(']'):
+            content = content + ']'
+        events.extend(json.loads(content))
+
+    with open(outputPath, 'w') as f:
+        json.dump(events, f)
+
+# Processes started with MACHINEAPP_TRACE_FILE set trace themselves, one file per process
+if os.environ.get(TRACE_FILE_ENVIRONMENT_VARIABLE):
+    enableTracing('{}.{}.json'.format(os.environ[TRACE_FILE_ENVIRONMENT_VARIABLE], os.getpid()))
+    atexit.register(disableTracing)
@@ -0,0 +1,229 @@
+import json
+import struct
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+class Encoding:
+    '''
+    Encodings a Notifier client can ask for, with the 'encoding' query parameter of the
+    websocket URL (e.g. ws://machine:8081/?encoding=packed). JSON is the default.
+    '''
+    JSON    = 'json'
+    PACKED  = 'packed'
+
+def getEncoding(path):
+    '''
+    Returns the encoding requested by a websocket path. Falls back to JSON.
+    '''
+    values = parse_qs(urlparse(path or '').query).get('encoding')
+    if values and values[0] == Encoding.PACKED:
+        return Encoding.PACKED
+    return Encoding.JSON
+
+# One byte code of every NotificationLevel. Append new levels at the end: codes must never change.
+LEVEL_CODES = { level: code for code, level in enumerate([
+    'app_start',
+    'app_complete',
+    'app_pause',
+    'app_resume',
+    'app_state_change',
+    'app_estop_set',
+    'app_estop_release',
+    'info',
+    'warning',
+    'error',
+    'io_state',
+    'ui_info',
+    'profile'
+])}
+LEVELS_BY_CODE = { code: level for level, code in LEVEL_CODES.items() }
+
+class PackedEncoder:
+    '''
+    Encodes notifications into compact binary websocket frames. Layout (little-endian):
+
+        DEFINE_TEXT     u8 type=1, u16 id, utf-8 text
+        DEFINE_KEYS     u8 type=2, u16 id, utf-8 JSON array of payload keys
+        NOTIFICATION    u8 type=3, u8 level code, f64 timeSeconds, u16 text id, u8 payload kind, payload
+        DEFINITIONS     u8 type=4, then for each definition: u32 size, DEFINE_TEXT or DEFINE_KEYS frame
+
+    Levels are sent as their LEVEL_CODES code. Messages are interned once they repeat: the
+    first time a message is seen, it is sent inline. The second time, a DEFINE_TEXT frame
+    assigns it an id, and later notifications only carry the id. Dict payloads are sent as
+    the id of their (interned) keys followed by the JSON array of their values, once the same
+    keys were seen twice. Interned values are never forgotten, so messages that never repeat
+    (e.g. with an order number in them) must not take a slot of the tables. Payload kinds:
+
+        0: no payload
+        1: u16 keys id, utf-8 JSON array of values
+        2: utf-8 JSON of the payload
+        3: u16 text id of a level missing from LEVEL_CODES (level code 255), then kind 0, 1 or 2
+        4: utf-8 JSON of [message, payload, level], for messages not interned (text id 0xFFFF)
+
+    Definitions are shared by every packed client of a Notifier: a client must receive the
+    frame of 'getDefinitionsFrame' when it connects, then every frame, definitions included, in order.
+    '''
+    DEFINE_TEXT     = 1
+    DEFINE_KEYS     = 2
+    NOTIFICATION    = 3
+    DEFINITIONS     = 4
+
+    PAYLOAD_NONE    = 0
+    PAYLOAD_KEYED   = 1
+    PAYLOAD_JSON    = 2
+    PAYLOAD_CUSTOM_LEVEL = 3
+    PAYLOAD_INLINE  = 4
+
+    UNKNOWN_LEVEL   = 255
+    NO_ID           = 0xFFFF
+    MAX_DEFINITIONS = 4096
+    MAX_CANDIDATES  = 1024      # Values seen once that are remembered, in case they repeat
+
+    __header = struct.Struct('<BBdHB')
+    __definition = struct.Struct('<BH')
+    __id = struct.Struct('<H')
+    __size = struct.Struct('<I')
+
+    def __init__(self):
+        self.__jsonEncoder = json.JSONEncoder(separators=(',', ':'))
+        self.__textIds = {}         # Maps interned texts to their id
+        self.__keysIds = {}         # Maps interned key tuples to their id
+        self.__definitions = []     # Every definition frame, in order
+        self.__candidates = OrderedDict()   # (frame type, value) seen once and not interned, least recently seen first
+
+    def getDefinitionsFrame(self):
+        '''
+        Returns a single frame holding every definition so far, that a new client must receive
+        before anything else, or None if nothing was defined yet.
+        '''
+        if len(self.__definitions) == 0:
+            return None
+        return bytes([PackedEncoder.DEFINITIONS]) + b''.join([PackedEncoder.__size.pack(len(d)) + d for d in self.__definitions])
+
+    def encode(self, item):
+        '''
+        Encodes a notification dict (timeSeconds, level, message, customPayload).
+
+        returns:
+            (list<bytes>, bytes)
+                Definition frames introduced by this notification (to be sent first), and the notification frame
+        '''
+        definitions = []
+        levelCode = LEVEL_CODES.get(item["level"], PackedEncoder.UNKNOWN_LEVEL)
+        textId = self.__intern(self.__textIds, item["message"] or '', PackedEncoder.DEFINE_TEXT, definitions)
+        levelTextId = None
+        if levelCode == PackedEncoder.UNKNOWN_LEVEL:
+            levelTextId = self.__intern(self.__textIds, item["level"], PackedEncoder.DEFINE_TEXT, definitions)
+
+        payload = item["customPayload"]
+        if textId == PackedEncoder.NO_ID or levelTextId == PackedEncoder.NO_ID:
+            textId = PackedEncoder.NO_ID
+            kind, body = PackedEncoder.PAYLOAD_INLINE, self.__jsonEncoder.encode([item["message"], payload, item["level"]]).encode('utf-8')
+        elif payload == None:
+            kind, body = PackedEncoder.PAYLOAD_NONE, b''
+        else:
+            keysId = PackedEncoder.NO_ID
+            if isinstance(payload, dict) and all(isinstance(key, str) for key in payload):
+                keysId = self.__intern(self.__keysIds, tuple(payload.keys()), PackedEncoder.DEFINE_KEYS, definitions)
+            if keysId != PackedEncoder.NO_ID:
+                kind, body = PackedEncoder.PAYLOAD_KEYED, PackedEncoder.__id.pack(keysId) + self.__jsonEncoder.encode(list(payload.values())).encode('utf-8')
+            else:
+                kind, body = PackedEncoder.PAYLOAD_JSON, self.__jsonEncoder.encode(payload).encode('utf-8')
+
+        if levelTextId != None and textId != PackedEncoder.NO_ID:
+            kind, body = PackedEncoder.PAYLOAD_CUSTOM_LEVEL, PackedEncoder.__id.pack(levelTextId) + bytes([kind]) + body
+
+        frame = PackedEncoder.__header.pack(PackedEncoder.NOTIFICATION, levelCode, item["timeSeconds"], textId, kind) + body
+        return definitions, frame
+
+    def __intern(self, ids, value, frameType, definitions):
+        valueId = ids.get(value)
+        if valueId != None:
+            return valueId
+
+        if len(ids) >= PackedEncoder.MAX_DEFINITIONS:
+            return PackedEncoder.NO_ID
+
+        candidate = (frameType, value)
+        if not candidate in self.__candidates:
+            self.__candidates[candidate] = True
+            if len(self.__candidates) > PackedEncoder.MAX_CANDIDATES:
+                self.__candidates.popitem(last=False)
+            return PackedEncoder.NO_ID
+        del self.__candidates[candidate]
+
+        valueId = len(ids)
+        ids[value] = valueId
+        text = value if frameType == PackedEncoder.DEFINE_TEXT else self.__jsonEncoder.encode(list(value))
+        definition = PackedEncoder.__definition.pack(frameType, valueId) + text.encode('utf-8')
+        self.__definitions.append(definition)
+        definitions.append(definition)
+        return valueId
+
+class PackedDecoder:
+    '''
+    Decodes the frames of a PackedEncoder back into notification dicts. Reference
+    implementation for clients, and useful for tests and tools.
+    '''
+    __header = struct.Struct('<BBdHB')
+    __definition = struct.Struct('<BH')
+    __id = struct.Struct('<H')
+    __size = struct.Struct('<I')
+
+    def __init__(self):
+        self.__texts = {}
+        self.__keys = {}
+
+    def decode(self, frame):
+        '''
+        Decodes a frame.
+
+        returns:
+            dict
+                The notification, or None for definition frames
+        '''
+        frameType = frame[0]
+        if frameType == PackedEncoder.DEFINITIONS:
+            offset = 1
+            while offset < len(frame):
+                size, = PackedDecoder.__size.unpack_from(frame, offset)
+                offset += PackedDecoder.__size.size
+                self.decode(frame[offset:offset + size])
+                offset += size
+            return None
+
+        if frameType in (PackedEncoder.DEFINE_TEXT, PackedEncoder.DEFINE_KEYS):
+            _, valueId = PackedDecoder.__definition.unpack_from(frame)
+            text = frame[PackedDecoder.__definition.size:].decode('utf-8')
+            if frameType == PackedEncoder.DEFINE_TEXT:
+                self.__texts[valueId] = text
+            else:
+                self.__keys[valueId] = json.loads(text)
+            return None
+
+        _, levelCode, timeSeconds, textId, kind = PackedDecoder.__header.unpack_from(frame)
+        body = frame[PackedDecoder.__header.size:]
+        level = LEVELS_BY_CODE.get(levelCode)
+
+        if kind == PackedEncoder.PAYLOAD_INLINE:
+            message, payload, level = json.loads(body.decode('utf-8'))
+            return { "timeSeconds": timeSeconds, "level": level, "message": message, "customPayload": payload }
+
+        if kind == PackedEncoder.PAYLOAD_CUSTOM_LEVEL:
+            level = self.__texts[PackedDecoder.__id.unpack_from(body)[0]]
+            kind, body = body[2], body[3:]
+
+        return {
+            "timeSeconds": timeSeconds,
+            "level": level,
+            "message": self.__texts[textId],
+            "customPayload": self.__decodePayload(kind, body)
+        }
+
+    def __decodePayload(self, kind, body):
+        if kind == PackedEncoder.PAYLOAD_NONE:
+            return None
+        if kind == PackedEncoder.PAYLOAD_KEYED:
+            keys = self.__keys[PackedDecoder.__id.unpack_from(body)[0]]
+            return dict(zip(keys, json.loads(body[2:].decode('utf-8'))))
+        return json.loads(body.decode('utf-8'))
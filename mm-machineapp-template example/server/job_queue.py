@@ -0,0 +1,290 @@
+from collections import deque, namedtuple
+import logging
+import threading
+from internal.metrics import registry
+
+PENDING_SHEETS = registry.gauge('machineapp_pending_sheets', 'Sheets ordered and not cut yet')
+
+EPSILON = 1e-6          # Tolerance (mm) when checking whether a sheet fits on a roll
+
+# A sheet to cut. 'roll' is the index of the roll it is planned on: 0 is the roll currently
+# loaded, 1 the next one, and so on.
+PlannedCut = namedtuple('PlannedCut', ['orderId', 'length', 'roll'])
+
+class Order():
+    ''' Sheets of the same length, submitted together '''
+
+    def __init__(self, orderId, length, quantity, name=None):
+        self.id = orderId
+        self.length = length
+        self.quantity = quantity
+        self.name = name
+        self.completed = 0
+        self.started = 0        # Sheets being cut right now
+
+    def getPendingCount(self):
+        ''' Sheets that are not cut yet '''
+        return self.quantity - self.completed
+
+    def getUnplannedCount(self):
+        ''' Sheets that are not cut yet, nor being cut '''
+        return self.quantity - self.completed - self.started
+
+    def toDict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "length": self.length,
+            "quantity": self.quantity,
+            "completed": self.completed
+        }
+
+class CutPlan():
+    '''
+    Sequence in which the pending sheets are cut, as computed by 'planCuts'.
+
+    rollChanges is the number of new rolls the plan needs. scrapLength is the material
+    thrown away: the scrap distance cut at the start of every new roll, plus what is
+    left on every roll that is changed before it runs out. What is left on the last roll
+    is not counted, since it is used by the next orders.
+    '''
+
+    def __init__(self, cuts, rollChanges, scrapLength, leftoverLength):
+        self.cuts = cuts
+        self.rollChanges = rollChanges
+        self.scrapLength = scrapLength
+        self.leftoverLength = leftoverLength
+
+    def format(self):
+        lines = ['{} sheets on {} roll(s), {} roll change(s), {:.1f}mm of scrap'.format(
+            len(self.cuts), self.rollChanges + 1, self.rollChanges, self.scrapLength)]
+        for roll in range(self.rollChanges + 1):
+            groups = []
+            for cut in self.cuts:
+                if cut.roll != roll:
+                    continue
+                if len(groups) > 0 and groups[-1][0] == (cut.orderId, cut.length):
+                    groups[-1][1] += 1
+                else:
+                    groups.append([(cut.orderId, cut.length), 1])
+            lines.append('  Roll {}: {}'.format(roll, ', '.join(['{} x {}mm (order {})'.format(count, length, orderId) for (orderId, length), count in groups])))
+        return '\n'.join(lines)
+
+def planCuts(pieces, remainingLength, rollLength=None, scrapDistance=0):
+    '''
+    Solves the 1-D cutting-stock problem of the pending sheets with first-fit decreasing:
+    sheets are placed from the longest to the shortest, each on the first roll with enough
+    material left, starting with the roll currently loaded. Sheets of the same length are
+    placed as a group, so planning costs one pass over the rolls per distinct length.
+
+    On each roll, the sheets are then cut order by order (oldest first), with sheets of
+    the same length back to back.
+
+    params:
+        pieces: list<(int, float, int)>
+            (order id, length, count) of the sheets to cut, oldest order first
+        remainingLength: float
+            Material left on the roll currently loaded. float('inf') when unknown.
+        rollLength: float
+            (Optional) Length of a new roll. None when unknown, in which case everything is
+            planned on the current roll.
+        scrapDistance: float
+            (Optional) Material thrown away at the start of every new roll
+
+    returns:
+        CutPlan
+    '''
+    usableLength = rollLength - scrapDistance if rollLength != None else float('inf')
+    freeLengths = [remainingLength]     # Material left on each roll
+    assignments = [[]]                  # (order id, length, count) planned on each roll
+
+    # sorted is stable: among sheets of the same length, the oldest orders are placed first
+    for orderId, length, count in sorted(pieces, key=lambda piece: -piece[1]):
+        for roll in range(len(freeLengths)):
+            if count == 0:
+                break
+            fit = _fitCount(freeLengths[roll], length, count)
+            if fit > 0:
+                assignments[roll].append((orderId, length, fit))
+                freeLengths[roll] -= fit * length
+                count -= fit
+
+        while count > 0:
+            fit = _fitCount(usableLength, length, count)
+            if fit == 0:
+                raise ValueError('Sheets of {}mm do not fit on a roll'.format(length))
+            assignments.append([(orderId, length, fit)])
+            freeLengths.append(usableLength - fit * length)
+            count -= fit
+
+    cuts = []
+    for roll, assigned in enumerate(assignments):
+        for orderId, length, count in sorted(assigned, key=lambda a: (a[0], -a[1])):
+            cuts.extend([PlannedCut(orderId, length, roll)] * count)
+
+    rollChanges = len(freeLengths) - 1
+    scrapLength = rollChanges * scrapDistance + sum(freeLengths[:-1])
+    return CutPlan(cuts, rollChanges, scrapLength, freeLengths[-1])
+
+def _fitCount(freeLength, length, count):
+    ''' Returns how many of 'count' sheets of 'length' fit in 'freeLength' '''
+    if freeLength == float('inf'):
+        return count
+    return min(count, int((freeLength + EPSILON) // length))
+
+class JobQueue():
+    '''
+    Orders waiting to be cut. Orders can be submitted from any thread, at any time: the
+    pending sheets of every order are planned together (see planCuts), so that a new order
+    can use the material left by the previous ones.
+
+    The engine thread asks for the next sheet with 'nextCut', then reports it with
+    'startCut' and 'completeCut'. A sheet started but not completed (e.g. the MachineApp
+    was stopped mid-cut) is planned again by the next call to 'replan'.
+    '''
+
+    def __init__(self, rollLength=None, scrapDistance=0, onSubmit=None):
+        '''
+        params:
+            rollLength: float
+                (Optional) Length of a new roll. None when unknown.
+            scrapDistance: float
+                (Optional) Material thrown away at the start of every new roll
+            onSubmit: func() -> void
+                (Optional) Called whenever an order is submitted, e.g. BaseMachineAppEngine.wakeup
+        '''
+        self.logger = logging.getLogger(__name__)
+        self.rollLength = rollLength
+        self.scrapDistance = scrapDistance
+        self.__onSubmit = onSubmit
+        self.__lock = threading.Lock()
+        self.__orders = {}                  # Maps order ids to their Order, in submission order
+        self.__nextOrderId = 1
+        self.__plan = None                  # Last CutPlan, None when it must be computed again
+        self.__cuts = deque()               # Sheets of the plan that were not started yet
+        self.__plannedRemaining = None      # Material the plan expects on the current roll
+
+    def submit(self, length, quantity, name=None):
+        '''
+        Adds an order to the queue.
+
+        returns:
+            int
+                Id of the order
+        '''
+        length = float(length)
+        quantity = int(quantity)
+        if length <= 0 or quantity <= 0:
+            raise ValueError('Invalid order: {} sheets of {}mm'.format(quantity, length))
+        if self.rollLength != None and length > self.rollLength - self.scrapDistance + EPSILON:
+            raise ValueError('Sheets of {}mm do not fit on a roll of {}mm'.format(length, self.rollLength))
+
+        with self.__lock:
+            orderId = self.__nextOrderId
+            self.__nextOrderId += 1
+            self.__orders[orderId] = Order(orderId, length, quantity, name)
+            self.__plan = None
+            self.__updatePendingSheets()
+
+        self.logger.info('Order {} submitted: {} sheets of {}mm'.format(orderId, quantity, length))
+        if self.__onSubmit != None:
+            self.__onSubmit()
+        return orderId
+
+    def cancel(self, orderId):
+        ''' Removes the sheets of an order that were not cut yet '''
+        with self.__lock:
+            order = self.__orders.pop(orderId, None)
+            if order != None:
+                self.__plan = None
+                self.__updatePendingSheets()
+        return order != None
+
+    def replan(self):
+        '''
+        Plans the pending sheets again on the next call to 'nextCut'. Sheets that were started
+        and never completed are planned again: call it when a run starts.
+        '''
+        with self.__lock:
+            for order in self.__orders.values():
+                order.started = 0
+            self.__plan = None
+
+    def hasPendingCuts(self):
+        with self.__lock:
+            return any(order.getPendingCount() > 0 for order in self.__orders.values())
+
+    def getPendingCount(self):
+        with self.__lock:
+            return sum([order.getPendingCount() for order in self.__orders.values()])
+
+    def getOrders(self):
+        ''' Returns the orders that are not complete, oldest first '''
+        with self.__lock:
+            return [order.toDict() for order in self.__orders.values()]
+
+    def getPlan(self):
+        ''' Returns the last CutPlan, or None if the queue changed since '''
+        return self.__plan
+
+    def nextCut(self, remainingLength):
+        '''
+        Returns the next sheet to cut, without starting it. If it is planned on a roll other
+        than 0, the current roll must be changed first.
+
+        params:
+            remainingLength: float
+                Material left on the roll currently loaded. float('inf') when unknown.
+
+        returns:
+            PlannedCut
+                None if there is nothing left to cut
+        '''
+        with self.__lock:
+            if self.__plan == None or abs(remainingLength - self.__plannedRemaining) > EPSILON:
+                self.__computePlan(remainingLength)
+            return self.__cuts[0] if len(self.__cuts) > 0 else None
+
+    def startCut(self, cut):
+        ''' Takes the sheet returned by 'nextCut' off the plan '''
+        with self.__lock:
+            if len(self.__cuts) > 0 and self.__cuts[0] == cut:
+                self.__cuts.popleft()
+                order = self.__orders.get(cut.orderId)
+                if order != None:
+                    order.started += 1
+                if cut.roll == 0:
+                    self.__plannedRemaining -= cut.length
+
+    def completeCut(self, cut):
+        '''
+        Counts a sheet as cut.
+
+        returns:
+            bool
+                True if this sheet completed its order
+        '''
+        with self.__lock:
+            order = self.__orders.get(cut.orderId)
+            if order == None:
+                return False
+            order.started = max(order.started - 1, 0)
+            order.completed += 1
+            self.__updatePendingSheets()
+            if order.getPendingCount() > 0:
+                return False
+            del self.__orders[order.id]
+
+        self.logger.info('Order {} complete: {} sheets of {}mm'.format(order.id, order.quantity, order.length))
+        return True
+
+    def __computePlan(self, remainingLength):
+        pieces = [(order.id, order.length, order.getUnplannedCount()) for order in self.__orders.values() if order.getUnplannedCount() > 0]
+        self.__plan = planCuts(pieces, remainingLength, self.rollLength, self.scrapDistance)
+        self.__cuts = deque(self.__plan.cuts)
+        self.__plannedRemaining = remainingLength
+        if len(pieces) > 0:
+            self.logger.info('Cut plan: {}'.format(self.__plan.format()))
+
+    def __updatePendingSheets(self):
+        PENDING_SHEETS.set(sum([order.getPendingCount() for order in self.__orders.values()]))
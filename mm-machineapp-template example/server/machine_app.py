@@ -2,14 +2,17 @@
 
 from env import env
 import logging
+import threading
 import time
 from internal.base_machine_app import MachineAppState, BaseMachineAppEngine
+from internal.motion_planner import AxisLimits, MotionPlanner
 #new from template needed in this program 
 from internal.notifier import NotificationLevel, sendNotification, getNotifier
 # from internal.io_monitor import IOMonitor
 from sensor import Sensor
 from digital_out import Digital_Out
 from pneumatic import Pneumatic
+from job_queue import JobQueue
 #from math import ceil, sqrt #we will not need math
 
 '''
@@ -24,6 +27,44 @@ else:
 
 class MachineAppEngine(BaseMachineAppEngine):
     ''' Manages and orchestrates your MachineAppStates '''
+    STOP_WHEN_QUEUE_EMPTY = True    # If False, the run waits for the next order once every order is cut. Only useful if something calls submitJob during the run.
+    ROLL_LOADED_BUTTON = None       # (networkId, pin) of the input the operator presses once a new roll is loaded. None feeds a new roll right away, without waiting for the operator.
+
+    def __init__(self, clock=None):
+        super().__init__(clock)
+        self.job_queue = JobQueue(onSubmit=self.requestUpdate) #orders are kept from one run to the next
+        self.configuration_orders = [] #ids of the orders that came from the configuration
+        self.roll_load_confirmed = threading.Event() #set by confirmRollLoaded, cleared when a roll is loaded
+
+    def submitJob(self, length, quantity, name=None):
+        '''
+        Queues an order of 'quantity' sheets of 'length' mm. Can be called from any thread,
+        whether the MachineApp is running or not: a running MachineApp starts cutting it as
+        soon as it is waiting for a job.
+
+        returns:
+            int
+                Id of the order
+        '''
+        return self.job_queue.submit(length, quantity, name)
+
+    def confirmRollLoaded(self):
+        '''
+        Tells the MachineApp that the operator loaded a new roll. Called when ROLL_LOADED_BUTTON
+        is pressed, and can be called from any thread, whether the MachineApp is running or not:
+        Wait_For_Roll feeds the roll as soon as it is confirmed. A confirmation made before the
+        run started counts for its first roll; one made while a roll is in use does not count
+        for the next roll.
+        '''
+        self.roll_load_confirmed.set()
+        self.requestUpdate()
+
+    def loadRoll(self):
+        ''' Closes the rollers on a new roll '''
+        self.roll_load_confirmed.clear()
+        self.roller_pneumatic.push()
+        self.roll_loaded = True
+        self.roll_remaining = self.Roll_length if self.Roll_length != None else float('inf')
 
     def buildStateDictionary(self):
         '''
@@ -38,14 +79,15 @@ class MachineAppEngine(BaseMachineAppEngine):
         '''
     
         stateDictionary = {
-            'Initialize'            : InitializeState(self),
-            'Feed_New_Roll'         : FeedNewRollState(self),
+            'Initialize'            : Initialize(self),
+            'Feed_New_Roll'         : Feed_New_Roll(self),
+            'Wait_For_Roll'         : Wait_For_Roll(self),
             'Roll'                  : Roll(self),
             'Clamp'                 : Clamp(self),
             'Cut'                   : Cut(self),
-            'Home'                  : HomingState(self), #home state rollers need to be down
-            'First_Roll'            : First_Roll(self)
-        
+            'Home'                  : Home(self), #home state rollers need to be down
+            'First_Roll'            : First_Roll(self),
+            'Wait_For_Job'          : Wait_For_Job(self)
 
         }
 
@@ -65,9 +107,9 @@ class MachineAppEngine(BaseMachineAppEngine):
         self.MachineMotion.configAxis(self.timing_belt_axis, 8, 150) #150 is for mechanical gain for timing belt. If gearbox used then divide by 5
         self.MachineMotion.configAxisDirection(self.timing_belt_axis, 'positive')
         #Rollers
-        # self.roller_axis = 2
-        # self.MachineMotion.configAxis(self.roller_axis, 8, 319.186) 
-        # self.MachineMotion.configAxisDirection(self.roller_axis, 'positive')
+        self.roller_axis = 2
+        self.MachineMotion.configAxis(self.roller_axis, 8, 319.186) 
+        self.MachineMotion.configAxisDirection(self.roller_axis, 'positive')
         #pneumatics
         dio1 = mm_IP
         dio2 = mm_IP
@@ -79,15 +121,45 @@ class MachineAppEngine(BaseMachineAppEngine):
         #outputs
         self.knife_output = Digital_Out("Knife Output", ipAddress=dio1, networkId=1, pin=0) #double check correct when knife installed
 
+        #inputs
+        if self.ROLL_LOADED_BUTTON != None:
+            networkId, pin = self.ROLL_LOADED_BUTTON
+            self.roll_loaded_button = Sensor("Roll Loaded Button", ipAddress=dio1, networkId=networkId, pin=pin)
+            self.roll_loaded_button.register_on_rising_edge(self.confirmRollLoaded)
+
         #Setup your global variables
-        Length = input() #this will need to be tied to the UI
-        Num_of_sheets = input() #this will need to be tied to the UI
-        Roller_speed = 100 #100 is max roller speed; can be lower
-        Roller_accel = 100
-        TimingBelt_speed = 900
-        TimingBelt_accel = 850
-        scrap_distance = 350 #distance from roller to blade 
-        flag = 0 #this will note if a new roll is in place
+        configuration = self.getConfiguration() or {}
+        #Axis limits (mm/s, mm/s^2, mm/s^3): the speed and acceleration of every move are planned from them
+        #Without a jerk limit, the planned values give the same moves as sending the max speed and accel
+        self.Roller_limits = AxisLimits(configuration.get('Roller_max_speed', 100), #100 is max roller speed; can be lower
+                                        configuration.get('Roller_max_accel', 100),
+                                        configuration.get('Roller_max_jerk'))
+        self.TimingBelt_limits = AxisLimits(configuration.get('TimingBelt_max_speed', 900),
+                                            configuration.get('TimingBelt_max_accel', 850),
+                                            configuration.get('TimingBelt_max_jerk'))
+        self.roller_planner = MotionPlanner(self.Roller_limits)
+        self.timing_belt_planner = MotionPlanner(self.TimingBelt_limits)
+        self.cut_distance = 1900 #timing belt travel across the sheet
+        self.scrap_distance = 350 #distance from roller to blade 
+        self.roll_loaded = False #this will note if a new roll is in place
+        self.Roll_length = float(configuration['Roll_length']) if 'Roll_length' in configuration else None #None when the length of a new roll is unknown
+        self.roll_remaining = 0 #material left on the loaded roll
+        self.current_cut = None #sheet being cut, None for the scrap piece of a new roll
+
+        #Orders: 'Length' and 'Num_of_sheets' for a single one, and/or a list of them in 'Jobs'
+        #They replace what is left of the orders of the previous configuration
+        self.job_queue.rollLength = self.Roll_length
+        self.job_queue.scrapDistance = self.scrap_distance
+        self.job_queue.replan()
+        for orderId in self.configuration_orders:
+            self.job_queue.cancel(orderId)
+        jobs = list(configuration.get('Jobs', []))
+        if 'Length' in configuration and 'Num_of_sheets' in configuration:
+            jobs.insert(0, configuration)
+        self.configuration_orders = [self.submitJob(job['Length'], job['Num_of_sheets'], job.get('Name')) for job in jobs]
+        if not self.job_queue.hasPendingCuts():
+            self.logger.warning('No order to cut: set Length and Num_of_sheets (or Jobs) in the configuration, or call submitJob')
+            sendNotification(NotificationLevel.WARNING, 'No order to cut: set Length and Num_of_sheets in the configuration')
 
 
     def onStop(self):
@@ -114,6 +186,21 @@ class MachineAppEngine(BaseMachineAppEngine):
         this method.
         '''
         self.MachineMotion.emitStop() 
+
+    def onResume(self):
+        '''
+        Called when a resume is requested from the REST API.
+        '''
+        pass
+
+    def onEstop(self):
+        '''
+        Called AFTER the MachineMotion has been estopped. All of the IOs are set back
+        to their safe position.
+        '''
+        self.knife_output.low() #knife goes down
+        self.roller_pneumatic.pull() #rollers up
+        self.plate_pneumatic.pull() #plate up
     
     
     def beforeRun(self):
@@ -160,14 +247,14 @@ class Initialize(MachineAppState):
 
     def onEnter(self):
         # Change below to ask for inputs
-        self.knife_output.low()
-        time.sleep(0.1) #make the seconds a variable such as knife wait 
+        self.engine.knife_output.low()
+        self.sleep(0.1) #make the seconds a variable such as knife wait 
         #self.engine.MachineMotion.waitForMotionCompletion() #is this correct usage? no 
-        #self.engine.MachineMotion.emitAbsoluteMove(self.timing_belt_axis,0) #moves timing belt to Home position (0)
-        self.engine.MachineMotion.emitHome(self.timing_belt_axis) #does same function as above
-        self.notifier.sendMessage(NotificationLevel.INFO,'Knife moving to home')
-        self.roller_pneumatic.pull()
-        self.plate_pneumatic.pull()
+        #self.engine.MachineMotion.emitAbsoluteMove(self.engine.timing_belt_axis,0) #moves timing belt to Home position (0)
+        self.engine.MachineMotion.emitHome(self.engine.timing_belt_axis) #does same function as above
+        sendNotification(NotificationLevel.INFO,'Knife moving to home')
+        self.engine.roller_pneumatic.pull()
+        self.engine.plate_pneumatic.pull()
         #self.notifier.sendMessage(NotificationLevel.INFO,'Pneumatics Up')
         
         # Ask for user 
@@ -183,24 +270,49 @@ class Feed_New_Roll(MachineAppState):
         super().__init__(engine)
 
     def onEnter(self):
-        self.knife_output.low()
-        time.sleep(0.5) #make the seconds a variable such as knife wait 
-        self.engine.MachineMotion.emitHome(self.timing_belt_axis)
-        self.roller_pneumatic.pull()
-        self.plate_pneumatic.pull()
+        self.engine.knife_output.low()
+        self.sleep(0.5) #make the seconds a variable such as knife wait 
+        self.engine.MachineMotion.emitHome(self.engine.timing_belt_axis)
+        self.engine.roller_pneumatic.pull()
+        self.engine.plate_pneumatic.pull()
         
-        #wait for input. need to add UI button. When input received, 'Roll Loaded' 
         #when users load a new roll they will tape the edges together. 
-        #load material to the rollers
-        self.roller_pneumatic.push()
+        if self.engine.ROLL_LOADED_BUTTON != None:
+            self.gotoState('Wait_For_Roll') #wait for the operator to press the button
+            return
 
-        #if flag set = 1 called First Roll
-        #possibly add code to first roll state
-        
+        #load material to the rollers
+        self.engine.loadRoll()
         self.gotoState('First_Roll')
     
     def update(self): 
         pass    
+
+class Wait_For_Roll(MachineAppState):
+    '''
+    Waits with the rollers open until the operator confirms that a new roll is loaded (see
+    MachineAppEngine.confirmRollLoaded), then closes the rollers on it. Only used when
+    ROLL_LOADED_BUTTON is set. Confirming runs 'update' right away, so this state does not poll.
+    '''
+    UPDATE_INTERVAL_SECONDS = float('inf')
+
+    def __init__(self, engine):
+        super().__init__(engine)
+
+    def onEnter(self):
+        if self.engine.roll_load_confirmed.is_set():
+            self.__loadRoll()
+            return
+        sendNotification(NotificationLevel.INFO, 'Load a new roll, then press the Roll Loaded button')
+
+    def update(self):
+        if self.engine.roll_load_confirmed.is_set():
+            self.__loadRoll()
+
+    def __loadRoll(self):
+        #load material to the rollers
+        self.engine.loadRoll()
+        self.gotoState('First_Roll')
     
 class First_Roll(MachineAppState):
     ''' Rolls material enought to cut first roll and scrap that first piece'''
@@ -208,8 +320,10 @@ class First_Roll(MachineAppState):
         super().__init__(engine)
 
     def onEnter(self):
-        self.engine.MachineMotion.emitRelativeMove(self.roller_axis,scrap_distance)    #scrap distance defined in global variables
-        Num_of_sheets + 1 #this makes sure we remove this cut from our count
+        self.engine.MachineMotion.emitRelativeMove(self.engine.roller_axis,"positive",self.engine.scrap_distance)    #scrap distance defined in global variables
+        self.engine.MachineMotion.waitForMotionCompletion()
+        self.engine.roll_remaining -= self.engine.scrap_distance
+        self.engine.current_cut = None #this makes sure this cut is not counted as a sheet
         self.gotoState('Clamp')
 
     def update(self): 
@@ -223,18 +337,21 @@ class Home(MachineAppState):
         super().__init__(engine)
 
     def onEnter(self):
-        self.knife_output.low()
-        time.sleep(0.5) #make the seconds a variable such as knife wait 
-        self.engine.MachineMotion.emitSpeed(TimingBelt_speed)
-        self.engine.MachineMotion.emitAcceleration(TimingBelt_accel)
-        self.engine.MachineMotion.emitAbsoluteMove(self.timing_belt_axis,0) #moves timing belt to Home position (0)
+        self.engine.knife_output.low()
+        self.sleep(0.5) #make the seconds a variable such as knife wait 
+        profile = self.engine.timing_belt_planner.plan(self.engine.cut_distance) #the knife comes back from the end of the cut
+        self.engine.MachineMotion.emitSpeed(profile.speed)
+        self.engine.MachineMotion.emitAcceleration(profile.acceleration)
+        self.engine.MachineMotion.emitAbsoluteMove(self.engine.timing_belt_axis,0) #moves timing belt to Home position (0)
         #self.notifier.sendMessage(NotificationLevel.INFO,'Knife moving to home')
-        self.roller_pneumatic.release()
+        self.engine.roller_pneumatic.release()
         #self.notifier.sendMessage(NotificationLevel.INFO,'Rollers Released')
-        #is there a roll? yes
-        self.gotoState('Roll')
-        #is there a roll? No
-        self.gotoState ('Feed_New_Roll')
+        if self.engine.roll_loaded:
+            #is there a roll? yes
+            self.gotoState('Roll')
+        else:
+            #is there a roll? No
+            self.gotoState ('Feed_New_Roll')
         
     #def onResume(self):
     #    self.gotoState('Initialize')    #I don't remember why this is here
@@ -256,8 +373,27 @@ class Roll(MachineAppState):
     # If there is a roll then continue, 
     # if not,
 
-        self.MachineMotion.emitStop()
-        self.gotoState('Feed_New_Roll')
+        if not self.engine.roll_loaded:
+            self.engine.MachineMotion.emitStop()
+            self.gotoState('Feed_New_Roll')
+            return
+
+        cut = self.engine.job_queue.nextCut(self.engine.roll_remaining)
+        if cut == None:
+            self.gotoState('Wait_For_Job')
+            return
+
+        if cut.roll > 0:
+            #the plan needs a new roll: what is left on this one is scrap
+            sendNotification(NotificationLevel.INFO, 'Roll change: {:.0f}mm left on the roll'.format(self.engine.roll_remaining))
+            self.engine.roll_loaded = False
+            self.engine.roll_load_confirmed.clear() #the operator must confirm the new roll, not an earlier one
+            self.gotoState('Feed_New_Roll')
+            return
+
+        self.engine.job_queue.startCut(cut)
+        self.engine.current_cut = cut
+        self.engine.roll_remaining -= cut.length
         #check last cut to see if it was finished
         #if not, create pop up notification to check last cut
 
@@ -267,11 +403,12 @@ class Roll(MachineAppState):
 
         # knife pneumatic on release 
 
-        self.knife_output.low()
-        self.engine.MachineMotion.emitAbsoluteMove(self.timing_belt_axis,0)
-        self.engine.MachineMotion.emitSpeed(Roller_speed)
-        self.engine.MachineMotion.emitAcceleration(Roller_accel)
-        self.engine.MachineMotion.emitRelativeMove(self.roller_axis,distance) #Distance will be pulled from Global Variable Length input
+        self.engine.knife_output.low()
+        self.engine.MachineMotion.emitAbsoluteMove(self.engine.timing_belt_axis,0)
+        profile = self.engine.roller_planner.plan(cut.length) #fastest move for this length
+        self.engine.MachineMotion.emitSpeed(profile.speed)
+        self.engine.MachineMotion.emitAcceleration(profile.acceleration)
+        self.engine.MachineMotion.emitRelativeMove(self.engine.roller_axis,"positive",cut.length) #Distance is pulled from the job queue
         self.engine.MachineMotion.waitForMotionCompletion()
         #is there a roll? yes
         self.gotoState('Clamp')
@@ -306,10 +443,15 @@ class Clamp(MachineAppState):
     # if self.knife_output.low() = false
     #     self.knife_output.low()
 
-        self.knife_output.low()
-        self.engine.MachineMotion.emitAbsoluteMove(self.timing_belt_axis,0)
-        self.engine.MachineMotion.waitForMotionCompletion() #is this correct?
-        self.plate_pneumatic.push()
+        # The plate does not need to wait for the timing belt, so both run at the same time
+        schedule = self.engine.createActionSchedule()
+        knifeDown = schedule.output('Knife down', self.engine.knife_output, False)
+        beltReturn = self.engine.createMotionProgram(self.engine.MachineMotion).absoluteMove(self.engine.timing_belt_axis,0)
+        schedule.motion('Timing belt return', beltReturn, dependsOn=[knifeDown])
+        schedule.push('Plate down', self.engine.plate_pneumatic)
+        report = schedule.run()
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(report.format())
     
         self.gotoState('Cut')
 
@@ -322,26 +464,50 @@ class Cut(MachineAppState):
         super().__init__(engine) 
         
     def onEnter(self):
-        self.engine.MachineMotion.emitAbsoluteMove(self.timing_belt_axis,0)
-        self.engine.MachineMotion.waitForMotionCompletion() #is this correct? yes
-        self.knife_output.high() #is this correct to bring knife up? yes
-        self.engine.MachineMotion.emitSpeed(TimingBelt_speed)
-        self.engine.MachineMotion.emitAcceleration(TimingBelt_accel)
-        self.engine.MachineMotion.emitRelativeMove(self.timing_belt_axis, "positive",1900) 
-        self.engine.MachineMotion.waitForMotionCompletion()
-        self.knife_output.low()
-        
-        Num_Sheets - 1
-        
-        if Num_Sheets > 0:
-        
-            self.gotoState('Home')
+        # The whole cut is sent to the MachineMotion as a single motion program
+        program = self.engine.createMotionProgram(self.engine.MachineMotion)
+        program.absoluteMove(self.engine.timing_belt_axis,0)
+        program.then(self.engine.knife_output.high) #knife goes up once the timing belt is in place
+        program.profile(self.engine.timing_belt_planner.plan(self.engine.cut_distance))
+        program.relativeMove(self.engine.timing_belt_axis, "positive",self.engine.cut_distance)
+        program.then(self.engine.knife_output.low) #knife goes down once the cut is complete
+        program.run()
         
+        cut = self.engine.current_cut
+        self.engine.current_cut = None
+        if cut == None:
+            self.engine.completeCycle('scrap')
         else:
-            self.engine.stop()
+            if self.engine.job_queue.completeCut(cut):
+                sendNotification(NotificationLevel.INFO, 'Order {} complete'.format(cut.orderId))
+            self.engine.completeCycle('sheet')
+        
+        self.gotoState('Home') #Roll picks the next sheet, or waits for a job
     
 
     def update(self):
         pass
 
+
+class Wait_For_Job(MachineAppState):
+    '''
+    Waits with the machine at rest until an order is submitted (see MachineAppEngine.submitJob),
+    or stops the run if STOP_WHEN_QUEUE_EMPTY. Submitting an order runs 'update' right away,
+    so this state does not poll.
+    '''
+    UPDATE_INTERVAL_SECONDS = float('inf')
+
+    def __init__(self, engine):
+        super().__init__(engine)
+
+    def onEnter(self):
+        if self.engine.STOP_WHEN_QUEUE_EMPTY and not self.engine.job_queue.hasPendingCuts():
+            self.engine.stop()
+            return
+        sendNotification(NotificationLevel.INFO, 'Waiting for a job')
+
+    def update(self):
+        if self.engine.job_queue.hasPendingCuts():
+            self.gotoState('Home')
+
     
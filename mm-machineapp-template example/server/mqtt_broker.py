@@ -0,0 +1,136 @@
+import logging
+log = logging.getLogger(__name__)
+import paho.mqtt.client as mqtt
+import threading
+
+class MqttBrokerConnection():
+    '''
+    Single MQTT connection to a broker, shared by every Sensor that talks to it.
+
+    Incoming messages are dispatched through a topic -> subscribers map, so that all of
+    the Sensors of a MachineMotion share one socket and one network thread. Whenever the
+    connection is (re)established, every registered topic is subscribed again.
+
+    Use getBrokerConnection to retrieve the connection of a broker, and releaseBrokerConnection
+    to give it back. The connection is closed once its last user gives it back.
+    '''
+
+    def __init__(self, ipAddress):
+        self.ipAddress = ipAddress
+        self.connected = False
+        self.__lock = threading.RLock()
+        self.__subscribers = {}         # Maps topics to a list of (onMessage, onConnect) tuples
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self.__onConnect
+        self.client.on_disconnect = self.__onDisconnect
+        self.client.on_message = self.__onMessage
+        self.client.connect(ipAddress)
+        self.client.loop_start()
+
+    def subscribe(self, topic, onMessage, onConnect=None):
+        '''
+        Registers a subscriber for a topic.
+
+        params:
+            topic: str
+                MQTT topic to subscribe to
+            onMessage: func(client, userData, msg) -> void
+                Called on the network thread for every message received on that topic
+            onConnect: func() -> void
+                (Optional) Called once the topic is subscribed, and again after every reconnect
+        '''
+        with self.__lock:
+            subscribers = self.__subscribers.setdefault(topic, [])
+            subscribers.append((onMessage, onConnect))
+            if self.connected and len(subscribers) == 1:
+                self.client.subscribe(topic)
+            isConnected = self.connected
+
+        if isConnected and onConnect is not None:
+            onConnect()
+
+    def unsubscribe(self, topic, onMessage):
+        '''
+        Removes a subscriber. The topic is unsubscribed from the broker once nobody listens to it anymore.
+        '''
+        with self.__lock:
+            subscribers = self.__subscribers.get(topic, [])
+            self.__subscribers[topic] = [s for s in subscribers if s[0] != onMessage]
+            if len(self.__subscribers[topic]) == 0:
+                del self.__subscribers[topic]
+                if self.connected:
+                    self.client.unsubscribe(topic)
+
+    def close(self):
+        ''' Disconnects from the broker and stops the network thread '''
+        with self.__lock:
+            self.__subscribers = {}
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.connected = False
+
+    def __onConnect(self, client, userData, flags, rc):
+        if rc != 0:
+            log.error("Connection to {} refused (rc={})".format(self.ipAddress, rc))
+            return
+
+        with self.__lock:
+            self.connected = True
+            topics = list(self.__subscribers.keys())
+            onConnects = [s[1] for subscribers in self.__subscribers.values() for s in subscribers if s[1] is not None]
+            if len(topics) > 0:
+                self.client.subscribe([(topic, 0) for topic in topics])
+
+        log.info("Connected to {}, subscribed to {} topics".format(self.ipAddress, len(topics)))
+        for onConnect in onConnects:
+            onConnect()
+
+    def __onDisconnect(self, client, userData, rc):
+        self.connected = False
+        if rc != 0:
+            log.warning("Unexpected disconnection from {}, reconnecting".format(self.ipAddress))
+
+    def __onMessage(self, client, userData, msg):
+        subscribers = self.__subscribers.get(msg.topic)
+        if subscribers is None:
+            return
+
+        for onMessage, _ in subscribers:
+            # A failing subscriber must not take the shared network thread down with it
+            try:
+                onMessage(client, userData, msg)
+            except Exception:
+                log.exception("Error while handling a message on {}".format(msg.topic))
+
+_connectionsLock = threading.Lock()
+_connections = {}
+_connectionUsers = {}       # Maps broker addresses to the number of users of their connection
+
+def getBrokerConnection(ipAddress):
+    '''
+    Retrieves the shared connection to the broker at ipAddress, creating it if needed.
+    Every call must be paired with a call to releaseBrokerConnection.
+    '''
+    with _connectionsLock:
+        connection = _connections.get(ipAddress)
+        if connection is None:
+            connection = MqttBrokerConnection(ipAddress)
+            _connections[ipAddress] = connection
+            _connectionUsers[ipAddress] = 0
+        _connectionUsers[ipAddress] += 1
+
+        return connection
+
+def releaseBrokerConnection(connection):
+    ''' Gives back a connection retrieved with getBrokerConnection. The last user closes it. '''
+    with _connectionsLock:
+        if _connections.get(connection.ipAddress) is not connection:
+            return
+        _connectionUsers[connection.ipAddress] -= 1
+        if _connectionUsers[connection.ipAddress] > 0:
+            return
+        del _connections[connection.ipAddress]
+        del _connectionUsers[connection.ipAddress]
+
+    connection.close()
@@ -1,8 +1,18 @@
 import logging
 log = logging.getLogger(__name__)
-import paho.mqtt.client as mqtt
 import paho.mqtt.subscribe as MQTTsubscribe
 import time
+import threading
+import asyncio
+from mqtt_broker import getBrokerConnection, releaseBrokerConnection
+from edge_history import EdgeHistory
+import internal.tracing as tracing
+from internal.clock import getClock
+from internal.journal import RecordType, getJournal
+from internal.log_pipeline import RateLimitedLog
+from internal.metrics import registry
+
+MQTT_MESSAGES = registry.counter('machineapp_mqtt_messages_total', 'MQTT messages received, by receiver', ['component', 'name'])
 
 class Sensor():
     _on_rising_edge_flag = False
@@ -18,30 +28,44 @@ class Sensor():
     def getState(self):
         return self.state
         
-    def __onConnect(self, client, userData, flags, rc):
-        if rc == 0:
-            self.mqtt_topic = 'devices/io-expander/'+ str(self.networkId) +'/digital-input/'+ str(self.pin)
-            self.sensorClient.subscribe(self.mqtt_topic)
-            self.connected=True
-            log.info(self.name + " connected to pin " + str(self.pin))
+    def __onConnect(self):
+        self.connected=True
+        log.info(self.name + " connected to pin " + str(self.pin))
         
 
     def __onMessage(self, client, userData, msg):
-        print("{} received msg {}".format(self.name, msg.payload))
+        timestamp = getClock().monotonic()
+        self._messages_metric.inc()
+        if tracing.activeTracer is not None:
+            tracing.activeTracer.instant("mqtt " + self.name, "mqtt", {"topic": msg.topic, "value": str(msg.payload)})
+        self._message_log.info("%s received msg %s", self.name, msg.payload)
         value = msg.payload
         self.state = int(value)
         ret = ""
         
         
+        # The first message is the current value of the input, not an edge
         if not self.has_received_first_message:
+            self.has_received_first_message = True
             return
         
+        self.edge_history.append(timestamp, self.state)
+        journal = getJournal()
+        if journal is not None:
+            journal.record(RecordType.IO_EDGE, self.name, 1, self.networkId, self.pin, self.state)
+
         if self.state == 1:
-            self._on_rising_edge_flag = True
+            with self._edge_condition:
+                self._on_rising_edge_flag = True
+                self._edge_condition.notify_all()
+                self.__wake_async_waiters(self._rising_edge_waiters)
             if self._on_rising_edge_cb is not None:
                 ret = self._on_rising_edge_cb()
         elif self.state ==0:
-            self._on_falling_edge_flag = True
+            with self._edge_condition:
+                self._on_falling_edge_flag = True
+                self._edge_condition.notify_all()
+                self.__wake_async_waiters(self._falling_edge_waiters)
             if self._on_falling_edge_cb is not None:
                 ret = self._on_falling_edge_cb()
         elif self._on_state_change_cb is not None:
@@ -50,28 +74,43 @@ class Sensor():
         
         
 
-    def __init__(self, name, ipAddress, networkId, pin):
+    def __init__(self, name, ipAddress, networkId, pin, edge_history_size=256):
         self.connected=False
         self.networkId = networkId
         self.pin = pin
         self.name = name
-        self.sensorClient = None
-        self.sensorClient = mqtt.Client()
-        self.sensorClient.on_connect = self.__onConnect
-        self.sensorClient.on_message = self.__onMessage
-        self.sensorClient.connect(ipAddress)
         self.has_received_first_message = False
-        self.sensorClient.loop_start()
+        self._edge_condition = threading.Condition() # Notified from __onMessage whenever an edge flag is raised
+        self._rising_edge_waiters = [] # (loop, future) of the coroutines awaiting rising_edge
+        self._falling_edge_waiters = [] # (loop, future) of the coroutines awaiting falling_edge
+        self._message_log = RateLimitedLog(log, 1.0) # A chattering input must not flood the log
+        self._messages_metric = MQTT_MESSAGES.labels('sensor', name)
+        self.edge_history = EdgeHistory(edge_history_size) # Last edges seen by this sensor, timestamped with the MachineApp clock's monotonic()
+        self.mqtt_topic = 'devices/io-expander/'+ str(self.networkId) +'/digital-input/'+ str(self.pin)
+        # All of the sensors on the same broker share one client and one network thread
+        self.brokerConnection = getBrokerConnection(ipAddress)
+        self.sensorClient = self.brokerConnection.client
+        self.brokerConnection.subscribe(self.mqtt_topic, self.__onMessage, self.__onConnect)
         
         t0 = time.time()
         connection_timeout = 5 #timeout after 5 seconds
         while self.connected==False:
             if time.time()-t0 > connection_timeout:
+                self.close()
                 raise self.timeoutException("system timeout during connection to to {}".format(self.name))
                 
             time.sleep(0.2)
 
     
+    #Stops receiving messages. The broker connection is closed along with the last sensor using it.
+    def close(self):
+        if self.brokerConnection is None:
+            return
+        self.brokerConnection.unsubscribe(self.mqtt_topic, self.__onMessage)
+        releaseBrokerConnection(self.brokerConnection)
+        self.brokerConnection = None
+        self.sensorClient = None
+
     def register_on_rising_edge(self, cb):
         self._on_rising_edge_cb = cb
     def register_on_falling_edge(self, cb):
@@ -81,38 +120,93 @@ class Sensor():
         
     #Returns true after rising edge has been detected
     def wait_for_rising_edge(self, timeout = None):
-        print("{} waiting for rising edge\n\t{}".format(self.name, self.mqtt_topic))
+        log.info("{} waiting for rising edge\n\t{}".format(self.name, self.mqtt_topic))
         #Wait for the rising edge flag to trigger True. 
-        t0 = time.time()
-        while self._on_rising_edge_flag == False:
-            if timeout is not None and time.time()-t0 > timeout:
+        with self._edge_condition:
+            if not getClock().waitCondition(self._edge_condition, lambda: self._on_rising_edge_flag, timeout):
                 raise self.timeoutException("system timeout wait_for_rising_edge {}".format(self.name))
-            time.sleep(0.5)
-        self._on_rising_edge_flag = False
+            self._on_rising_edge_flag = False
         return
     
     def wait_for_falling_edge(self, timeout = None):
-        #Wait for the rising edge flag to trigger True. 
-        t0 = time.time()
-        while self._on_falling_edge_flag == False:
-            if timeout is not None and time.time()-t0 > timeout:
-                raise Exception("system timeout wait_for_falling_edge {}".format(self.name))
-            time.sleep(0.5)
-        self._on_falling_edge_flag = False
+        #Wait for the falling edge flag to trigger True. 
+        with self._edge_condition:
+            if not getClock().waitCondition(self._edge_condition, lambda: self._on_falling_edge_flag, timeout):
+                raise self.timeoutException("system timeout wait_for_falling_edge {}".format(self.name))
+            self._on_falling_edge_flag = False
         return
     
+    #Awaitable version of wait_for_rising_edge, for use on an asyncio event loop
+    async def rising_edge(self, timeout = None):
+        await self.__wait_for_edge_async('_on_rising_edge_flag', self._rising_edge_waiters, timeout, "rising_edge")
+
+    #Awaitable version of wait_for_falling_edge, for use on an asyncio event loop
+    async def falling_edge(self, timeout = None):
+        await self.__wait_for_edge_async('_on_falling_edge_flag', self._falling_edge_waiters, timeout, "falling_edge")
+
+    async def __wait_for_edge_async(self, flag_name, waiters, timeout, description):
+        loop = asyncio.get_event_loop()
+        with self._edge_condition:
+            if getattr(self, flag_name):
+                setattr(self, flag_name, False)
+                return
+            waiter = (loop, loop.create_future())
+            waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            raise self.timeoutException("system timeout {} {}".format(description, self.name))
+        finally:
+            with self._edge_condition:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+
+        with self._edge_condition:
+            setattr(self, flag_name, False)
+
+    #Must be called while holding _edge_condition
+    def __wake_async_waiters(self, waiters):
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self.__resolve_future, future)
+        waiters.clear()
+
+    @staticmethod
+    def __resolve_future(future):
+        if not future.done():
+            future.set_result(None)
+
     def seen_rising_edge(self):
-        if self._on_rising_edge_flag:
-            self._on_rising_edge_flag = False
-            return True
+        with self._edge_condition:
+            if self._on_rising_edge_flag:
+                self._on_rising_edge_flag = False
+                return True
         return False
 
     def seen_falling_edge(self):
-        if self._on_falling_edge_flag:
-            self._on_falling_edge_flag = False
-            return True
+        with self._edge_condition:
+            if self._on_falling_edge_flag:
+                self._on_falling_edge_flag = False
+                return True
         return False
 
+    def edge_cursor(self):
+        #Returns a cursor to pass to edges_since in order to read the edges received from now on
+        return self.edge_history.cursor()
+
+    def edges_since(self, cursor):
+        #Returns (edges, next_cursor, lost_count). Edges are (monotonic_timestamp, value) tuples, oldest first.
+        return self.edge_history.since(cursor)
+
+    def count_edges(self, window_seconds, value = None):
+        #Counts the edges received in the last window_seconds. Only rising (1) or falling (0) edges if value is set.
+        return self.edge_history.countInWindow(getClock().monotonic() - window_seconds, value=value)
+
+    def pulse_widths(self, value = 1, window_seconds = None):
+        #Returns how long, in seconds, the input stayed at value each time it got there, oldest first
+        start = None if window_seconds is None else getClock().monotonic() - window_seconds
+        return self.edge_history.pulseWidths(value, start)
+
 # example code
 if __name__ == '__main__':
     test_sensor1 = Sensor("Test Sensor1", ipAddress="192.168.7.2", networkId=1, pin=1)
@@ -124,4 +218,4 @@ if __name__ == '__main__':
         test_sensor2.wait_for_rising_edge(2)
         test_sensor3.wait_for_rising_edge(5)
     except Sensor.timeoutException:
-        print("Sensor timeout")
+        log.warning("Sensor timeout")
@@ -0,0 +1,71 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from internal.action_scheduler import ActionSchedule
+from internal.clock import VirtualClock
+
+class ActionScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.clock.attach()         # Like the engine thread, so that the time waits for every action to be submitted
+
+    def tearDown(self):
+        self.clock.detach()
+        self.executor.shutdown()
+
+    def test_actions_start_once_their_dependencies_are_complete(self):
+        order = []
+        lock = threading.Lock()
+
+        def step(name, seconds):
+            def callback():
+                self.clock.sleep(seconds)
+                with lock:
+                    order.append(name)
+            return callback
+
+        schedule = ActionSchedule(self.executor, self.clock)
+        slow = schedule.add('Slow', step('Slow', 2))
+        fast = schedule.add('Fast', step('Fast', 1))
+        schedule.add('After both', step('After both', 0.5), dependsOn=[slow, fast])
+        report = schedule.run()
+
+        self.assertEqual(order, ['Fast', 'Slow', 'After both'])
+        self.assertEqual(report.totalSeconds, 2.5)
+        self.assertEqual([action.name for action in report.criticalPath], ['Slow', 'After both'])
+        self.assertEqual(report.toJson()["actions"][2], {
+            "name": 'After both', "dependsOn": ['Slow', 'Fast'], "startSeconds": 2, "endSeconds": 2.5, "durationSeconds": 0.5 })
+        self.assertIn('Slow -> After both', report.format())
+
+    def test_failure_stops_the_schedule(self):
+        started = []
+
+        def fail():
+            raise RuntimeError('Valve stuck')
+
+        schedule = ActionSchedule(self.executor, self.clock)
+        failing = schedule.add('Failing', fail)
+        schedule.dwell('Running', 1)
+        schedule.add('Dependent', lambda: started.append('Dependent'), dependsOn=[failing])
+
+        with self.assertRaises(RuntimeError):
+            schedule.run()
+        self.assertEqual(started, [])
+        self.assertEqual(self.clock.monotonic(), 1)     # The running action was waited for
+
+    def test_dependencies_must_belong_to_the_schedule(self):
+        other = ActionSchedule(self.executor, self.clock).dwell('Other', 1)
+
+        with self.assertRaises(ValueError):
+            ActionSchedule(self.executor, self.clock).dwell('Dwell', 1, dependsOn=[other])
+
+    def test_empty_schedule(self):
+        report = ActionSchedule(self.executor, self.clock).run()
+
+        self.assertEqual(report.totalSeconds, 0)
+        self.assertEqual(report.criticalPath, [])
+
+if __name__ == '__main__':
+    unittest.main()
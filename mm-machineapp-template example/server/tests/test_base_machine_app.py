@@ -0,0 +1,148 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import internal.mqtt_subscription_pool as mqtt_subscription_pool
+    from internal.base_machine_app import BaseMachineAppEngine, MachineAppState
+except ImportError:     # websockets and the MachineApp template runtime modules are not installed
+    raise unittest.SkipTest('The MachineApp dependencies are not installed')
+
+import internal.log_pipeline as log_pipeline
+import internal.metrics as metrics
+from internal.clock import VirtualClock, getClock, setClock
+from internal.fake_machine_motion import MachineMotion
+from tests.test_mqtt_subscription_pool import QueuedTopicSubscriber
+
+class NamedIOMachineMotion(MachineMotion):
+    def getInputTopic(self, ioName):
+        return 'devices/io/' + ioName
+
+class WaitForButton(MachineAppState):
+    ''' Waits for an MQTT message, without periodic updates '''
+    UPDATE_INTERVAL_SECONDS = float('inf')
+
+    def onEnter(self):
+        self.registerCallback(self.engine.machineMotion, 'button', self.onButton)
+        self.engine.monitor = self.engine.createIOMonitor(self.engine.machineMotion, resyncIntervalSeconds=60)
+        self.engine.monitor.startMonitoring('Button', True, 1, 0)
+
+    def onButton(self, topic, msg):
+        self.engine.received.append((self.engine.clock.monotonic(), msg))
+        self.engine.stop()
+
+    def update(self):
+        pass
+
+class ButtonEngine(BaseMachineAppEngine):
+    PROFILE_REPORT_INTERVAL_SECONDS = None
+    JOURNAL_DIRECTORY = None
+    LOG_FILE = None
+    METRICS_PORT = None
+
+    def initialize(self):
+        self.received = []
+
+    def getDefaultState(self):
+        return 'Wait_For_Button'
+
+    def buildStateDictionary(self):
+        return { 'Wait_For_Button': WaitForButton(self) }
+
+    def afterRun(self):
+        pass
+
+    def onStop(self):
+        pass
+
+    def onPause(self):
+        pass
+
+    def onResume(self):
+        pass
+
+    def onEstop(self):
+        pass
+
+class FailingEngine(ButtonEngine):
+    ''' Acquires the log pipeline and the metrics port, then fails before the first state '''
+    METRICS_PORT = 0
+    METRICS_IP = '127.0.0.1'
+
+    def initialize(self):
+        raise RuntimeError('initialize failed')
+
+class UnwritableJournalEngine(ButtonEngine):
+    ''' Fails to create its journal, before initialize is called '''
+    METRICS_PORT = 0
+    METRICS_IP = '127.0.0.1'
+
+class BaseMachineAppEngineTest(unittest.TestCase):
+    TIMEOUT_SECONDS = 30        # Real time after which a run is considered stuck
+
+    def setUp(self):
+        self.previousClock = getClock()
+        self.previousSubscriber = mqtt_subscription_pool.MqttTopicSubscriber
+        mqtt_subscription_pool.MqttTopicSubscriber = QueuedTopicSubscriber
+
+    def tearDown(self):
+        mqtt_subscription_pool.MqttTopicSubscriber = self.previousSubscriber
+        setClock(self.previousClock)
+
+    def run_engine(self, engine):
+        thread = threading.Thread(target=engine.loop, args=(False, {}), daemon=True)
+        thread.start()
+        thread.join(BaseMachineAppEngineTest.TIMEOUT_SECONDS)
+        if thread.is_alive():
+            engine.stop()
+            thread.join(BaseMachineAppEngineTest.TIMEOUT_SECONDS)
+            self.fail('The run did not complete')
+
+    def test_polled_mqtt_message_wakes_a_state_without_updates(self):
+        clock = VirtualClock()
+        engine = ButtonEngine(clock)
+        engine.machineMotion = NamedIOMachineMotion()
+        clock.callLater(3600, lambda: engine.machineMotion.publishMqtt('devices/io/button', '1'))
+        self.run_engine(engine)
+
+        self.assertEqual(engine.received, [(3600, '1')])
+
+    def test_io_monitors_are_closed_at_the_end_of_the_run(self):
+        engine = ButtonEngine(VirtualClock())
+        engine.machineMotion = NamedIOMachineMotion()
+        engine.clock.callLater(1, lambda: engine.machineMotion.publishMqtt('devices/io/button', '1'))
+        self.run_engine(engine)
+        engine.machineMotion.publishMqtt('devices/io-expander/1/digital-input/0', '1')
+
+        self.assertEqual(engine.monitor.getStats()["received"], 0)
+        self.assertNotIn('IOMonitorFlusher', [thread.name for thread in threading.enumerate()])
+
+    def assert_run_resources_are_released(self, engineClass, exceptionClass):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        engine = engineClass(VirtualClock())
+        engine.LOG_FILE = os.path.join(directory, 'machine_app.log')
+        engine.machineMotion = NamedIOMachineMotion()
+
+        for run in range(2):
+            with self.assertRaises(exceptionClass):
+                engine.loop(False, {})
+
+            self.assertEqual(log_pipeline.activeWriter, None)
+            self.assertEqual(metrics.globalMetricsServer, None)
+            with self.assertRaises(RuntimeError):       # The event loop of the run is no longer set
+                asyncio.get_event_loop()
+
+    def test_run_resources_are_released_when_initialize_fails(self):
+        self.assert_run_resources_are_released(FailingEngine, RuntimeError)
+
+    def test_run_resources_are_released_when_the_setup_fails(self):
+        with tempfile.NamedTemporaryFile() as journalFile:
+            UnwritableJournalEngine.JOURNAL_DIRECTORY = journalFile.name
+            self.assert_run_resources_are_released(UnwritableJournalEngine, OSError)
+
+if __name__ == '__main__':
+    unittest.main()
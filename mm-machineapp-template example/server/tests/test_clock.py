@@ -0,0 +1,208 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from internal.clock import RealClock, VirtualClock, getClock, setClock
+from internal.action_scheduler import ActionSchedule
+from internal.fake_machine_motion import MachineMotion
+from internal.motion_program import MotionProgram
+
+class VirtualClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock(epoch=1000.0)
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def waitAll(self, futures):
+        pending = set(futures)
+        while len(pending) > 0:
+            pending -= self.clock.waitFutures(pending)
+        return [future.result() for future in futures]
+
+    def test_sleep_moves_the_time_without_waiting(self):
+        startTime = time.monotonic()
+        self.clock.sleep(3600)
+
+        self.assertEqual(self.clock.monotonic(), 3600)
+        self.assertEqual(self.clock.time(), 4600.0)
+        self.assertLess(time.monotonic() - startTime, 1)
+
+    def test_concurrent_sleeps_overlap(self):
+        def sleep(seconds):
+            self.clock.sleep(seconds)
+            return self.clock.monotonic()
+
+        self.clock.attach()     # Otherwise the first sleep could end before the others are submitted
+        try:
+            futures = [self.clock.submit(self.executor, sleep, seconds) for seconds in (3, 1, 2)]
+            self.assertEqual(self.waitAll(futures), [3, 1, 2])
+        finally:
+            self.clock.detach()
+
+        self.assertEqual(self.clock.monotonic(), 3)
+
+    def test_time_does_not_move_while_a_participant_runs(self):
+        self.clock.attach()
+        try:
+            future = self.clock.submit(self.executor, self.clock.sleep, 1)
+            time.sleep(0.05)
+            self.assertEqual(self.clock.monotonic(), 0)
+
+            self.clock.sleep(0.5)
+            self.assertEqual(self.clock.monotonic(), 0.5)
+            self.assertFalse(future.done())
+
+            self.clock.sleep(1)
+            self.assertEqual(self.clock.monotonic(), 1.5)
+            self.assertTrue(future.done())
+        finally:
+            self.clock.detach()
+
+    def test_submitted_functions_start_before_the_time_moves(self):
+        started = []
+        blocker = threading.Event()
+        self.clock.attach()
+        try:
+            blocked = self.clock.submit(ThreadPoolExecutor(max_workers=1), blocker.wait)
+            queued = self.clock.submit(self.executor, lambda: started.append(self.clock.monotonic()))
+            threading.Timer(0.05, blocker.set).start()
+            self.clock.sleep(10)
+        finally:
+            self.clock.detach()
+
+        self.assertTrue(blocked.done())
+        self.assertTrue(queued.done())
+        self.assertEqual(started, [0])
+        self.assertEqual(self.clock.monotonic(), 10)
+
+    def test_scheduled_callbacks_run_at_their_time(self):
+        event = threading.Event()
+        calls = []
+        self.clock.callLater(2, lambda: calls.append(self.clock.monotonic()))
+        self.clock.callLater(5, event.set)
+
+        self.assertTrue(self.clock.waitEvent(event))
+        self.assertEqual(calls, [2])
+        self.assertEqual(self.clock.monotonic(), 5)
+
+    def test_wait_expires_at_its_timeout(self):
+        self.assertFalse(self.clock.waitEvent(threading.Event(), 2.5))
+        self.assertEqual(self.clock.monotonic(), 2.5)
+
+    def test_wait_condition_releases_the_condition(self):
+        condition = threading.Condition()
+        state = {"ready": False}
+
+        def setReady():
+            with condition:
+                state["ready"] = True
+                condition.notify_all()
+
+        self.clock.callLater(1, setReady)
+        with condition:
+            self.assertTrue(self.clock.waitCondition(condition, lambda: state["ready"], 10))
+        self.assertEqual(self.clock.monotonic(), 1)
+
+    def test_other_threads_can_release_a_wait(self):
+        event = threading.Event()
+        threading.Timer(0.05, event.set).start()
+
+        self.assertTrue(self.clock.waitEvent(event))
+        self.assertEqual(self.clock.monotonic(), 0)
+
+    def test_advance_runs_the_scheduled_callbacks(self):
+        calls = []
+        self.clock.callLater(1, lambda: calls.append(1))
+        self.clock.callLater(3, lambda: calls.append(3))
+        self.clock.advance(2)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(self.clock.monotonic(), 2)
+
+    def test_wait_futures_times_out(self):
+        self.clock.attach()
+        try:
+            future = self.clock.submit(self.executor, self.clock.sleep, 5)
+            self.assertEqual(self.clock.waitFutures([future], 1), set())
+            self.assertEqual(self.clock.monotonic(), 1)
+            self.assertEqual(self.clock.waitFutures([future]), set([future]))
+            self.assertEqual(self.clock.monotonic(), 5)
+        finally:
+            self.clock.detach()
+
+class SimulationTest(unittest.TestCase):
+    ''' Runs the pieces driven by the MachineApp clock on a VirtualClock '''
+
+    def setUp(self):
+        self.previousClock = getClock()
+
+    def tearDown(self):
+        setClock(self.previousClock)
+
+    def runSchedule(self):
+        clock = VirtualClock()
+        setClock(clock)
+        executor = ThreadPoolExecutor(max_workers=4)
+        motionExecutor = ThreadPoolExecutor(max_workers=1)
+        machineMotion = MachineMotion()
+        clock.attach()          # Like the engine thread, so that the time waits for every action to be submitted
+        try:
+            schedule = ActionSchedule(executor, clock)
+            first = schedule.dwell('First', 0.5)
+            program = MotionProgram(machineMotion, motionExecutor, clock).speed(100).acceleration(100).relativeMove(1, 'positive', 200)
+            move = schedule.motion('Move', program, dependsOn=[first])
+            schedule.dwell('Parallel', 1)
+            schedule.dwell('Last', 0.25, dependsOn=[move])
+            report = schedule.run()
+        finally:
+            clock.detach()
+            executor.shutdown()
+            motionExecutor.shutdown()
+
+        return report, machineMotion, clock.monotonic()
+
+    def test_schedule_timings_are_deterministic(self):
+        reports = [self.runSchedule()[0].toJson() for _ in range(5)]
+        for report in reports[1:]:
+            self.assertEqual(report, reports[0])
+
+    def test_schedule_runs_independent_actions_at_the_same_time(self):
+        report, machineMotion, elapsedSeconds = self.runSchedule()
+        moveSeconds = machineMotion.getMoveDuration(200)
+
+        self.assertAlmostEqual(report.totalSeconds, 0.5 + moveSeconds + 0.25)
+        self.assertAlmostEqual(elapsedSeconds, report.totalSeconds)
+        self.assertEqual([action.name for action in report.criticalPath], ['First', 'Move', 'Last'])
+
+    def test_motion_program_timeout_is_in_virtual_time(self):
+        clock = VirtualClock()
+        setClock(clock)
+        executor = ThreadPoolExecutor(max_workers=1)
+        clock.attach()
+        try:
+            machineMotion = MachineMotion()
+            handle = MotionProgram(machineMotion, executor, clock).relativeMove(1, 'positive', 1000).submit()
+            with self.assertRaises(TimeoutError):
+                handle.wait(1)
+            self.assertEqual(clock.monotonic(), 1)
+            handle.wait()
+            self.assertAlmostEqual(clock.monotonic(), machineMotion.getMoveDuration(1000))
+        finally:
+            clock.detach()
+            executor.shutdown()
+
+class RealClockTest(unittest.TestCase):
+
+    def test_wait_futures_returns_the_completed_futures(self):
+        clock = RealClock()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            fast = clock.submit(executor, lambda: 1)
+            slow = clock.submit(executor, time.sleep, 0.2)
+            self.assertEqual(clock.waitFutures([fast]), set([fast]))
+            self.assertEqual(clock.waitFutures([slow], 0.01), set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from edge_history import EdgeHistory
+
+class EdgeHistoryTest(unittest.TestCase):
+
+    def test_since_resumes_from_the_cursor(self):
+        history = EdgeHistory(8)
+        cursor = history.cursor()
+        history.append(1.0, 1)
+        history.append(2.0, 0)
+
+        events, cursor, missed = history.since(cursor)
+        self.assertEqual((events, cursor, missed), ([(1.0, 1), (2.0, 0)], 2, 0))
+        history.append(3.0, 1)
+        self.assertEqual(history.since(cursor), ([(3.0, 1)], 3, 0))
+        self.assertEqual(history.since(3), ([], 3, 0))
+
+    def test_oldest_events_are_overwritten(self):
+        history = EdgeHistory(4)
+        for i in range(10):
+            history.append(float(i), i % 2)
+
+        events, cursor, missed = history.since(0)
+        self.assertEqual([timestamp for timestamp, _ in events], [6.0, 7.0, 8.0, 9.0])
+        self.assertEqual(cursor, 10)
+        self.assertEqual(missed, 6)
+
+    def test_count_in_window(self):
+        history = EdgeHistory(16)
+        for timestamp, value in ((1.0, 1), (2.0, 0), (3.0, 1), (4.0, 0)):
+            history.append(timestamp, value)
+
+        self.assertEqual(history.countInWindow(2.0, 3.0), 2)
+        self.assertEqual(history.countInWindow(0.0, value=1), 2)
+        self.assertEqual(history.countInWindow(5.0), 0)
+
+    def test_pulse_widths(self):
+        history = EdgeHistory(16)
+        for timestamp, value in ((1.0, 1), (1.5, 0), (3.0, 1), (3.25, 1), (4.0, 0), (5.0, 1)):
+            history.append(timestamp, value)
+
+        self.assertEqual(history.pulseWidths(), [0.5, 1.0])      # The pulse started at 5.0 is still in progress
+        self.assertEqual(history.pulseWidths(0), [1.5, 1.0])
+        self.assertEqual(history.pulseWidths(start=2.0), [1.0])
+
+    def test_out_of_range_values_are_clamped(self):
+        history = EdgeHistory(4)
+        history.append(1.0, 1000)
+        history.append(2.0, -2 ** 40)
+        history.append(3.0, 2 ** 40)
+
+        self.assertEqual(history.since(0)[0], [(1.0, 1000), (2.0, EdgeHistory.MIN_VALUE), (3.0, EdgeHistory.MAX_VALUE)])
+
+    def test_capacity_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            EdgeHistory(0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import threading
+import unittest
+
+try:
+    import internal.io_monitor as io_monitor
+    from internal.io_monitor import IOMonitor
+except ImportError:     # websockets and internal.interprocess_message come with the MachineApp runtime
+    raise unittest.SkipTest('The notifier dependencies are not installed')
+
+from internal.fake_machine_motion import MachineMotion
+
+def countFlusherThreads():
+    return len([thread for thread in threading.enumerate() if thread.name == 'IOMonitorFlusher'])
+
+class IOMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previousSendNotification = io_monitor.sendNotification
+        self.notifications = []
+        io_monitor.sendNotification = lambda level, message, customPayload=None: self.notifications.append(customPayload)
+        self.machineMotion = MachineMotion()
+        self.monitors = []
+
+    def tearDown(self):
+        for monitor in self.monitors:
+            monitor.close()
+        io_monitor.sendNotification = self.previousSendNotification
+
+    def createMonitor(self, **kwargs):
+        monitor = IOMonitor(self.machineMotion, **kwargs)
+        self.monitors.append(monitor)
+        return monitor
+
+    def test_no_thread_by_default(self):
+        threadCount = countFlusherThreads()
+        monitor = self.createMonitor()
+        monitor.startMonitoring('Knife', False, 1, 0)
+
+        self.assertEqual(countFlusherThreads(), threadCount)
+
+    def test_thread_is_started_with_the_first_io_and_stopped_by_close(self):
+        threadCount = countFlusherThreads()
+        monitor = self.createMonitor(resyncIntervalSeconds=60)
+        self.assertEqual(countFlusherThreads(), threadCount)
+
+        monitor.startMonitoring('Knife', False, 1, 0)
+        self.assertEqual(countFlusherThreads(), threadCount + 1)
+        monitor.close()
+        self.assertEqual(countFlusherThreads(), threadCount)
+
+    def test_messages_are_ignored_once_closed(self):
+        monitor = self.createMonitor()
+        monitor.startMonitoring('Knife', False, 1, 0)
+        monitor.close()
+        self.machineMotion.publishMqtt('devices/io-expander/1/digital-output/0', '1')
+
+        self.assertEqual(self.notifications, [])
+        self.assertEqual(monitor.getStats()["received"], 0)
+
+    def test_changes_of_monitored_ios_are_sent(self):
+        monitor = self.createMonitor()
+        monitor.startMonitoring('Knife', False, 1, 0)
+        monitor.startMonitoring('Button', True, 2, 3)
+        for topic, msg in (('devices/io-expander/1/digital-output/0', '1'),
+                           ('devices/io-expander/2/digital-input/3', '1'),
+                           ('devices/io-expander/2/digital-input/3', '1'),     # Unchanged
+                           ('devices/io-expander/1/digital-input/0', '1'),     # Input of the same device and pin as Knife
+                           ('devices/io-expander/1/available', 'true'),
+                           ('devices/io-expander/x/digital-input/0', '1'),
+                           ('other/topic', '1')):
+            self.machineMotion.publishMqtt(topic, msg)
+
+        self.assertEqual(self.notifications, [
+            { "isInput": False, "name": 'Knife', "device": 1, "pin": 0, "value": '1' },
+            { "isInput": True, "name": 'Button', "device": 2, "pin": 3, "value": '1' }])
+        self.assertEqual(monitor.getStats()["suppressed"], 1)
+
+    def test_an_io_is_monitored_under_one_name(self):
+        monitor = self.createMonitor()
+
+        self.assertTrue(monitor.startMonitoring('Knife', False, 1, 0))
+        self.assertFalse(monitor.startMonitoring('Knife', True, 1, 1))
+        self.assertFalse(monitor.startMonitoring('Blade', False, 1, 0))
+        self.assertFalse(monitor.stopMonitoring('Blade'))
+        self.machineMotion.publishMqtt('devices/io-expander/1/digital-output/0', '1')
+        self.assertEqual([payload["name"] for payload in self.notifications], ['Knife'])
+
+        self.assertTrue(monitor.stopMonitoring('Knife'))
+        self.assertTrue(monitor.startMonitoring('Blade', False, 1, 0))
+        self.machineMotion.publishMqtt('devices/io-expander/1/digital-output/0', '0')
+        self.assertEqual([payload["name"] for payload in self.notifications], ['Knife', 'Blade'])
+
+    def test_topics_are_still_parsed_once_the_cache_is_full(self):
+        monitor = self.createMonitor()
+        monitor.startMonitoring('Button', True, 1, 0)
+        for i in range(IOMonitor.MAX_CACHED_TOPICS + 10):
+            self.machineMotion.publishMqtt('devices/io-expander/9/digital-input/{}'.format(i), '1')
+        self.machineMotion.publishMqtt('devices/io-expander/1/digital-input/0', '1')
+        self.machineMotion.publishMqtt('devices/io-expander/1/digital-input/0', '0')
+
+        self.assertEqual([payload["value"] for payload in self.notifications], ['1', '0'])
+
+if __name__ == '__main__':
+    unittest.main()
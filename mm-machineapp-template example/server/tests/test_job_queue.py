@@ -0,0 +1,113 @@
+import unittest
+from job_queue import JobQueue, PlannedCut, planCuts
+
+class PlanCutsTest(unittest.TestCase):
+
+    def test_everything_fits_on_an_unknown_roll(self):
+        plan = planCuts([(1, 500, 3)], float('inf'))
+
+        self.assertEqual(plan.cuts, [PlannedCut(1, 500, 0)] * 3)
+        self.assertEqual(plan.rollChanges, 0)
+        self.assertEqual(plan.scrapLength, 0)
+
+    def test_longest_sheets_are_placed_first(self):
+        # First-fit decreasing: the 600mm sheets fill the current roll, the 300mm ones fill the gaps
+        plan = planCuts([(1, 300, 2), (2, 600, 2)], 1000, rollLength=1350, scrapDistance=350)
+
+        self.assertEqual(plan.cuts, [PlannedCut(1, 300, 0), PlannedCut(2, 600, 0), PlannedCut(1, 300, 1), PlannedCut(2, 600, 1)])
+        self.assertEqual(plan.rollChanges, 1)
+        self.assertEqual(plan.scrapLength, 350 + 100)
+        self.assertEqual(plan.leftoverLength, 100)
+
+    def test_orders_are_cut_oldest_first_on_each_roll(self):
+        plan = planCuts([(1, 100, 1), (2, 200, 1), (3, 100, 1)], float('inf'))
+
+        self.assertEqual([cut.orderId for cut in plan.cuts], [1, 2, 3])
+
+    def test_exact_fit(self):
+        plan = planCuts([(1, 250, 4)], 1000)
+
+        self.assertEqual(plan.rollChanges, 0)
+        self.assertEqual(plan.leftoverLength, 0)
+
+    def test_sheet_longer_than_a_roll(self):
+        with self.assertRaises(ValueError):
+            planCuts([(1, 2000, 1)], 0, rollLength=1350, scrapDistance=350)
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.submissions = []
+        self.queue = JobQueue(rollLength=1350, scrapDistance=350, onSubmit=lambda: self.submissions.append(True))
+
+    def cutAll(self, remainingLength):
+        cuts = []
+        while True:
+            cut = self.queue.nextCut(remainingLength)
+            if cut == None:
+                return cuts
+            if cut.roll > 0:
+                remainingLength = self.queue.rollLength - self.queue.scrapDistance
+                continue
+            self.queue.startCut(cut)
+            remainingLength -= cut.length
+            self.queue.completeCut(cut)
+            cuts.append(cut)
+
+    def test_submit_validates_and_notifies(self):
+        with self.assertRaises(ValueError):
+            self.queue.submit(0, 1)
+        with self.assertRaises(ValueError):
+            self.queue.submit(1100, 1)
+        orderId = self.queue.submit('500', 2, 'Panels')
+
+        self.assertEqual(len(self.submissions), 1)
+        self.assertEqual(self.queue.getOrders(), [{ "id": orderId, "name": 'Panels', "length": 500.0, "quantity": 2, "completed": 0 }])
+        self.assertEqual(self.queue.getPendingCount(), 2)
+
+    def test_orders_are_removed_once_complete(self):
+        orderId = self.queue.submit(400, 2)
+        cut = self.queue.nextCut(1000)
+        self.queue.startCut(cut)
+
+        self.assertFalse(self.queue.completeCut(cut))
+        cut = self.queue.nextCut(600)
+        self.queue.startCut(cut)
+        self.assertTrue(self.queue.completeCut(cut))
+        self.assertFalse(self.queue.hasPendingCuts())
+        self.assertEqual(self.queue.getOrders(), [])
+        self.assertEqual(cut.orderId, orderId)
+
+    def test_new_orders_use_the_material_left(self):
+        self.queue.submit(600, 1)
+        cut = self.queue.nextCut(1000)
+        self.queue.startCut(cut)
+        self.queue.completeCut(cut)
+        self.queue.submit(400, 1)
+
+        self.assertEqual(self.queue.nextCut(400), PlannedCut(2, 400, 0))
+
+    def test_roll_change_when_the_roll_runs_out(self):
+        self.queue.submit(600, 3)
+
+        cuts = self.cutAll(1000)
+        self.assertEqual(len(cuts), 3)
+        self.assertEqual(self.queue.getPendingCount(), 0)
+
+    def test_started_cuts_are_planned_again_after_replan(self):
+        self.queue.submit(300, 2)
+        cut = self.queue.nextCut(1000)
+        self.queue.startCut(cut)
+        self.queue.replan()       # The run was stopped mid-cut
+
+        self.assertEqual(len(self.cutAll(1000)), 2)
+
+    def test_cancel(self):
+        orderId = self.queue.submit(300, 2)
+
+        self.assertTrue(self.queue.cancel(orderId))
+        self.assertFalse(self.queue.cancel(orderId))
+        self.assertEqual(self.queue.nextCut(1000), None)
+
+if __name__ == '__main__':
+    unittest.main()
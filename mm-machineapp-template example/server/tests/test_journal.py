@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+from internal.journal import Journal, RecordType
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_round_trip(self):
+        journal = Journal(self.directory)
+        journal.record(RecordType.RUN_START, timeSeconds=10)
+        journal.record(RecordType.IO_EDGE, 'Knife', code=1, device=2, pin=3, value=1, timeSeconds=11)
+        journal.record(RecordType.CYCLE_COMPLETE, 'sheet', value=4.5, timeSeconds=12)
+        journal.record(RecordType.CYCLE_COMPLETE, 'sheet', value=4.0, timeSeconds=13)
+        journal.close()
+
+        records = journal.query()
+        self.assertEqual([record.timeSeconds for record in records], [10, 11, 12, 13])
+        self.assertEqual(records[0].name, None)
+        self.assertEqual(records[1], (11, RecordType.IO_EDGE, 1, 'Knife', 2, 3, 1))
+        self.assertEqual(journal.count(RecordType.CYCLE_COMPLETE, name='sheet'), 2)
+        self.assertEqual(journal.count(RecordType.CYCLE_COMPLETE, 12.5, 20, name='sheet'), 1)
+        self.assertEqual(journal.count(RecordType.CYCLE_COMPLETE, name='unknown'), 0)
+
+    def test_times_going_backwards(self):
+        journal = Journal(self.directory)
+        for timeSeconds in (100, 200, 50, 300):
+            journal.record(RecordType.STATE_ENTER, 'state', timeSeconds=timeSeconds)
+        journal.flush()
+
+        self.assertEqual([record.timeSeconds for record in journal.query()], [100, 200, 50, 300])
+        self.assertEqual([record.timeSeconds for record in journal.query(40, 60)], [50])
+        self.assertEqual([record.timeSeconds for record in journal.query(150, 400)], [200, 300])
+        self.assertEqual([record.timeSeconds for record in journal.query(None, 150)], [100, 50])
+        journal.close()
+
+    def test_times_going_backwards_across_segments(self):
+        journal = Journal(self.directory, maxSegmentBytes=1024)
+        times = [1000 + i for i in range(100)] + [10 + i for i in range(100)]
+        for timeSeconds in times:
+            journal.record(RecordType.STATE_ENTER, 'state', timeSeconds=timeSeconds)
+        journal.close()
+
+        self.assertGreater(len(journal.getSegments()), 2)
+        self.assertEqual([record.timeSeconds for record in journal.query()], times)
+        self.assertEqual([record.timeSeconds for record in journal.query(50, 55)], [50, 51, 52, 53, 54])
+        self.assertEqual(journal.count(RecordType.STATE_ENTER, 1090, 2000), 10)
+
+    def test_index_skips_earlier_records(self):
+        journal = Journal(self.directory)
+        for i in range(3 * Journal.INDEX_INTERVAL + 10):
+            journal.record(RecordType.CYCLE_COMPLETE, 'sheet', timeSeconds=i)
+        journal.record(RecordType.CYCLE_COMPLETE, 'sheet', timeSeconds=5)
+        journal.close()
+
+        self.assertEqual([record.timeSeconds for record in journal.query(700, 703)], [700, 701, 702])
+        self.assertEqual([record.timeSeconds for record in journal.query(5, 6)], [5, 5])
+
+    def test_oldest_segments_are_deleted(self):
+        journal = Journal(self.directory, maxSegmentBytes=1024, maxTotalBytes=4096)
+        for i in range(1000):
+            journal.record(RecordType.CYCLE_COMPLETE, 'sheet', timeSeconds=i)
+        journal.close()
+
+        totalBytes = sum(os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory))
+        self.assertLess(totalBytes, 4096 + 2 * 1024)
+        records = journal.query()
+        self.assertEqual(records[-1].timeSeconds, 999)
+        self.assertGreater(records[0].timeSeconds, 0)
+
+    def test_records_are_read_by_a_new_journal(self):
+        journal = Journal(self.directory)
+        journal.record(RecordType.NOTIFICATION, 'Cut done', code=2, timeSeconds=5)
+        journal.close()
+
+        journal = Journal(self.directory)
+        journal.record(RecordType.NOTIFICATION, 'Cut done', code=2, timeSeconds=6)
+        journal.close()
+
+        self.assertEqual(len(journal.getSegments()), 2)
+        self.assertEqual(journal.count(RecordType.NOTIFICATION, name='Cut done'), 2)
+
+    def test_records_are_dropped_when_too_many_are_pending(self):
+        journal = Journal(self.directory, maxPending=0)
+        journal.record(RecordType.RUN_START, timeSeconds=1)
+        journal.close()
+
+        self.assertEqual(journal.droppedCount, 1)
+        self.assertEqual(journal.query(), [])
+
+if __name__ == '__main__':
+    unittest.main()
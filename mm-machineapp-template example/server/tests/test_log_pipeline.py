@@ -0,0 +1,119 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+from internal.clock import VirtualClock, getClock, setClock
+from internal.log_pipeline import RateLimitedLog, installLogPipeline, uninstallLogPipeline
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class RateLimitedLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previousClock = getClock()
+        self.clock = VirtualClock()
+        setClock(self.clock)
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('test_rate_limited_log')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        setClock(self.previousClock)
+
+    def test_messages_are_suppressed_until_the_interval_elapses(self):
+        log = RateLimitedLog(self.logger, 1.0)
+        for _ in range(5):
+            log.info('Input changed')
+        self.clock.advance(1.0)
+        log.info('Input changed')
+
+        self.assertEqual(self.handler.messages, ['Input changed', 'Input changed (4 similar messages suppressed)'])
+
+    def test_keys_are_limited_separately(self):
+        log = RateLimitedLog(self.logger, 1.0)
+        log.info('Input %s changed', 'a', key='a')
+        log.info('Input %s changed', 'b', key='b')
+        log.info('Input %s changed', 'a', key='a')
+
+        self.assertEqual(self.handler.messages, ['Input a changed', 'Input b changed'])
+
+    def test_disabled_levels_are_not_counted(self):
+        log = RateLimitedLog(self.logger, 1.0)
+        log.debug('Message')
+        log.info('Message')
+
+        self.assertEqual(self.handler.messages, ['Message'])
+
+    def test_concurrent_logs_are_all_accounted_for(self):
+        log = RateLimitedLog(self.logger, 1.0)
+
+        def logMany():
+            for _ in range(1000):
+                log.info('Input changed')
+
+        threads = [threading.Thread(target=logMany) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.clock.advance(1.0)
+        log.info('Input changed')
+
+        self.assertEqual(self.handler.messages, ['Input changed', 'Input changed (3999 similar messages suppressed)'])
+
+class LogPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.root = logging.getLogger()
+        self.previousLevel = self.root.level
+        self.handler = logging.StreamHandler()
+        self.root.addHandler(self.handler)
+
+    def tearDown(self):
+        uninstallLogPipeline()
+        self.root.removeHandler(self.handler)
+        self.root.setLevel(self.previousLevel)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_records_are_written_and_handlers_restored(self):
+        path = os.path.join(self.directory, 'machine_app.log')
+        writer = installLogPipeline(path, level=logging.INFO, console=False)
+
+        self.assertIs(installLogPipeline(path), writer)
+        self.assertNotIn(self.handler, self.root.handlers)
+        logging.getLogger('test_log_pipeline').info('Cutting sheet %d', 3)
+        uninstallLogPipeline()
+
+        with open(path, encoding='utf-8') as f:
+            self.assertIn('Cutting sheet 3', f.read())
+        self.assertIn(self.handler, self.root.handlers)
+        self.assertEqual(self.root.level, self.previousLevel)
+
+    def test_log_file_is_rotated(self):
+        path = os.path.join(self.directory, 'machine_app.log')
+        installLogPipeline(path, maxBytes=1024, backupCount=2, level=logging.INFO, console=False)
+        logger = logging.getLogger('test_log_pipeline')
+        for i in range(200):
+            logger.info('Line %d', i)
+        uninstallLogPipeline()
+
+        self.assertTrue(os.path.exists(path + '.1'))
+        self.assertTrue(os.path.exists(path + '.2'))
+        self.assertFalse(os.path.exists(path + '.3'))
+        with open(path + '.1', encoding='utf-8') as old, open(path, encoding='utf-8') as current:
+            self.assertIn('Line 199', old.read() + current.read())
+
+if __name__ == '__main__':
+    unittest.main()
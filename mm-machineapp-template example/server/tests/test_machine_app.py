@@ -0,0 +1,69 @@
+import threading
+import unittest
+import benchmark
+from internal.clock import VirtualClock, getClock, setClock
+
+if len(benchmark.findMissingModules('cycle')) > 0:
+    raise unittest.SkipTest('The MachineApp dependencies are not installed')
+
+class MachineAppTest(unittest.TestCase):
+    ''' Runs the MachineAppEngine of machine_app.py on a VirtualClock, with simulated IOs '''
+    TIMEOUT_SECONDS = 30        # Real time after which a run is considered stuck
+
+    def setUp(self):
+        self.previousClock = getClock()
+        self.clock = VirtualClock()
+        setClock(self.clock)
+
+        from env import env
+        env.IS_DEVELOPMENT = True
+        benchmark.installSimulatedDrivers()
+        import machine_app
+        machine_app.Pneumatic = benchmark.SimulatedPneumatic
+        machine_app.Digital_Out = benchmark.SimulatedDigitalOut
+        machine_app.Sensor = benchmark.SimulatedSensor
+
+        self.engine = machine_app.MachineAppEngine()
+        self.engine.PROFILE_REPORT_INTERVAL_SECONDS = None
+        self.engine.JOURNAL_DIRECTORY = None
+        self.engine.LOG_FILE = None
+        self.engine.METRICS_PORT = None
+
+    def tearDown(self):
+        setClock(self.previousClock)
+
+    def run_engine(self, configuration):
+        thread = threading.Thread(target=self.engine.loop, args=(False, configuration), daemon=True)
+        thread.start()
+        thread.join(MachineAppTest.TIMEOUT_SECONDS)
+        if thread.is_alive():
+            self.engine.stop()
+            thread.join(MachineAppTest.TIMEOUT_SECONDS)
+            self.fail('The run did not complete')
+        return self.engine.getStateTimings()
+
+    def test_default_engine_feeds_the_roll_without_waiting(self):
+        timings = self.run_engine({ "Length": 500, "Num_of_sheets": 2 })
+
+        self.assertNotIn('Wait_For_Roll', timings)
+        self.assertIn('First_Roll', timings)
+        self.assertEqual(timings['Cut']['onEnter']['count'], 3)    # The scrap piece and 2 sheets
+        self.assertFalse(self.engine.job_queue.hasPendingCuts())
+
+    def test_roll_loaded_button_is_waited_for(self):
+        self.engine.ROLL_LOADED_BUTTON = (2, 4)
+        self.clock.callLater(60, lambda: self.engine.roll_loaded_button.trigger(1))
+        timings = self.run_engine({ "Length": 500, "Num_of_sheets": 1 })
+
+        self.assertIn('Wait_For_Roll', timings)
+        self.assertGreaterEqual(timings['Wait_For_Roll']['inState']['max'], 59)
+        self.assertFalse(self.engine.job_queue.hasPendingCuts())
+
+    def test_empty_configuration_is_reported(self):
+        with self.assertLogs(self.engine.logger, 'WARNING') as logs:
+            self.run_engine({})
+
+        self.assertIn('No order to cut', logs.output[0])
+
+if __name__ == '__main__':
+    unittest.main()
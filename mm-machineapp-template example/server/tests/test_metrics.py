@@ -0,0 +1,73 @@
+import unittest
+import urllib.request
+from internal.metrics import MetricsRegistry, MetricsServer
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_with_labels(self):
+        counter = self.registry.counter('sheets_total', 'Sheets cut', ['material'])
+        counter.labels('steel').inc()
+        counter.labels('steel').inc(2)
+        counter.labels('wood "oak"').inc()
+
+        self.assertEqual(counter.format().split('\n'), [
+            '# HELP sheets_total Sheets cut',
+            '# TYPE sheets_total counter',
+            'sheets_total{material="steel"} 3',
+            'sheets_total{material="wood \\"oak\\""} 1'])
+
+    def test_labels_must_match(self):
+        counter = self.registry.counter('sheets_total', 'Sheets cut', ['material'])
+
+        with self.assertRaises(ValueError):
+            counter.labels()
+        with self.assertRaises(ValueError):
+            self.registry.gauge('sheets_total', 'Sheets cut', ['material'])
+        self.assertIs(self.registry.counter('sheets_total', 'Sheets cut', ['material']), counter)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('cut_seconds', 'Cut duration', buckets=(1, 5))
+        for value in (0.5, 2, 3, 10):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.format().split('\n')[2:], [
+            'cut_seconds_bucket{le="1"} 1',
+            'cut_seconds_bucket{le="5"} 3',
+            'cut_seconds_bucket{le="+Inf"} 4',
+            'cut_seconds_sum 15.5',
+            'cut_seconds_count 4'])
+
+    def test_function_is_called_when_collected(self):
+        depth = [3]
+        gauge = self.registry.gauge('queue_depth', 'Jobs waiting', ['queue'])
+        gauge.setFunction(lambda: { ('cuts',): depth[0] })
+        depth[0] = 7
+
+        self.assertIn('queue_depth{queue="cuts"} 7', self.registry.format())
+
+    def test_failing_metric_does_not_hide_the_others(self):
+        self.registry.gauge('broken', 'Raises').setFunction(lambda: 1 / 0)
+        self.registry.gauge('working', 'Works').set(1.5)
+
+        self.assertIn('working 1.5', self.registry.format())
+
+class MetricsServerTest(unittest.TestCase):
+
+    def test_serves_the_registry_on_localhost(self):
+        registry = MetricsRegistry()
+        registry.counter('sheets_total', 'Sheets cut').inc()
+        server = MetricsServer(registry, port=0)
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(server.port), timeout=5) as response:
+                body = response.read().decode('utf-8')
+        finally:
+            server.stop()
+
+        self.assertIn('sheets_total 1', body)
+        self.assertEqual(MetricsServer.DEFAULT_IP, '127.0.0.1')
+
+if __name__ == '__main__':
+    unittest.main()
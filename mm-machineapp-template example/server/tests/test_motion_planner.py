@@ -0,0 +1,66 @@
+import math
+import unittest
+from internal.motion_planner import AxisLimits, MotionPlanner
+
+class MotionPlannerTest(unittest.TestCase):
+
+    def assertMoveCovers(self, profile):
+        ''' A constant acceleration ramp to the speed, a cruise and a ramp down cover the distance in the duration '''
+        rampTime = profile.speed / profile.acceleration
+        self.assertAlmostEqual(rampTime, profile.rampTime)
+        self.assertAlmostEqual(profile.speed * rampTime + profile.speed * profile.cruiseTime, profile.distance)
+        self.assertAlmostEqual(2 * rampTime + profile.cruiseTime, profile.duration)
+
+    def test_long_move_without_jerk_uses_the_limits(self):
+        profile = MotionPlanner(AxisLimits(900, 850)).plan(1900)
+
+        self.assertEqual((profile.speed, profile.acceleration), (900, 850))
+        self.assertAlmostEqual(profile.duration, 1900 / 900 + 900 / 850)
+        self.assertMoveCovers(profile)
+
+    def test_short_move_without_jerk_peaks_below_the_speed_limit(self):
+        profile = MotionPlanner(AxisLimits(100, 100)).plan(50)
+
+        self.assertAlmostEqual(profile.speed, math.sqrt(50 * 100))
+        self.assertEqual(profile.acceleration, 100)
+        self.assertEqual(profile.cruiseTime, 0)
+        self.assertMoveCovers(profile)
+
+    def test_jerk_only_lowers_the_acceleration(self):
+        withoutJerk = MotionPlanner(AxisLimits(900, 850)).plan(1900)
+        for distance in (10, 500, 1900):
+            profile = MotionPlanner(AxisLimits(900, 850, 2000)).plan(distance)
+
+            self.assertLess(profile.acceleration, 850)
+            self.assertLessEqual(profile.speed, 900)
+            self.assertMoveCovers(profile)
+        self.assertGreater(MotionPlanner(AxisLimits(900, 850, 2000)).plan(1900).duration, withoutJerk.duration)
+
+    def test_direction_does_not_matter(self):
+        planner = MotionPlanner(AxisLimits(100, 100))
+
+        self.assertEqual(planner.plan(-350), planner.plan(350))
+
+    def test_zero_distance(self):
+        profile = MotionPlanner(AxisLimits(100, 100)).plan(0)
+
+        self.assertEqual(profile.duration, 0)
+
+    def test_cache_is_bounded(self):
+        planner = MotionPlanner(AxisLimits(100, 100))
+        self.assertIs(planner.plan(350), planner.plan(350.0001))
+        for i in range(MotionPlanner.MAX_CACHE_SIZE + 10):
+            planner.plan(i + 1)
+
+        self.assertEqual(planner.getCacheSize(), MotionPlanner.MAX_CACHE_SIZE)
+        planner.clearCache()
+        self.assertEqual(planner.getCacheSize(), 0)
+
+    def test_limits_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            AxisLimits(0, 100)
+        with self.assertRaises(ValueError):
+            AxisLimits(100, 100, -1)
+
+if __name__ == '__main__':
+    unittest.main()
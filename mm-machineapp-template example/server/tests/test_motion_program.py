@@ -0,0 +1,98 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from internal.fake_machine_motion import MachineMotion
+from internal.motion_program import MotionProgram
+
+FAST = 100000       # Speed and acceleration that make the simulated moves take a few milliseconds
+
+class MotionProgramTest(unittest.TestCase):
+
+    def setUp(self):
+        self.machineMotion = MachineMotion()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def createProgram(self):
+        return MotionProgram(self.machineMotion, self.executor).speed(FAST).acceleration(FAST)
+
+    def getCommandNames(self):
+        return [name for name, _ in self.machineMotion.commands]
+
+    def test_steps_are_sent_in_order(self):
+        self.createProgram().relativeMove(1, 'positive', 100).absoluteMove(2, 50).home(1).run()
+
+        self.assertEqual(self.machineMotion.commands, [
+            ('emitSpeed', (FAST,)),
+            ('emitAcceleration', (FAST,)),
+            ('emitRelativeMove', (1, 'positive', 100)),
+            ('emitAbsoluteMove', (2, 50)),
+            ('emitHome', (1,)),
+            ('waitForMotionCompletion', ())
+        ])
+
+    def test_repeated_speed_and_acceleration_are_skipped(self):
+        program = self.createProgram().speed(FAST).acceleration(FAST).relativeMove(1, 'positive', 10)
+        program.speed(FAST / 2).relativeMove(1, 'positive', 10).run()
+
+        self.assertEqual(self.getCommandNames(), [
+            'emitSpeed', 'emitAcceleration', 'emitRelativeMove', 'emitSpeed', 'emitRelativeMove', 'waitForMotionCompletion'
+        ])
+
+    def test_each_program_sends_its_own_speed(self):
+        self.createProgram().relativeMove(1, 'positive', 10).run()
+        self.createProgram().relativeMove(1, 'positive', 10).run()
+
+        self.assertEqual(self.getCommandNames().count('emitSpeed'), 2)
+        self.assertEqual(self.getCommandNames().count('emitAcceleration'), 2)
+
+    def test_callbacks_run_once_the_previous_moves_are_complete(self):
+        completed = []
+        program = self.createProgram().relativeMove(1, 'positive', 100)
+        program.then(lambda: completed.append(self.machineMotion.isMotionCompleted()))
+        program.then(lambda: completed.append(self.machineMotion.isMotionCompleted()))
+        program.run()
+
+        self.assertEqual(completed, [True, True])
+        # The second callback has no move to wait for
+        self.assertEqual(self.getCommandNames().count('waitForMotionCompletion'), 1)
+
+    def test_program_without_moves_does_not_wait(self):
+        called = []
+        MotionProgram(self.machineMotion, self.executor).then(lambda: called.append(True)).waitForCompletion().run()
+
+        self.assertEqual(called, [True])
+        self.assertEqual(self.machineMotion.commands, [])
+
+    def test_exceptions_are_raised_by_wait(self):
+        def fail():
+            raise RuntimeError('Output failed')
+
+        handle = self.createProgram().relativeMove(1, 'positive', 10).then(fail).relativeMove(1, 'positive', 10).submit()
+
+        with self.assertRaises(RuntimeError):
+            handle.wait(5)
+        self.assertTrue(handle.isDone())
+        self.assertEqual(self.getCommandNames().count('emitRelativeMove'), 1)
+
+    def test_programs_run_in_submission_order(self):
+        first = self.createProgram().absoluteMove(1, 100).submit()
+        second = self.createProgram().absoluteMove(1, 0).submit()
+        second.wait(5)
+
+        self.assertTrue(first.isDone())
+        moves = [args for name, args in self.machineMotion.commands if name == 'emitAbsoluteMove']
+        self.assertEqual(moves, [(1, 100), (1, 0)])
+
+    def test_steps_recorded_after_submit_are_not_sent(self):
+        program = self.createProgram().relativeMove(1, 'positive', 10)
+        handle = program.submit()
+        program.relativeMove(1, 'positive', 10)
+        handle.wait(5)
+
+        self.assertEqual(self.getCommandNames().count('emitRelativeMove'), 1)
+        self.assertEqual(len(program.getSteps()), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import gc
+import unittest
+import weakref
+from collections import OrderedDict
+
+try:
+    import internal.mqtt_subscription_pool as mqtt_subscription_pool
+except ImportError:     # internal.mqtt_topic_subscriber comes with the MachineApp template runtime
+    raise unittest.SkipTest('internal.mqtt_topic_subscriber is not installed')
+
+from internal.mqtt_subscription_pool import MqttSubscriptionPool, MqttDispatchMode
+from internal.fake_machine_motion import MachineMotion
+
+class QueuedTopicSubscriber:
+    ''' Stands in for MqttTopicSubscriber: messages are queued until 'update' delivers them all '''
+
+    def __init__(self, machineMotion):
+        self.callbacks = OrderedDict()
+        self.queue = []
+        machineMotion.addMqttCallback(self.onMessage)
+
+    def registerCallback(self, topic, callback):
+        self.callbacks[topic] = callback
+
+    def onMessage(self, topic, msg):
+        if topic in self.callbacks:
+            self.queue.append((topic, msg))
+
+    def update(self):
+        queue, self.queue = self.queue, []
+        for topic, msg in queue:
+            self.callbacks[topic](topic, msg)
+
+    def delete(self):
+        self.callbacks.clear()
+
+class MqttSubscriptionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.previousSubscriber = mqtt_subscription_pool.MqttTopicSubscriber
+        mqtt_subscription_pool.MqttTopicSubscriber = QueuedTopicSubscriber
+        self.machineMotion = MachineMotion()
+        self.received = []
+
+    def tearDown(self):
+        mqtt_subscription_pool.MqttTopicSubscriber = self.previousSubscriber
+
+    def callback(self, topic, msg):
+        self.received.append((topic, msg))
+
+    def test_reacquiring_a_topic_drops_only_its_pending_messages(self):
+        pool = MqttSubscriptionPool(MqttDispatchMode.POLL)
+        pool.acquire(self.machineMotion, 'a', self.callback).release()
+        pool.acquire(self.machineMotion, 'b', self.callback)
+
+        self.machineMotion.publishMqtt('a', 'stale')
+        self.machineMotion.publishMqtt('b', '1')
+        pool.acquire(self.machineMotion, 'a', self.callback)
+        self.assertEqual(self.received, [])         # Other callbacks are not called from acquire
+        self.assertTrue(pool.hasPendingMessages())
+
+        self.machineMotion.publishMqtt('a', 'fresh')
+        self.machineMotion.publishMqtt('b', '2')
+        pool.update()
+
+        self.assertEqual(self.received, [('b', '1'), ('a', 'fresh'), ('b', '2')])
+        self.assertFalse(pool.hasPendingMessages())
+
+    def test_messages_of_released_topics_are_dropped(self):
+        pool = MqttSubscriptionPool(MqttDispatchMode.POLL)
+        handle = pool.acquire(self.machineMotion, 'a', self.callback)
+        self.machineMotion.publishMqtt('a', '1')
+        handle.release()
+        pool.update()
+
+        self.assertEqual(self.received, [])
+        self.assertEqual(pool.getReferenceCounts(), {'a': 0})
+
+    def test_poll_mode_reports_messages_of_held_topics(self):
+        wakeups = []
+        pool = MqttSubscriptionPool(MqttDispatchMode.POLL, lambda: wakeups.append(True))
+        pool.acquire(self.machineMotion, 'a', self.callback)
+        self.machineMotion.publishMqtt('b', '1')
+        self.assertFalse(pool.hasPendingMessages())
+
+        self.machineMotion.publishMqtt('a', '2')
+        self.assertEqual(wakeups, [True])
+        self.assertTrue(pool.hasPendingMessages())
+        pool.update()
+        self.assertEqual(self.received, [('a', '2')])
+        self.assertFalse(pool.hasPendingMessages())
+
+    def test_engine_thread_mode_delivers_on_update(self):
+        wakeups = []
+        pool = MqttSubscriptionPool(MqttDispatchMode.ENGINE_THREAD, lambda: wakeups.append(True))
+        pool.acquire(self.machineMotion, 'a', self.callback)
+        self.machineMotion.publishMqtt('a', '1')
+        self.machineMotion.publishMqtt('b', '2')
+
+        self.assertEqual(wakeups, [True])
+        self.assertEqual(self.received, [])
+        pool.update()
+        self.assertEqual(self.received, [('a', '1')])
+
+    def test_free_releases_the_machine_motions(self):
+        pool = MqttSubscriptionPool(MqttDispatchMode.EXECUTOR)
+        machineMotion = MachineMotion()
+        pool.acquire(machineMotion, 'a', self.callback)
+        reference = weakref.ref(machineMotion)
+        pool.free()
+        machineMotion.publishMqtt('a', '1')     # The callback stays registered on the MachineMotion, but does nothing
+        del machineMotion
+        gc.collect()
+
+        self.assertIsNone(reference())
+        self.assertEqual(self.received, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import socket
+import threading
+import time
+import unittest
+import urllib.request
+
+try:
+    import websockets
+    import internal.notifier as notifier
+    from internal.notifier import Notifier, NotifierClient, NotificationTransport, NotificationLevel, OverflowPolicy
+except ImportError:     # websockets and internal.interprocess_message come with the MachineApp runtime
+    raise unittest.SkipTest('The notifier dependencies are not installed')
+
+class FakeWebsocket:
+    def __init__(self):
+        self.isClosed = False
+
+    async def send(self, frame):
+        pass
+
+    async def close(self):
+        self.isClosed = True
+
+class NotifierClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def push(self, client, frames):
+        async def pushAll():
+            for frame, isPinned in frames:
+                client.push(frame, isPinned=isPinned)
+            await asyncio.sleep(0)
+        self.loop.run_until_complete(pushAll())
+
+    def test_oldest_unpinned_frame_is_dropped(self):
+        client = NotifierClient(FakeWebsocket(), 3, OverflowPolicy.DROP_OLDEST)
+        self.push(client, [('definition', True), ('a', False), ('b', False), ('c', False)])
+
+        stats = client.getStats()
+        self.assertEqual(stats["queueDepth"], 3)
+        self.assertEqual(stats["droppedCount"], 1)
+
+    def test_queue_of_pinned_frames_stays_bounded(self):
+        websocket = FakeWebsocket()
+        client = NotifierClient(websocket, 2, OverflowPolicy.DROP_OLDEST)
+        self.push(client, [('definition 1', True), ('definition 2', True), ('a', False)])
+
+        self.assertEqual(client.getStats()["queueDepth"], 2)
+        self.assertEqual(client.getStats()["droppedCount"], 1)
+        self.assertFalse(client.isClosing)
+
+        self.push(client, [('definition 3', True)])
+        self.assertTrue(client.isClosing)
+        self.assertTrue(websocket.isClosed)
+        self.assertEqual(client.getStats()["queueDepth"], 0)
+
+class NotificationTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.parentReady = threading.Event()
+        self.previousSend = notifier.sendSubprocessToParentMsg
+        notifier.sendSubprocessToParentMsg = self.sendToParent
+
+    def tearDown(self):
+        self.parentReady.set()
+        notifier.sendSubprocessToParentMsg = self.previousSend
+
+    def sendToParent(self, messageType, notification):
+        self.parentReady.wait(5)        # A parent process busy with something else
+        self.sent.append(notification["message"])
+
+    def test_io_states_are_dropped_first_and_order_is_kept(self):
+        transport = NotificationTransport(maxPending=3)
+        transport.send({ "level": NotificationLevel.INFO, "message": 'first' })
+        while transport.getStats()["pending"] > 0:      # Wait for the flusher to block on the parent
+            pass
+
+        for message, level in [('io 1', NotificationLevel.IO_STATE), ('info 1', NotificationLevel.INFO), ('io 2', NotificationLevel.IO_STATE),
+                               ('info 2', NotificationLevel.INFO), ('info 3', NotificationLevel.INFO), ('info 4', NotificationLevel.INFO)]:
+            transport.send({ "level": level, "message": message })
+
+        self.parentReady.set()
+        self.assertTrue(transport.flush(5))
+        self.assertEqual(self.sent, ['first', 'info 2', 'info 3', 'info 4'])
+        self.assertEqual(transport.getStats()["droppedCount"], 3)
+
+    def test_io_states_and_other_notifications_are_sent_in_order(self):
+        transport = NotificationTransport()
+        messages = ['io {}'.format(i) if i % 3 == 0 else 'info {}'.format(i) for i in range(30)]
+        for message in messages:
+            transport.send({ "level": NotificationLevel.IO_STATE if message.startswith('io') else NotificationLevel.INFO, "message": message })
+
+        self.parentReady.set()
+        self.assertTrue(transport.flush(5))
+        self.assertEqual(self.sent, messages)
+
+def findFreePort():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+class NotifierMetricsTest(unittest.TestCase):
+    TIMEOUT_SECONDS = 10
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)    # Cleanups run last first: after the websocket is closed
+
+    def scrape(self, port):
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=NotifierMetricsTest.TIMEOUT_SECONDS) as response:
+            return response.read().decode('utf-8')
+
+    def test_client_gauges_are_served_on_the_notifier_metrics_port(self):
+        port = findFreePort()
+        server = Notifier(ip='127.0.0.1', port=port, metricsPort=0)
+        self.addCleanup(server.metricsServer.stop)
+        self.addCleanup(server.setDead)
+
+        async def connect():
+            for attempt in range(50):       # The websocket server starts on its own thread
+                try:
+                    return await websockets.connect('ws://127.0.0.1:{}/'.format(port))
+                except OSError:
+                    await asyncio.sleep(0.1)
+            self.fail('Unable to connect to the notifier')
+        websocket = self.loop.run_until_complete(connect())
+        self.addCleanup(lambda: self.loop.run_until_complete(websocket.close()))
+        deadline = time.monotonic() + NotifierMetricsTest.TIMEOUT_SECONDS
+        while len(server.getClientStats()) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        metrics = self.scrape(server.metricsServer.port)
+        self.assertIn('machineapp_notifier_pending_messages 0', metrics)
+        self.assertRegex(metrics, r'machineapp_notifier_client_queue_depth\{client="127\.0\.0\.1:\d+"\} 0')
+        self.assertRegex(metrics, r'machineapp_notifier_client_lag_seconds\{client="127\.0\.0\.1:\d+"\} 0')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from internal.profiler import LatencyHistogram, StateProfiler
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+
+        self.assertEqual(histogram.percentile(50), None)
+        self.assertEqual(histogram.getSummary()["mean"], None)
+
+    def test_percentiles_are_accurate_to_the_bucket_width(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 101):
+            histogram.record(i / 1000.0)
+
+        for p in (50, 95, 99):
+            self.assertGreaterEqual(histogram.percentile(p), p / 1000.0)
+            self.assertLessEqual(histogram.percentile(p), p / 1000.0 * LatencyHistogram.GROWTH)
+        self.assertEqual(histogram.percentile(100), 0.1)
+        summary = histogram.getSummary()
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["mean"], 0.0505)
+        self.assertEqual(summary["max"], 0.1)
+
+    def test_values_out_of_range(self):
+        histogram = LatencyHistogram()
+        histogram.record(0)
+        histogram.record(1e9)
+
+        self.assertEqual(histogram.min, 0)
+        self.assertEqual(histogram.percentile(100), 1e9)
+
+class StateProfilerTest(unittest.TestCase):
+
+    def test_summary_by_state_and_phase(self):
+        profiler = StateProfiler()
+        profiler.record('Cut', StateProfiler.ON_ENTER, 0.5)
+        profiler.record('Cut', StateProfiler.ON_ENTER, 1.5)
+        profiler.record('Roll', StateProfiler.IN_STATE, 2.0)
+
+        summary = profiler.getSummary()
+        self.assertEqual(sorted(summary.keys()), ['Cut', 'Roll'])
+        self.assertEqual(summary['Cut'][StateProfiler.ON_ENTER]["count"], 2)
+        self.assertEqual(summary['Cut'][StateProfiler.ON_ENTER]["mean"], 1.0)
+        self.assertIn('Roll', profiler.format())
+
+    def test_reset(self):
+        profiler = StateProfiler()
+        profiler.record('Cut', StateProfiler.UPDATE, 0.1)
+        profiler.reset()
+
+        self.assertEqual(profiler.getSummary(), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+
+try:
+    import mqtt_broker
+    from sensor import Sensor
+except ImportError:     # paho-mqtt is not installed
+    raise unittest.SkipTest('paho-mqtt is not installed')
+
+from internal.clock import VirtualClock, getClock, setClock
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class FakeMqttClient:
+    ''' Stands for paho's mqtt.Client: connects as soon as its network thread is started '''
+    instances = []
+
+    def __init__(self):
+        self.subscribed = set()
+        self.isLooping = False
+        self.isConnected = False
+        FakeMqttClient.instances.append(self)
+
+    def connect(self, ipAddress):
+        self.ipAddress = ipAddress
+
+    def loop_start(self):
+        self.isLooping = True
+        self.isConnected = True
+        self.on_connect(self, None, {}, 0)
+
+    def loop_stop(self):
+        self.isLooping = False
+
+    def disconnect(self):
+        self.isConnected = False
+        self.on_disconnect(self, None, 0)
+
+    def subscribe(self, topic):
+        topics = [topic] if isinstance(topic, str) else [t for t, qos in topic]
+        self.subscribed.update(topics)
+
+    def unsubscribe(self, topic):
+        self.subscribed.discard(topic)
+
+    def deliver(self, topic, payload):
+        if topic in self.subscribed:
+            self.on_message(self, None, FakeMessage(topic, payload))
+
+class SensorTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeMqttClient.instances = []
+        self.previousClient = mqtt_broker.mqtt.Client
+        mqtt_broker.mqtt.Client = FakeMqttClient
+        self.previousClock = getClock()
+
+    def tearDown(self):
+        mqtt_broker.mqtt.Client = self.previousClient
+        setClock(self.previousClock)
+
+    def createSensor(self, name, pin, ipAddress='192.168.7.2'):
+        sensor = Sensor(name, ipAddress=ipAddress, networkId=1, pin=pin)
+        self.addCleanup(sensor.close)
+        return sensor
+
+    def test_sensors_of_a_broker_share_one_connection(self):
+        first = self.createSensor('First', 1)
+        second = self.createSensor('Second', 2)
+        other = self.createSensor('Other broker', 1, ipAddress='192.168.7.3')
+
+        self.assertIs(first.brokerConnection, second.brokerConnection)
+        self.assertIsNot(first.brokerConnection, other.brokerConnection)
+        self.assertEqual(len(FakeMqttClient.instances), 2)
+
+        client = first.sensorClient
+        client.deliver(second.mqtt_topic, b'0')
+        client.deliver(second.mqtt_topic, b'1')
+        self.assertEqual(second.getState(), 1)
+        self.assertTrue(second.seen_rising_edge())
+        self.assertFalse(first.seen_rising_edge())
+
+    def test_connection_is_released_on_the_last_close(self):
+        first = self.createSensor('First', 1)
+        second = self.createSensor('Second', 2)
+        client = first.sensorClient
+
+        first.close()
+        self.assertTrue(client.isLooping)
+        self.assertEqual(client.subscribed, {second.mqtt_topic})
+
+        second.close()
+        self.assertFalse(client.isLooping)
+        self.assertFalse(client.isConnected)
+
+        third = self.createSensor('Third', 3)
+        self.assertIsNot(third.sensorClient, client)
+        self.assertEqual(len(FakeMqttClient.instances), 2)
+
+    def test_edge_wakes_the_waiter_without_delay(self):
+        clock = VirtualClock()
+        setClock(clock)
+        sensor = self.createSensor('Roll', 1)
+        sensor.sensorClient.deliver(sensor.mqtt_topic, b'0')
+        clock.callLater(2.5, lambda: sensor.sensorClient.deliver(sensor.mqtt_topic, b'1'))
+        clock.callLater(4, lambda: sensor.sensorClient.deliver(sensor.mqtt_topic, b'0'))
+
+        sensor.wait_for_rising_edge(10)
+        self.assertEqual(clock.monotonic(), 2.5)
+        sensor.wait_for_falling_edge(10)
+        self.assertEqual(clock.monotonic(), 4)
+
+    def test_wait_times_out_without_an_edge(self):
+        clock = VirtualClock()
+        setClock(clock)
+        sensor = self.createSensor('Roll', 1)
+        sensor.sensorClient.deliver(sensor.mqtt_topic, b'0')
+
+        with self.assertRaises(Sensor.timeoutException):
+            sensor.wait_for_rising_edge(3)
+        self.assertEqual(clock.monotonic(), 3)
+
+        sensor.sensorClient.deliver(sensor.mqtt_topic, b'1')     # An edge seen before waiting is not lost
+        sensor.wait_for_rising_edge(3)
+        self.assertEqual(clock.monotonic(), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import internal.tracing as tracing
+from internal.tracing import Tracer, enableTracing, disableTracing, mergeTraceFiles
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(disableTracing)
+
+    def load(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def assertValidEvents(self, events):
+        ''' Checks the fields required by the Trace Event Format for the phases in use '''
+        for event in events:
+            self.assertIn(event["ph"], ('X', 'i', 'b', 'e'))
+            for field in ("name", "cat", "ts", "pid", "tid"):
+                self.assertIn(field, event)
+            if event["ph"] == 'X':
+                self.assertGreaterEqual(event["dur"], 0)
+            if event["ph"] in ('b', 'e'):
+                self.assertIn("id", event)
+
+    def recordEvents(self, tracer):
+        eventId = tracer.nextId()
+        tracer.asyncBegin('notification', 'notifier', eventId, {"level": 'info'})
+        with tracer.span('Cut', 'state'):
+            tracer.instant('mqtt Roll', 'mqtt', {"value": '1'})
+        thread = threading.Thread(target=tracer.asyncEnd, args=('notification', 'notifier', eventId))
+        thread.start()
+        thread.join()
+
+    def test_trace_file_is_a_valid_trace_event_array(self):
+        path = os.path.join(self.directory, 'trace.json')
+        tracer = enableTracing(path)
+        self.assertIs(tracing.activeTracer, tracer)
+        self.recordEvents(tracer)
+        disableTracing()
+
+        events = self.load(path)
+        self.assertEqual([event["ph"] for event in events], ['b', 'i', 'X', 'e'])
+        self.assertValidEvents(events)
+        self.assertEqual(events[1]["args"], {"value": '1'})
+        self.assertLessEqual(events[2]["ts"], events[1]["ts"])      # The span contains the instant
+        self.assertEqual(events[0]["id"], events[3]["id"])
+        self.assertNotEqual(events[0]["tid"], events[3]["tid"])
+
+    def test_empty_trace_file_is_valid(self):
+        path = os.path.join(self.directory, 'trace.json')
+        enableTracing(path)
+        disableTracing()
+
+        self.assertEqual(self.load(path), [])
+
+    def test_unclosed_trace_files_are_merged(self):
+        closedPath = os.path.join(self.directory, 'closed.json')
+        tracer = Tracer(closedPath)
+        self.recordEvents(tracer)
+        tracer.close()
+
+        unclosedPath = os.path.join(self.directory, 'unclosed.json')
+        tracer = Tracer(unclosedPath)       # A process killed after flushing, before closing
+        self.addCleanup(tracer.close)
+        self.recordEvents(tracer)
+        tracer.flush()
+
+        mergedPath = os.path.join(self.directory, 'merged.json')
+        mergeTraceFiles([closedPath, unclosedPath], mergedPath)
+        events = self.load(mergedPath)
+        self.assertEqual(len(events), 8)
+        self.assertValidEvents(events)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from internal.wire_format import Encoding, PackedEncoder, PackedDecoder, getEncoding
+
+def notification(message, customPayload=None, level='info'):
+    return { "timeSeconds": 12.5, "level": level, "message": message, "customPayload": customPayload }
+
+class PackedEncodingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = PackedEncoder()
+        self.decoder = PackedDecoder()
+
+    def roundTrip(self, item):
+        definitions, frame = self.encoder.encode(item)
+        for definition in definitions:
+            self.assertIsNone(self.decoder.decode(definition))
+        return definitions, self.decoder.decode(frame)
+
+    def test_notifications_round_trip(self):
+        items = [
+            notification('Started'),
+            notification('IO', { "isInput": True, "device": 1, "pin": 2, "value": 1 }, 'io_state'),
+            notification('List', [1, 2, 3]),
+            notification('Keys', { "a": 1, "b": [2] }),
+            notification('Custom level', { "a": 1 }, 'custom')
+        ]
+        for _ in range(3):      # Sent inline, then interned, then by id
+            for item in items:
+                _, decoded = self.roundTrip(item)
+                self.assertEqual(decoded, item)
+
+    def test_messages_are_interned_once_they_repeat(self):
+        definitions, _ = self.roundTrip(notification('Sheet cut'))
+        self.assertEqual(definitions, [])
+
+        definitions, _ = self.roundTrip(notification('Sheet cut'))
+        self.assertEqual(len(definitions), 1)
+
+        definitions, _ = self.roundTrip(notification('Sheet cut'))
+        self.assertEqual(definitions, [])
+
+    def test_unique_messages_do_not_fill_the_tables(self):
+        for i in range(PackedEncoder.MAX_DEFINITIONS + 10):
+            self.roundTrip(notification('Order {} complete'.format(i)))
+
+        self.assertIsNone(self.encoder.getDefinitionsFrame())
+        self.roundTrip(notification('Sheet cut'))
+        definitions, decoded = self.roundTrip(notification('Sheet cut'))
+        self.assertEqual(len(definitions), 1)
+        self.assertEqual(decoded["message"], 'Sheet cut')
+
+    def test_definitions_frame_lets_a_new_client_decode(self):
+        item = notification('IO', { "value": 1 })
+        self.roundTrip(item)
+        self.roundTrip(item)
+        _, frame = self.encoder.encode(item)
+
+        decoder = PackedDecoder()
+        self.assertIsNone(decoder.decode(self.encoder.getDefinitionsFrame()))
+        self.assertEqual(decoder.decode(frame), item)
+
+    def test_packed_frames_are_smaller_once_interned(self):
+        item = notification('IO state changed', { "isInput": True, "device": 1, "pin": 2, "value": 1 })
+        _, inlineFrame = self.encoder.encode(item)
+        self.encoder.encode(item)
+        _, internedFrame = self.encoder.encode(item)
+
+        self.assertLess(len(internedFrame), len(inlineFrame))
+
+class EncodingTest(unittest.TestCase):
+
+    def test_encoding_is_read_from_the_path(self):
+        self.assertEqual(getEncoding('/?encoding=packed'), Encoding.PACKED)
+        self.assertEqual(getEncoding('/?encoding=other'), Encoding.JSON)
+        self.assertEqual(getEncoding('/'), Encoding.JSON)
+        self.assertEqual(getEncoding(None), Encoding.JSON)
+
+if __name__ == '__main__':
+    unittest.main()